@@ -0,0 +1,226 @@
+# amap_client.py (共享的高德HTTP客户端 - 连接池 / 超时 / 重试 / 全局QPS限流)
+
+import asyncio
+import random
+import threading
+import time
+import weakref
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (AMAP_API_KEY, AMAP_BASE_URL, AMAP_QPS, AMAP_TIMEOUT, AMAP_MAX_RETRIES,
+                    AMAP_POOL_SIZE, ROUTE_PREFETCH_RESERVE_TOKENS)
+from api_recorder import api_recorder, request_key
+from single_flight import SingleFlight
+from tracing import annotate
+
+# 高德返回 status != '1' 时，以下 infocode 属于临时性错误(访问过于频繁/QPS超限/网关超时/服务繁忙)，值得重试
+RETRYABLE_INFOCODES = {'10004', '10014', '10015', '10016', '10019', '10020', '10021'}
+# 退避时间: 第n次重试在 [0, min(上限, 基数*2^n)] 之间随机取值 (full jitter)
+_BACKOFF_BASE = 0.25
+_BACKOFF_CAP = 4.0
+
+
+class AmapQuotaBusy(RuntimeError):
+    """后台(低优先级)请求没有拿到空闲令牌: 配额正被前台请求使用，稍后再试。"""
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶限流器，整个进程共享一个实例，保证所有会话加起来也不超过高德Key的QPS配额。
+    `reserve()` 预定一个令牌并返回需要等待的秒数(令牌可以“透支”，等待时间随排队长度线性增长)。
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def try_acquire(self, reserve: float = 0) -> bool:
+        """只在当前有空闲令牌(并且取走后仍至少剩 reserve 个)时才取走一个，不排队。"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1 + reserve:
+                self._tokens -= 1
+                return True
+            return False
+
+    def set_rate(self, rate: float):
+        """调整速率，例如批量规划把一个Key的配额平分给多个worker进程(每个进程各有一个令牌桶)。"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.capacity = max(1.0, rate)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+amap_limiter = TokenBucket(AMAP_QPS)
+
+# 复用TCP/TLS连接的会话，所有地图工具共享
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=AMAP_POOL_SIZE))
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=AMAP_POOL_SIZE))
+
+# 异步客户端绑定在创建它的事件循环上，因此每个事件循环各持有一个(随循环一起回收)
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+# 相同的请求(接口 + 参数)同时只向高德发一次，同步和异步调用之间也会合并
+amap_flight = SingleFlight("amap")
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "retries": 0, "failures": 0}
+# 计数同时记到当前工具调用的追踪 span 上
+_TRACE_FIELDS = {"requests": "amap_requests", "retries": "retries", "failures": "amap_failures"}
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+    annotate(**{_TRACE_FIELDS[name]: 1})
+
+
+def client_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats, coalesced=amap_flight.stats()["coalesced"])
+
+
+def _backoff(attempt: int):
+    time.sleep(random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt)))
+
+
+def amap_get(path: str, params: Dict[str, Any], background: bool = False) -> Dict[str, Any]:
+    """
+    以GET方式请求高德Web服务 `{AMAP_BASE_URL}{path}`。同一时刻相同的请求只发一次，同时到达的调用者共享应答；
+    后台请求只跟随已有的请求，自己发起的请求不让前台等待(它随时可能因为让出配额而放弃)。
+    """
+    key = request_key("amap", path, params)
+    if background:
+        return amap_flight.follow(key, _amap_get, path, params, True)
+    return amap_flight.do(key, _amap_get, path, params)
+
+
+def _amap_get(path: str, params: Dict[str, Any], background: bool = False) -> Dict[str, Any]:
+    """
+    以GET方式请求高德Web服务 `{AMAP_BASE_URL}{path}`，自动带上Key。
+    - 每次请求(包括重试)都先从全局令牌桶取令牌；background=True 的低优先级请求(例如路线预取)从不排队，
+      令牌桶里没有富余(至少保留 ROUTE_PREFETCH_RESERVE_TOKENS 个给前台)时抛出 AmapQuotaBusy；
+    - 连接错误、超时、5xx 以及可重试的 infocode 会按抖动退避重试 AMAP_MAX_RETRIES 次；
+    - 返回解析后的JSON(可能是 status != '1' 的业务错误，交给调用方判断)；网络层失败在重试耗尽后抛出异常。
+    - API_TRANSPORT_MODE=replay 时直接从录制库返回，不访问网络；record 时把最终应答写入录制库。
+    """
+    if api_recorder.replaying:
+        annotate(replayed=1)
+        return api_recorder.replay("amap", path, params)
+    started = time.perf_counter()
+    url = f"{AMAP_BASE_URL}{path}"
+    query = {'key': AMAP_API_KEY, **params}
+    last_error: Optional[Exception] = None
+    data: Optional[Dict[str, Any]] = None
+    for attempt in range(AMAP_MAX_RETRIES + 1):
+        if attempt:
+            _count("retries")
+            _backoff(attempt)
+        if not background:
+            amap_limiter.acquire()
+        elif not amap_limiter.try_acquire(ROUTE_PREFETCH_RESERVE_TOKENS):
+            raise AmapQuotaBusy("高德配额正被前台请求使用")
+        _count("requests")
+        try:
+            response = _session.get(url, params=query, timeout=AMAP_TIMEOUT)
+            if response.status_code >= 500:
+                last_error = requests.HTTPError(f"高德服务端错误 {response.status_code}", response=response)
+                continue
+            response.raise_for_status()
+            annotate(amap_bytes=len(response.content))
+            data = response.json()
+        except (requests.ConnectionError, requests.Timeout) as e:
+            last_error = e
+            continue
+        if data.get('status') != '1' and str(data.get('infocode')) in RETRYABLE_INFOCODES:
+            print(f"--- ⏳ [amap_client] 高德临时错误 {data.get('infocode')} ({data.get('info')})，准备重试 ---")
+            continue
+        if api_recorder.recording:
+            api_recorder.record("amap", path, params, data, elapsed_ms=(time.perf_counter() - started) * 1000)
+        return data
+
+    _count("failures")
+    if data is not None:
+        return data
+    raise last_error
+
+
+def _async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        limits = httpx.Limits(max_connections=AMAP_POOL_SIZE, max_keepalive_connections=AMAP_POOL_SIZE)
+        client = httpx.AsyncClient(timeout=AMAP_TIMEOUT, limits=limits)
+        _async_clients[loop] = client
+    return client
+
+
+async def amap_get_async(path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """amap_get 的异步版本(httpx)，与同步版本共享同一个令牌桶、重试策略、统计计数、录制/回放和请求合并。"""
+    return await amap_flight.ado(request_key("amap", path, params), _amap_get_async, path, params)
+
+
+async def _amap_get_async(path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    if api_recorder.replaying:
+        annotate(replayed=1)
+        return await api_recorder.areplay("amap", path, params)
+    started = time.perf_counter()
+    url = f"{AMAP_BASE_URL}{path}"
+    query = {'key': AMAP_API_KEY, **params}
+    last_error: Optional[Exception] = None
+    data: Optional[Dict[str, Any]] = None
+    for attempt in range(AMAP_MAX_RETRIES + 1):
+        if attempt:
+            _count("retries")
+            await asyncio.sleep(random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt)))
+        wait = amap_limiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        _count("requests")
+        try:
+            response = await _async_client().get(url, params=query)
+            if response.status_code >= 500:
+                last_error = httpx.HTTPStatusError(f"高德服务端错误 {response.status_code}",
+                                                   request=response.request, response=response)
+                continue
+            response.raise_for_status()
+            annotate(amap_bytes=len(response.content))
+            data = response.json()
+        except httpx.TransportError as e:
+            last_error = e
+            continue
+        if data.get('status') != '1' and str(data.get('infocode')) in RETRYABLE_INFOCODES:
+            print(f"--- ⏳ [amap_client] 高德临时错误 {data.get('infocode')} ({data.get('info')})，准备重试 ---")
+            continue
+        if api_recorder.recording:
+            api_recorder.record("amap", path, params, data, elapsed_ms=(time.perf_counter() - started) * 1000)
+        return data
+
+    _count("failures")
+    if data is not None:
+        return data
+    raise last_error
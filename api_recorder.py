@@ -0,0 +1,134 @@
+# api_recorder.py (外部API的录制/回放层 - 高德与Tavily的请求应答按规范化的请求键存入本地SQLite)
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import API_TRANSPORT_MODE, API_RECORD_PATH, API_REPLAY_LATENCY
+
+TRANSPORT_MODES = ("live", "record", "replay")
+
+
+class ReplayMissError(LookupError):
+    """回放模式下录制库里没有这个请求。回放模式从不访问网络，因此直接报错。"""
+
+
+def request_key(service: str, endpoint: str, params: Dict[str, Any]) -> str:
+    """请求的规范化键: 服务名 + 接口 + 排序后的参数(去掉Key等凭据)，取哈希。"""
+    canonical = json.dumps({k: str(v) for k, v in params.items() if k not in ("key", "api_key")},
+                           sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(f"{service}|{endpoint}|{canonical}".encode(), digest_size=16).hexdigest()
+
+
+class ApiRecorder:
+    """
+    录制库: 一张以 (service, key) 为主键的 WITHOUT ROWID 表，应答体是 zlib 压缩后的JSON。
+    回放时先查内存中的LRU，未命中再按主键读库，单次查找在微秒级。
+    """
+
+    def __init__(self, path: str = API_RECORD_PATH, mode: str = API_TRANSPORT_MODE, memory_entries: int = 20000,
+                 replay_latency: bool = API_REPLAY_LATENCY):
+        if mode not in TRANSPORT_MODES:
+            raise ValueError(f"API_TRANSPORT_MODE 必须是 {TRANSPORT_MODES} 之一，实际为 {mode!r}")
+        self.path = path
+        self.mode = mode
+        # 为 True 时回放还原录制时的耗时，用于复现线上的慢会话；默认立即返回
+        self.replay_latency = replay_latency
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._stats = {"recorded": 0, "replayed": 0, "misses": 0}
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS recordings (service TEXT NOT NULL, key TEXT NOT NULL, "
+                               "endpoint TEXT NOT NULL, request TEXT NOT NULL, response BLOB NOT NULL, "
+                               "elapsed_ms REAL, recorded_at REAL NOT NULL, PRIMARY KEY (service, key)) WITHOUT ROWID")
+        return self._conn
+
+    def record(self, service: str, endpoint: str, params: Dict[str, Any], response: Any, elapsed_ms: float = None):
+        key = request_key(service, endpoint, params)
+        request = json.dumps({k: v for k, v in params.items() if k not in ("key", "api_key")}, ensure_ascii=False)
+        blob = zlib.compress(json.dumps(response, ensure_ascii=False, separators=(',', ':')).encode(), 6)
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (service, key, endpoint, request, blob, elapsed_ms, time.time()))
+            self._remember((service, key), (response, elapsed_ms))
+            self._stats["recorded"] += 1
+
+    def lookup(self, service: str, endpoint: str, params: Dict[str, Any]) -> Tuple[Any, float]:
+        """返回 (录制的应答, 回放前应等待的秒数)；没有录制时抛出 ReplayMissError。应答对象被缓存共享，调用方不要修改。"""
+        key = request_key(service, endpoint, params)
+        with self._lock:
+            entry = self._memory.get((service, key))
+            if entry is not None:
+                self._memory.move_to_end((service, key))
+            else:
+                row = self._connection().execute(
+                    "SELECT response, elapsed_ms FROM recordings WHERE service = ? AND key = ?",
+                    (service, key)).fetchone()
+                if row is None:
+                    self._stats["misses"] += 1
+                    raise ReplayMissError(f"录制库中没有 {service} {endpoint} {params}")
+                entry = (json.loads(zlib.decompress(row[0])), row[1])
+                self._remember((service, key), entry)
+            self._stats["replayed"] += 1
+        response, elapsed_ms = entry
+        return response, ((elapsed_ms or 0) / 1000 if self.replay_latency else 0.0)
+
+    def replay(self, service: str, endpoint: str, params: Dict[str, Any]) -> Any:
+        response, delay = self.lookup(service, endpoint, params)
+        if delay:
+            time.sleep(delay)
+        return response
+
+    async def areplay(self, service: str, endpoint: str, params: Dict[str, Any]) -> Any:
+        response, delay = self.lookup(service, endpoint, params)
+        if delay:
+            await asyncio.sleep(delay)
+        return response
+
+    def _remember(self, key: tuple, entry: Tuple[Any, Optional[float]]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, mode=self.mode)
+            if self._conn is not None or self.replaying:
+                rows = self._connection().execute(
+                    "SELECT service, COUNT(*), SUM(LENGTH(response)) FROM recordings GROUP BY service").fetchall()
+                stats["stored"] = {service: {"entries": count, "bytes": size} for service, count, size in rows}
+            return stats
+
+
+# 进程内共享的录制器，模式由 API_TRANSPORT_MODE 决定(live 时不会打开数据库)
+api_recorder = ApiRecorder()
+
+
+if __name__ == '__main__':
+    # 用法: API_TRANSPORT_MODE=replay python api_recorder.py  -> 查看录制库中各服务的条目数和体积
+    print(json.dumps(ApiRecorder(mode="replay").stats(), ensure_ascii=False, indent=2))
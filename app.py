@@ -1,11 +1,17 @@
 # app.py (最终流式处理版 - 解决KeyError: 'warnings'崩溃问题)
 
+import uuid
+
 import streamlit as st
 from langchain_core.messages import HumanMessage, AIMessage
+from async_runtime import iterate
+from config import PLANNING_SERVICE_URL
+from session_context import use_session
+from history_manager import compact_history
+from planning_client import PlanningServiceError, agent_events, stream_turn
+from trip_spec import TripSpec, find_trip_spec
+from tracing import TurnTracer
 
-# 您的Agent创建函数
-from explorer_agent_core import create_explorer_agent
-from route_agent_core import create_route_agent
 
 # --- 页面基础设置 ---
 st.set_page_config(page_title="路路通智能旅行社", page_icon="🌏", layout="wide")
@@ -13,10 +19,76 @@ st.title("🌏 路路通智能旅行社")
 st.caption("您的AI旅行探索与规划伙伴")
 
 # --- Agent和状态初始化 ---
-if "planner_agent" not in st.session_state:
-    st.session_state.planner_agent = create_route_agent()
-if "explorer_agent" not in st.session_state:
-    st.session_state.explorer_agent = create_explorer_agent()
+# Agent执行器(模型客户端、提示词、工具)本身不保存对话状态，整个进程只创建一份，所有会话共享；
+# 每个会话只保存自己的聊天历史。Agent模块在第一次真正对话时才导入，新访客可以更快看到页面。
+@st.cache_resource(show_spinner="正在唤醒规划师...")
+def get_planner_agent():
+    from route_agent_core import create_route_agent
+    return create_route_agent()
+
+
+@st.cache_resource(show_spinner="正在唤醒探索家...")
+def get_explorer_agent():
+    from explorer_agent_core import create_explorer_agent
+    return create_explorer_agent()
+
+
+AGENT_FACTORIES = {"planner": get_planner_agent, "explorer": get_explorer_agent}
+
+# 每个浏览器会话一个ID，工具用它隔离按会话保存的数据(例如路线几何)
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+# 探索家交接给规划师的结构化行程信息(TripSpec)，坐标已核实
+if "trip_spec" not in st.session_state:
+    st.session_state.trip_spec = None
+
+
+def accept_trip_spec(spec):
+    """保存交接信息，并把其中已核实的坐标写入地点缓存，规划师即使再次查询也不会请求高德。"""
+    st.session_state.trip_spec = spec
+    if PLANNING_SERVICE_URL:
+        # 使用规划服务时由服务进程写入它自己的缓存
+        return
+    from map_tools import remember_place
+    from route_prefetcher import route_prefetcher
+    for place in spec.places():
+        remember_place(place.name, spec.city, place.location)
+    # 用户切换到规划师之前，后台先把大概率用到的交通段查好
+    route_prefetcher.observe_trip_spec(spec, session_id=st.session_state.session_id)
+
+
+def local_events(agent_key, agent_input, history):
+    """在本进程中执行一轮对话，产出与规划服务相同的事件。"""
+    # 【关键】使用 agent.astream_events() 并在后台事件循环中运行:
+    # 模型的输出逐个token推送到界面，工具的开始/结束事件按发生顺序穿插其中；
+    # 模型在同一步里发起的多个工具调用(例如一次查询8个地点)会被并发执行，而不是逐个排队。
+    # 在当前会话的上下文中启动，工具据此隔离按会话保存的数据
+    # 每轮对话一个追踪器，记录每次模型调用和工具调用的耗时
+    tracer = TurnTracer(session_id=st.session_state.session_id, agent=agent_key)
+    with use_session(st.session_state.session_id):
+        stream = iterate(agent_events(AGENT_FACTORIES[agent_key](), {
+            **agent_input,
+            # 界面上保留完整历史，传给模型的是按token预算压缩后的副本
+            "chat_history": compact_history(history)
+        }, config={"callbacks": [tracer]}))
+    for event in stream:
+        if event["event"] != "done":
+            yield event
+            continue
+        final_response = event["output"]
+        spec = find_trip_spec(final_response) if agent_key == "explorer" and final_response else None
+        yield dict(event, trace=tracer.finish(), trip_spec=spec.to_dict() if spec is not None else None)
+
+
+def remote_events(agent_key, prompt, history):
+    """把一轮对话交给规划服务执行(历史的压缩也在服务端完成)，界面线程只负责渲染事件。"""
+    spec = st.session_state.trip_spec
+    try:
+        yield from stream_turn(agent_key, prompt, history, st.session_state.session_id,
+                               trip_spec=spec.to_dict() if agent_key == "planner" and spec is not None else None)
+    except PlanningServiceError as e:
+        hint = f"，请约 {e.retry_after:.0f} 秒后重试" if e.retry_after else ""
+        yield {"event": "error", "message": f"{e}{hint}"}
 
 # 初始化聊天历史
 if "explorer_messages" not in st.session_state:
@@ -37,6 +109,35 @@ with st.sidebar:
         "1. 先和“**探索家**”聊聊，找到心仪的目的地。\n\n"
         "2. 然后切换到“**规划师**”，开始详细规划。"
     )
+    # 耗时明细面板: 每轮对话结束后刷新
+    trace_panel = st.empty()
+    if st.session_state.trip_spec is not None:
+        spec = st.session_state.trip_spec
+        st.success(f"✅ 已收到探索家整理的行程: {spec.city} {spec.days}天，"
+                   f"{len(spec.places())} 个已核实坐标的地点，规划师会直接使用。")
+
+
+
+def render_trace(panel, summary):
+    """在侧边栏展示一轮对话的耗时拆分: 模型调用与各个工具分别花了多少时间。"""
+    if not summary:
+        return
+    with panel.container():
+        st.subheader("⏱️ 上一轮耗时")
+        llm = summary["llm"]
+        first_token = summary.get("first_token_ms")
+        first_token = f" · 首字 {first_token / 1000:.1f}s" if first_token is not None else ""
+        st.caption(f"总计 {summary['wall_ms'] / 1000:.1f}s{first_token} · 模型 {llm['calls']} 次 {llm['wall_ms'] / 1000:.1f}s "
+                   f"(输入 {llm['input_tokens']} / 输出 {llm['output_tokens']} tokens) · 工具 {summary['tool_calls']} 次")
+        rows = [{"工具": name, "次数": t["calls"], "合计(s)": round(t["wall_ms"] / 1000, 2),
+                 "最慢(s)": round(t["max_ms"] / 1000, 2), "缓存命中": t["cache_hits"],
+                 "高德请求": t["amap_requests"], "合并请求": t.get("coalesced", 0), "重试": t["retries"]}
+                for name, t in sorted(summary["tools"].items(), key=lambda item: -item[1]["wall_ms"])]
+        if rows:
+            st.dataframe(rows, hide_index=True, use_container_width=True)
+
+
+render_trace(trace_panel, st.session_state.get("last_trace"))
 
 # --- 主界面 ---
 if "探索家" in agent_choice:
@@ -63,42 +164,49 @@ if prompt := st.chat_input("请输入您的想法..."):
     history_to_update.append(HumanMessage(content=prompt))
     st.chat_message("user", avatar="😊").write(prompt)
 
-    agent_to_call = st.session_state[f"{current_agent_key}_agent"]
+    agent_input = {"input": prompt}
+    if current_agent_key == "planner":
+        # 用户把探索家的摘要粘贴过来时同样识别；否则沿用之前交接的信息
+        pasted_spec = find_trip_spec(prompt)
+        if pasted_spec is not None:
+            accept_trip_spec(pasted_spec)
+        if st.session_state.trip_spec is not None:
+            agent_input["trip_spec"] = st.session_state.trip_spec.to_prompt()
 
     with st.chat_message("ai", avatar=avatar):
         # 使用 st.write_stream 来优雅地处理流式输出
         def stream_generator():
-            final_response = ""
-            # 【关键】使用 agent.stream() 而不是 agent.invoke()
-            stream = agent_to_call.stream({
-                "input": prompt,
-                "chat_history": history_to_update
-            })
-
-            # 遍历流中的每一个数据块
-            for chunk in stream:
-                # 从多种可能的结构中安全地提取文本内容
-                content_to_yield = ""
-                if "actions" in chunk:
-                    for action in chunk["actions"]:
-                        content_to_yield += f"🧠 **思考**: 决定调用工具 `{action.tool}`...\n\n"
-                if "steps" in chunk:
-                    for step in chunk["steps"]:
-                        if hasattr(step, 'observation'):
-                            content_to_yield += f"🛠️ **工具结果**: {str(step.observation)[:300]}...\n\n"
-                if "messages" in chunk:
-                    for message in chunk["messages"]:
-                        content = message.content
-                        if content:
-                            final_response += content
-                            content_to_yield += content
-
-                if content_to_yield:
-                    yield content_to_yield
-
-            # 流程结束后，更新聊天历史
-            if final_response:
-                history_to_update.append(AIMessage(content=final_response))
+            # 配置了规划服务时本进程只是瘦客户端；否则在后台事件循环中直接执行Agent
+            if PLANNING_SERVICE_URL:
+                events = remote_events(current_agent_key, prompt, history_to_update)
+            else:
+                events = local_events(current_agent_key, agent_input, history_to_update)
+
+            in_text = False  # 上一段输出是模型的文字时，工具事件另起一段
+            for event in events:
+                kind = event["event"]
+                if kind in ("action", "observation") and in_text:
+                    yield "\n\n"
+                in_text = kind in ("token", "message")
+                if kind == "queued" and event.get("position", 0) > 1:
+                    yield f"⏳ 排队中，前面还有 {event['position'] - 1} 个请求...\n\n"
+                elif kind == "action":
+                    yield f"🧠 **思考**: 决定调用工具 `{event['tool']}`...\n\n"
+                elif kind == "observation":
+                    yield f"🛠️ **工具结果**: {event['content']}...\n\n"
+                elif in_text:
+                    yield event["content"]
+                elif kind == "error":
+                    yield f"⚠️ {event['message']}"
+                elif kind == "done":
+                    # 流程结束后，记录耗时并更新聊天历史
+                    st.session_state.last_trace = event.get("trace")
+                    render_trace(trace_panel, st.session_state.last_trace)
+                    if event["output"]:
+                        history_to_update.append(AIMessage(content=event["output"]))
+                    # 探索家给出最终摘要时，直接解析为结构化数据交给规划师，无需再逐个核实坐标
+                    if event.get("trip_spec"):
+                        accept_trip_spec(TripSpec.from_dict(event["trip_spec"]))
 
 
         # 执行并渲染流
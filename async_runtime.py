@@ -0,0 +1,91 @@
+# async_runtime.py (进程级的后台事件循环 - 让同步的Streamlit脚本驱动异步Agent)
+
+import asyncio
+import concurrent.futures
+import contextvars
+import queue
+import threading
+from typing import AsyncIterator, Callable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_loop = None
+_loop_lock = threading.Lock()
+_DONE = object()
+# CPU密集的计算(例如行程优化)可以交给进程池；未设置时在调用线程中直接执行
+_cpu_executor: Optional[concurrent.futures.Executor] = None
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """返回整个进程共享的后台事件循环(首次调用时在守护线程中启动)。"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-runtime", daemon=True).start()
+        return _loop
+
+
+def _submit(coro) -> concurrent.futures.Future:
+    """在后台事件循环中运行协程，并沿用调用方线程的 contextvars(例如会话ID)。"""
+    return asyncio.run_coroutine_threadsafe(_in_context(coro, contextvars.copy_context()), get_loop())
+
+
+async def _in_context(coro, context: contextvars.Context):
+    task = context.run(asyncio.ensure_future, coro)
+    return await task
+
+
+def run(coro, timeout: float = None):
+    """同步地等待一个协程在后台事件循环中执行完毕，并返回其结果。"""
+    return _submit(coro).result(timeout)
+
+
+def iterate(async_iterable: AsyncIterator[T]) -> Iterator[T]:
+    """
+    立即在后台事件循环中开始消费一个异步迭代器(此刻的 contextvars 会被带过去)，
+    并返回一个同步生成器逐个产出元素。调用方提前停止迭代(例如Streamlit页面被刷新)时，会取消后台任务。
+    """
+    items: "queue.Queue" = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in async_iterable:
+                items.put((True, item))
+        except BaseException as e:
+            items.put((False, e))
+            raise
+        items.put((False, _DONE))
+
+    return _drain(items, _submit(pump()))
+
+
+def _drain(items: "queue.Queue", future: concurrent.futures.Future) -> Iterator:
+    try:
+        while True:
+            ok, item = items.get()
+            if ok:
+                yield item
+            elif item is _DONE:
+                return
+            else:
+                raise item
+    finally:
+        if not future.done():
+            future.cancel()
+
+
+def set_cpu_executor(executor: Optional[concurrent.futures.Executor]):
+    """设置进程内共享的CPU密集计算执行器(规划服务启动时传入进程池)，传 None 恢复为直接执行。"""
+    global _cpu_executor
+    _cpu_executor = executor
+
+
+def run_cpu_bound(fn: Callable[..., T], *args, **kwargs) -> T:
+    """
+    执行一个CPU密集的纯函数: 设置了进程池时交给子进程，不占用事件循环和I/O线程的GIL；否则直接调用。
+    参数和返回值需要能被 pickle，函数内对参数的修改不会反映到调用方。
+    """
+    if _cpu_executor is None:
+        return fn(*args, **kwargs)
+    return _cpu_executor.submit(fn, *args, **kwargs).result()
@@ -0,0 +1,243 @@
+# batch_plan.py (离线批量规划 - 从JSONL读取行程信息，进程池/线程池并发运行规划师，结果完成一条写一条，可断点续跑)
+#
+# 用法: python batch_plan.py trips.jsonl -o itineraries.jsonl [--workers 4] [--pool process|thread] [--map-dir batch_maps]
+#   输入每行一个行程，格式与探索家交接给规划师的信息相同(坐标已核实)，另外可以带 id 和额外要求 request:
+#   {"id": "dalian-3d", "city": "大连", "days": 3, "hotel": {"name": "...", "location": "经度,纬度"},
+#    "arrival": {"station": {...}, "time": "2025-08-01 09:40"}, "departure": {...},
+#    "spots": [...], "restaurants": [...], "night_activities": [...], "request": "可选"}
+#   输出每行一个结果: {"id", "status": "ok"/"error", "markdown", "map", "unscheduled", "wall_s", ...}
+#   中途崩溃后用同样的命令重新运行: 输出文件中已经成功的行程会被跳过，失败的行程重新规划。
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from config import AMAP_QPS, BATCH_WORKERS, BATCH_POOL, BATCH_MAP_DIR
+
+DEFAULT_REQUEST = "行程信息已经全部确认，无需再向我提问。请直接为我规划{city}{days}日行程，并输出完整的行程单。"
+
+_agent_factory: Optional[Callable[[], Any]] = None
+_agent = None
+_agent_lock = threading.Lock()
+
+
+def trip_id(record: Dict[str, Any]) -> str:
+    """输入里没有 id 时按内容生成，同一个行程重新运行时得到相同的 id。"""
+    if record.get("id"):
+        return str(record["id"])
+    return hashlib.sha1(json.dumps(record, ensure_ascii=False, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def load_trips(path: str) -> Tuple[List[Tuple[str, Dict[str, Any]]], int]:
+    """读取输入文件，返回 ([(行程id, 行程)], 无法解析的行数)；重复的 id 只保留第一个。"""
+    trips, invalid, seen = [], 0, set()
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("每行需要是一个JSON对象")
+            except ValueError as e:
+                print(f"--- ⚠️ [batch_plan] 第{number}行无法解析，已跳过: {e} ---")
+                invalid += 1
+                continue
+            key = trip_id(record)
+            if key in seen:
+                print(f"--- ⚠️ [batch_plan] 第{number}行的 id {key!r} 重复，已跳过 ---")
+                continue
+            seen.add(key)
+            trips.append((key, record))
+    return trips, invalid
+
+
+def completed_ids(path: str) -> Set[str]:
+    """输出文件中已经成功的行程；崩溃时写了一半的最后一行解析失败，会被忽略。"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(result, dict) and result.get("status") == "ok":
+                done.add(str(result.get("id")))
+    return done
+
+
+def _missing_newline(path: str) -> bool:
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+def _init_worker(amap_share: float, agent_factory: Optional[Callable[[], Any]]):
+    """
+    每个worker进程(线程池时是主进程)启动时调用一次。每个进程各有一个高德令牌桶，多进程时把Key的QPS配额平分，
+    所有进程加起来仍不超过配额；磁盘缓存(地点、路线)本来就是所有进程共享的。
+    """
+    global _agent_factory
+    from amap_client import amap_limiter
+    from route_prefetcher import route_prefetcher
+    amap_limiter.set_rate(AMAP_QPS * amap_share)
+    # 批量规划时规划师自己马上就会查询所有交通段，后台预取只会与它抢配额
+    route_prefetcher.enabled = False
+    _agent_factory = agent_factory
+
+
+def _planner():
+    """Agent执行器本身不保存对话状态，一个进程里的所有线程共享一份。"""
+    global _agent
+    with _agent_lock:
+        if _agent is None:
+            if _agent_factory is not None:
+                _agent = _agent_factory()
+            else:
+                from route_agent_core import create_route_agent
+                _agent = create_route_agent()
+        return _agent
+
+
+def _save_map(itinerary, key: str, session_id: str, map_dir: str) -> Optional[str]:
+    from map_renderer import render_trip_map_html
+    html, _ = render_trip_map_html(itinerary.map_days(), session_id)
+    if html is None:
+        return None
+    os.makedirs(map_dir, exist_ok=True)
+    path = os.path.join(map_dir, f"{re.sub(r'[^0-9A-Za-z_-]', '_', key)}.html")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(html)
+    os.replace(tmp_path, path)
+    return path
+
+
+def plan_trip(key: str, record: Dict[str, Any], map_dir: str = BATCH_MAP_DIR) -> Dict[str, Any]:
+    """在worker中规划一个行程，返回写入输出文件的结果(出错时 status 为 error，不抛出异常)。"""
+    import async_runtime
+    from geometry_store import geometry_store
+    from itinerary_model import itinerary_store
+    from map_tools import remember_place
+    from session_context import use_session
+    from tracing import TurnTracer
+    from trip_spec import TripSpec, TripSpecError
+
+    started = time.perf_counter()
+    result: Dict[str, Any] = {"id": key, "status": "error"}
+    try:
+        spec = TripSpec.from_dict(record)
+    except TripSpecError as e:
+        return dict(result, error=f"行程信息不正确: {e}")
+    result.update(city=spec.city, days=spec.days)
+
+    # 每个行程一个独立的会话，行程状态和路线几何互不干扰，结束后立即释放
+    session_id = f"batch-{key}"
+    tracer = TurnTracer(session_id=session_id, agent="batch")
+    with use_session(session_id):
+        try:
+            for place in spec.places():
+                remember_place(place.name, spec.city, place.location)
+            inputs = {"input": record.get("request") or DEFAULT_REQUEST.format(city=spec.city, days=spec.days),
+                      "chat_history": [], "trip_spec": spec.to_prompt()}
+            output = async_runtime.run(_planner().ainvoke(inputs, config={"callbacks": [tracer]}))["output"]
+            result["markdown"] = output
+            itinerary = itinerary_store.get()
+            if itinerary is None:
+                result["error"] = "规划师没有生成行程(可能是在向用户提问)，回复见 markdown"
+            else:
+                with itinerary.lock:
+                    plan = itinerary.plan()
+                    result.update(status="ok", map=_save_map(itinerary, key, session_id, map_dir),
+                                  unscheduled=plan["unscheduled"], total_travel_minutes=plan["total_travel_minutes"])
+        except Exception as e:
+            result["error"] = f"规划出错: {e}"
+        finally:
+            itinerary_store.drop_session(session_id)
+            geometry_store.drop_session(session_id)
+    summary = tracer.finish()
+    result.update(wall_s=round(time.perf_counter() - started, 2), llm_calls=summary["llm"]["calls"],
+                  tool_calls=summary["tool_calls"],
+                  amap_requests=sum(tool["amap_requests"] for tool in summary["tools"].values()))
+    return result
+
+
+def run_batch(input_path: str, output_path: str, workers: int = BATCH_WORKERS, pool: str = BATCH_POOL,
+              map_dir: str = BATCH_MAP_DIR, agent_factory: Optional[Callable[[], Any]] = None) -> Dict[str, int]:
+    """
+    规划输入文件中尚未成功的行程，每完成一个就追加一行到输出文件并落盘。
+    agent_factory 为创建规划师的函数(默认 create_route_agent)；多进程时它必须能被 pickle(模块级函数)。
+    """
+    trips, invalid = load_trips(input_path)
+    done = completed_ids(output_path)
+    pending = [(key, record) for key, record in trips if key not in done]
+    print(f"--- 🚀 [batch_plan] 共 {len(trips)} 个行程，{len(trips) - len(pending)} 个已完成，"
+          f"本次规划 {len(pending)} 个({pool} × {workers}) ---")
+
+    if pool == "process":
+        # spawn 而不是 fork: 父进程里可能已经有事件循环和线程
+        executor = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker,
+            initargs=(1 / workers, agent_factory))
+    else:
+        _init_worker(1.0, agent_factory)
+        executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="batch-plan")
+
+    stats = {"ok": 0, "error": 0, "skipped": len(trips) - len(pending), "invalid": invalid}
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    try:
+        partial_line = _missing_newline(output_path)
+        with open(output_path, "a", encoding="utf-8") as out:
+            if partial_line:
+                # 上次崩溃时最后一行只写了一半，新结果从新的一行开始
+                out.write("\n")
+            futures = {executor.submit(plan_trip, key, record, map_dir): key for key, record in pending}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # 例如worker进程崩溃(BrokenProcessPool)；下次运行会重新规划
+                    result = {"id": futures[future], "status": "error", "error": f"worker异常退出: {e}"}
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+                stats["ok" if result["status"] == "ok" else "error"] += 1
+                icon = "✅" if result["status"] == "ok" else "❌"
+                print(f"--- {icon} [batch_plan] {result['id']} ({stats['ok'] + stats['error']}/{len(pending)}): "
+                      f"{result.get('error') or result.get('map') or ''} ---")
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    wall = time.perf_counter() - started
+    rate = stats["ok"] / wall * 60 if wall > 0 else 0.0
+    print(f"--- 🏁 [batch_plan] 完成 {stats['ok']} 个，失败 {stats['error']} 个，用时 {wall:.1f}s "
+          f"({rate:.1f} 个/分钟) ---")
+    return dict(stats, wall_s=round(wall, 2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线批量规划行程")
+    parser.add_argument("input", help="行程信息的JSONL文件，每行一个行程")
+    parser.add_argument("-o", "--output", required=True, help="结果JSONL文件(追加写入；重新运行时跳过已成功的行程)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="并发规划的行程数")
+    parser.add_argument("--pool", choices=("process", "thread"), default=BATCH_POOL, help="进程池或线程池")
+    parser.add_argument("--map-dir", default=BATCH_MAP_DIR, help="行程地图(HTML)的输出目录")
+    args = parser.parse_args(argv)
+    stats = run_batch(args.input, args.output, args.workers, args.pool, args.map_dir)
+    return 1 if stats["error"] or stats["invalid"] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,181 @@
+# benchmarks/fake_amap.py (本地模拟的高德Web服务 - 地点输入提示 / 公交 / 步行 / 驾车)
+
+import hashlib
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# 各城市的大致中心点；未知城市落在大连附近
+CITY_CENTERS = {
+    "大连": (121.62, 38.92), "上海": (121.47, 31.23), "北京": (116.40, 39.90), "成都": (104.07, 30.57),
+    "杭州": (120.16, 30.27), "西安": (108.94, 34.34), "青岛": (120.38, 36.07),
+}
+_POINT_SPACING_M = 25  # 模拟的 polyline 每隔约25米一个点，与真实公交/驾车路线的密度相近
+_MAX_POINTS = 3000
+
+
+def place_location(name: str, city: str) -> Tuple[float, float]:
+    """按名称的哈希在城市中心附近(约±12公里)确定性地生成坐标。"""
+    lng0, lat0 = CITY_CENTERS.get(city, CITY_CENTERS["大连"])
+    digest = hashlib.md5(f"{city}|{name}".encode()).digest()
+    dx = int.from_bytes(digest[:4], "big") / 2 ** 32 - 0.5
+    dy = int.from_bytes(digest[4:8], "big") / 2 ** 32 - 0.5
+    return round(lng0 + dx * 0.28, 6), round(lat0 + dy * 0.22, 6)
+
+
+def _parse(location: str) -> Tuple[float, float]:
+    lng, lat = location.split(",")
+    return float(lng), float(lat)
+
+
+def _distance_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    dx = (b[0] - a[0]) * 111_320 * math.cos(math.radians((a[1] + b[1]) / 2))
+    dy = (b[1] - a[1]) * 111_320
+    return math.hypot(dx, dy)
+
+
+def _polyline(a: Tuple[float, float], b: Tuple[float, float], seed: int) -> str:
+    """两点之间带轻微弯曲的折线，点的密度和真实路线相近。"""
+    n = max(2, min(_MAX_POINTS, int(_distance_m(a, b) / _POINT_SPACING_M)))
+    wiggle = 0.002 * ((seed % 7) - 3) / 3
+    points = []
+    for i in range(n):
+        t = i / (n - 1)
+        bend = math.sin(math.pi * t) * wiggle + math.sin(t * 40 + seed) * 0.00005
+        points.append(f"{a[0] + (b[0] - a[0]) * t - bend:.6f},{a[1] + (b[1] - a[1]) * t + bend:.6f}")
+    return ";".join(points)
+
+
+def _midpoint(a, b):
+    return (a[0] + b[0]) / 2, (a[1] + b[1]) / 2
+
+
+def inputtips(query: Dict[str, str]) -> Dict:
+    name, city = query.get("keywords", ""), query.get("city", "")
+    if "不存在" in name:
+        return {"status": "1", "info": "OK", "infocode": "10000", "count": "0", "tips": []}
+    lng, lat = place_location(name, city)
+    tip = {"name": name, "district": f"{city}市", "address": f"{city}{name}附近", "location": f"{lng},{lat}"}
+    return {"status": "1", "info": "OK", "infocode": "10000", "count": "1", "tips": [tip]}
+
+
+def transit(query: Dict[str, str]) -> Dict:
+    a, b = _parse(query["origin"]), _parse(query["destination"])
+    distance = _distance_m(a, b) * 1.3
+    seed = int(hashlib.md5(f"{a}{b}".encode()).hexdigest()[:6], 16)
+    if distance < 300:
+        return {"status": "1", "info": "OK", "infocode": "10000", "route": {"transits": []}}
+    walk_to = _midpoint(a, (a[0] * 0.9 + b[0] * 0.1, a[1] * 0.9 + b[1] * 0.1))
+    segments = [
+        {"walking": {"distance": "400", "duration": "360", "polyline": _polyline(a, walk_to, seed)},
+         "bus": {"buslines": [{
+             "name": f"地铁{seed % 5 + 1}号线", "via_num": str(max(1, int(distance / 1200))),
+             "departure_stop": {"name": f"站点{seed % 97}"}, "arrival_stop": {"name": f"站点{(seed // 97) % 97}"},
+             "polyline": _polyline(walk_to, b, seed)}]}},
+        {"walking": {"distance": "250", "duration": "210", "polyline": ""}, "bus": {"buslines": []}},
+    ]
+    plan = {"duration": str(int(distance / 8.5) + 900), "distance": str(int(distance)), "cost": "3.0",
+            "segments": segments}
+    # 真实接口通常返回多个方案，应答体积也随之变大
+    return {"status": "1", "info": "OK", "infocode": "10000", "route": {"transits": [plan, plan, plan]}}
+
+
+def path_route(query: Dict[str, str], speed_mps: float, taxi: bool = False) -> Dict:
+    a, b = _parse(query["origin"]), _parse(query["destination"])
+    distance = _distance_m(a, b) * 1.25
+    seed = int(hashlib.md5(f"{a}{b}".encode()).hexdigest()[:6], 16)
+    mid = _midpoint(a, b)
+    paths = []
+    # 驾车多策略(strategy=10)时和高德一样返回3条路线: 更远的路线耗时也更短一些(绕行快速路)
+    for variant in range(3 if query.get("strategy") == "10" else 1):
+        steps = [{"instruction": "沿道路行驶", "polyline": _polyline(a, mid, seed + 2 * variant)},
+                 {"instruction": "到达目的地", "polyline": _polyline(mid, b, seed + 2 * variant + 1)}]
+        length = distance * (1 + 0.15 * variant)
+        paths.append({"distance": str(int(length)), "duration": str(int(length / (speed_mps * (1 + 0.2 * variant)))),
+                      "steps": steps})
+    route = {"paths": paths}
+    if taxi:
+        # 驾车应答带有打车费估算: 起步价13元含3公里，之后每公里2.5元
+        route["taxi_cost"] = str(round(13 + max(0.0, distance - 3000) / 1000 * 2.5, 1))
+    return {"status": "1", "info": "OK", "infocode": "10000", "route": route}
+
+
+ROUTES = {
+    "/v3/assistant/inputtips": inputtips,
+    "/v3/direction/transit/integrated": transit,
+    "/v3/direction/walking": lambda query: path_route(query, 1.2),
+    "/v3/direction/driving": lambda query: path_route(query, 9.0, taxi=True),
+}
+
+
+class FakeAmapServer:
+    """在后台线程中运行的模拟高德服务；latency_ms 模拟网络往返时间，并统计请求数和响应字节数。"""
+
+    def __init__(self, latency_ms: float = 50.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency_ms = latency_ms
+        self.requests: Dict[str, int] = {}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                handler = ROUTES.get(parsed.path)
+                if server.latency_ms:
+                    time.sleep(server.latency_ms / 1000)
+                if handler is None:
+                    body, status = {"status": "0", "info": "INVALID_URL", "infocode": "20000"}, 404
+                else:
+                    query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                    body, status = handler(query), 200
+                payload = json.dumps(body, ensure_ascii=False).encode()
+                server._record(parsed.path, len(payload))
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+
+    def _record(self, path: str, size: int):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            self.bytes_sent += size
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v3"
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {"requests": sum(self.requests.values()), "bytes": self.bytes_sent}
+
+    def start(self) -> "FakeAmapServer":
+        threading.Thread(target=self._httpd.serve_forever, name="fake-amap", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+if __name__ == '__main__':
+    # 单独运行时作为一个常驻的模拟服务，便于手动调试: AMAP_BASE_URL=http://127.0.0.1:8765/v3
+    fake = FakeAmapServer(port=8765).start()
+    print(f"模拟高德服务已启动: {fake.base_url} (Ctrl+C 退出)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,187 @@
+# benchmarks/fake_llm.py (按剧本发起工具调用的离线聊天模型，代替通义千问)
+
+import asyncio
+import json
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from history_manager import estimate_tokens
+
+
+def _current_turn(messages: List[BaseMessage]) -> List[BaseMessage]:
+    last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+    return messages[last_human + 1:]
+
+
+def _request(messages: List[BaseMessage]) -> str:
+    return next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+
+
+def _tool_results(messages: List[BaseMessage]) -> List[Dict[str, Any]]:
+    """本轮中已完成的工具调用: [{name, args, content}]，按调用顺序排列。"""
+    calls = {}
+    for message in messages:
+        if isinstance(message, AIMessage):
+            for call in message.tool_calls:
+                calls[call["id"]] = call
+    results = []
+    for message in messages:
+        if isinstance(message, ToolMessage) and message.tool_call_id in calls:
+            call = calls[message.tool_call_id]
+            results.append({"name": call["name"], "args": call["args"], "content": message.content})
+    return results
+
+
+def _place_calls(trip: Dict[str, Any]) -> List[Dict[str, str]]:
+    names = [trip["hotel"]]
+    names += [trip[key]["station"] for key in ("arrival", "departure") if trip.get(key)]
+    for key in ("spots", "restaurants", "night_activities"):
+        names += trip.get(key, [])
+    return [{"place_name": name, "city": trip["city"]} for name in dict.fromkeys(names)]
+
+
+class ScriptedTripModel(BaseChatModel):
+    """
+    一个离线的“剧本”模型: 根据本轮对话里已有的工具结果决定下一步，发起与真实模型相似的工具调用序列。
+    - planner: 逐个查坐标(收到交接信息时跳过) -> optimize_itinerary -> render_itinerary -> 输出行程单
+    - planner 收到“把A换成B”的修改请求时: 查B的坐标 -> edit_itinerary -> 输出更新后的行程单
+    - explorer: tavily_search -> 逐个查坐标 -> 输出结构化摘要
+    latency_ms 模拟每次模型调用的耗时；usage_metadata 按文本长度估算，便于追踪 token 开销。
+    """
+
+    role: str
+    trip: Dict[str, Any]
+    latency_ms: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-trip-model"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _next_message(self, messages: List[BaseMessage]) -> AIMessage:
+        self.calls += 1
+        turn = _current_turn(messages)
+        results = _tool_results(turn)
+        step = sum(1 for m in turn if isinstance(m, AIMessage) and m.tool_calls)
+        if self.role == "explorer":
+            message = self._explorer_step(step, results)
+        elif "换成" in _request(messages) and self.trip.get("edit"):
+            message = self._edit_step(results)
+        else:
+            system = next((m.content for m in messages if isinstance(m, SystemMessage)), "")
+            message = self._planner_step(results, system)
+        input_tokens = sum(estimate_tokens(str(m.content)) for m in messages)
+        output_tokens = estimate_tokens(message.content + json.dumps([c["args"] for c in message.tool_calls]))
+        message.usage_metadata = {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                  "total_tokens": input_tokens + output_tokens}
+        return message
+
+    # --- 剧本 ---
+    def _tool_call(self, name: str, args: Dict[str, Any], index: int) -> Dict[str, Any]:
+        return {"name": name, "args": args, "id": f"call_{self.calls}_{index}", "type": "tool_call"}
+
+    def _located(self, results: List[Dict[str, Any]]) -> Dict[str, Dict[str, str]]:
+        located = {}
+        for result in results:
+            if result["name"] == "search_place_info" and result["content"] and result["content"] != "null":
+                try:
+                    place = json.loads(result["content"])
+                except ValueError:
+                    continue
+                located[result["args"]["place_name"]] = {"name": place["name"], "location": place["location"]}
+        return located
+
+    def _trip_spec(self, located: Dict[str, Dict[str, str]]) -> Dict[str, Any]:
+        trip = self.trip
+
+        def places(key):
+            return [located[name] for name in trip.get(key, []) if name in located]
+
+        def station(key):
+            block = trip.get(key)
+            if not block or block["station"] not in located:
+                return None
+            return {"station": located[block["station"]], "time": block["time"]}
+
+        return {"city": trip["city"], "days": trip["days"], "mode": trip.get("mode", "transit"),
+                "hotel": located[trip["hotel"]], "arrival": station("arrival"), "departure": station("departure"),
+                "spots": places("spots"), "restaurants": places("restaurants"),
+                "night_activities": places("night_activities")}
+
+    def _planner_step(self, results: List[Dict[str, Any]], system: str) -> AIMessage:
+        by_name = {}
+        for result in results:
+            by_name.setdefault(result["name"], []).append(result)
+        if "optimize_itinerary" not in by_name:
+            handoff = re.search(r'^\s*(\{"city".*\})\s*$', system, re.MULTILINE)
+            if handoff:
+                spec = json.loads(handoff.group(1))
+                spec.setdefault("mode", self.trip.get("mode", "transit"))
+            elif "search_place_info" not in by_name:
+                calls = [self._tool_call("search_place_info", args, i) for i, args in enumerate(_place_calls(self.trip))]
+                return AIMessage(content="", tool_calls=calls)
+            else:
+                spec = self._trip_spec(self._located(results))
+            return AIMessage(content="", tool_calls=[
+                self._tool_call("optimize_itinerary", {"trip_spec": json.dumps(spec, ensure_ascii=False)}, 0)])
+
+        if "render_itinerary" not in by_name:
+            return AIMessage(content="", tool_calls=[self._tool_call("render_itinerary", {}, 0)])
+        return AIMessage(content=by_name["render_itinerary"][-1]["content"])
+
+    def _edit_step(self, results: List[Dict[str, Any]]) -> AIMessage:
+        edit = self.trip["edit"]
+        done = {result["name"] for result in results}
+        if "search_place_info" not in done:
+            return AIMessage(content="", tool_calls=[
+                self._tool_call("search_place_info", {"place_name": edit["with"], "city": self.trip["city"]}, 0)])
+        if "edit_itinerary" not in done:
+            place = self._located(results)[edit["with"]]
+            edits = [{"op": "replace", "target": edit["replace"], "place": place}]
+            return AIMessage(content="", tool_calls=[
+                self._tool_call("edit_itinerary", {"edits": json.dumps(edits, ensure_ascii=False)}, 0)])
+        return AIMessage(content=next(r["content"] for r in results if r["name"] == "edit_itinerary"))
+
+    def _explorer_step(self, step: int, results: List[Dict[str, Any]]) -> AIMessage:
+        trip = self.trip
+        if step == 0:
+            query = f"{trip['city']}{trip['days']}天旅游攻略"
+            return AIMessage(content="", tool_calls=[self._tool_call("tavily_search", {"query": query}, 0)])
+        if step == 1:
+            calls = [self._tool_call("search_place_info", args, i) for i, args in enumerate(_place_calls(trip))]
+            return AIMessage(content="", tool_calls=calls)
+        spec = self._trip_spec(self._located(results))
+
+        def dump(value):
+            return json.dumps(value, ensure_ascii=False)
+
+        lines = ["好的，我已经为您整理好了所有精确信息，现在我将把它交给我的同事“路路通”进行详细规划：",
+                 f"- **城市**: {spec['city']}", f"- **旅行天数**: {spec['days']}", f"- **酒店**: {dump(spec['hotel'])}"]
+        if spec["arrival"]:
+            lines.append(f"- **抵达**: {dump(spec['arrival'])}")
+        if spec["departure"]:
+            lines.append(f"- **离开**: {dump(spec['departure'])}")
+        lines += [f"- **必去地点**: {dump(spec['spots'])}", f"- **指定餐厅**: {dump(spec['restaurants'])}",
+                  f"- **夜间活动**: {dump(spec['night_activities'])}"]
+        return AIMessage(content="\n".join(lines))
+
+    # --- BaseChatModel 接口 ---
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs) -> ChatResult:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
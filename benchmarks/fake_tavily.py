@@ -0,0 +1,50 @@
+# benchmarks/fake_tavily.py (Tavily 搜索客户端的本地替身)
+
+import asyncio
+import hashlib
+import time
+from typing import Any, Dict
+
+_PARAGRAPH = ("这里交通便利，适合安排半天到一天的行程。旺季人流较多，建议提前预约门票，"
+              "傍晚时分景色最佳，附近有不少本地特色餐馆和夜市可以顺路体验。")
+# 真实结果里常有英文或几乎没有标点的网页: 整篇只切出一段，而且比整个搜索结果的token预算还长
+_ENGLISH_PAGE = " ".join(["travellers love the old town for its narrow lanes seafood stalls and harbour views"] * 80)
+
+
+class StubTavilyClient:
+    """与 TavilyClient.search 接口一致，返回确定性的搜索结果；latency_ms 模拟接口耗时。"""
+
+    def __init__(self, latency_ms: float = 300.0, results: int = 5):
+        self.latency_ms = latency_ms
+        self.results = results
+        self.calls = 0
+
+    def _response(self, query: str, max_results: int) -> Dict[str, Any]:
+        self.calls += 1
+        digest = hashlib.md5(query.encode()).hexdigest()
+        results = [{
+            "title": f"{query} - 攻略{i + 1}",
+            "url": f"https://example.com/{digest[:8]}/{i}",
+            "content": f"{query} {_ENGLISH_PAGE}" if i == 0 else f"{query}。推荐地点{i + 1}。" + _PARAGRAPH * 4,
+            "score": round(0.9 - i * 0.05, 2),
+        } for i in range(min(max_results, self.results))]
+        return {"query": query, "results": results, "response_time": self.latency_ms / 1000}
+
+    def search(self, query: str, max_results: int = 5, **kwargs) -> Dict[str, Any]:
+        time.sleep(self.latency_ms / 1000)
+        return self._response(query, max_results)
+
+
+class AsyncStubTavilyClient(StubTavilyClient):
+    async def search(self, query: str, max_results: int = 5, **kwargs) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return self._response(query, max_results)
+
+
+def install(latency_ms: float = 300.0):
+    """用替身替换 explorer_tools 的(延迟创建的)Tavily客户端，返回 (同步客户端, 异步客户端)。"""
+    import explorer_tools
+    sync_client, async_client = StubTavilyClient(latency_ms), AsyncStubTavilyClient(latency_ms)
+    explorer_tools._clients["sync"] = sync_client
+    explorer_tools._clients["async"] = async_client
+    return sync_client, async_client
@@ -0,0 +1,176 @@
+# benchmarks/run.py (离线端到端基准测试: 模拟高德 + Tavily替身 + 剧本模型，驱动探索家和规划师)
+#
+# 用法(在项目根目录): python -m benchmarks.run [--scenario dalian_2d] [--llm-latency-ms 800] [--memory] [--json out.json]
+#   先 --transport record --recordings rec.sqlite3 录制一次，再 --transport replay 回放(零网络，衡量纯流水线开销)
+#   --prefetch-wait 5: 探索家结束后等5秒再交给规划师，衡量后台路线预取让规划师少发多少请求
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_amap import FakeAmapServer
+from benchmarks.scenarios import SCENARIOS
+
+
+def _prepare_environment(args) -> FakeAmapServer:
+    """在导入任何项目模块之前设置环境变量: 假的Key、本地高德地址、临时的缓存/追踪/地图目录。"""
+    server = FakeAmapServer(latency_ms=args.amap_latency_ms).start()
+    workdir = tempfile.mkdtemp(prefix="trip_bench_")
+    os.environ.update({
+        "DASHSCOPE_API_KEY": "offline", "AMAP_API_KEY": "offline", "TAVILY_API_KEY": "offline",
+        "AMAP_BASE_URL": server.base_url, "AMAP_QPS": str(args.amap_qps),
+        "CACHE_DB_PATH": os.path.join(workdir, "cache.sqlite3"),
+        "TRACE_LOG_PATH": os.path.join(workdir, "trace.jsonl"),
+        "MAP_OUTPUT_DIR": os.path.join(workdir, "maps"),
+        "API_TRANSPORT_MODE": args.transport,
+        "API_RECORD_PATH": args.recordings or os.path.join(workdir, "recordings.sqlite3"),
+        # 只有显式模拟“切换到规划师之前的空档”时才打开路线预取，默认的结果不受后台请求影响
+        "ROUTE_PREFETCH_ENABLED": "true" if args.prefetch_wait else "false",
+    })
+    return server
+
+
+def _run_turn(agent, inputs, tracer, use_async: bool):
+    import async_runtime
+    config = {"callbacks": [tracer]}
+    if use_async:
+        from planning_client import agent_events
+        events = list(async_runtime.iterate(agent_events(agent, inputs, config=config)))
+        return events[-1]["output"]
+    return agent.invoke(inputs, config=config)["output"]
+
+
+def run_scenario(name, trip, server, args):
+    from langchain_core.messages import AIMessage, HumanMessage
+    from benchmarks.fake_llm import ScriptedTripModel
+    from explorer_agent_core import create_explorer_agent
+    from explorer_tools import search_cache
+    from map_tools import geocode_cache, route_cache
+    from route_agent_core import create_route_agent
+    from route_prefetcher import route_prefetcher
+    from session_context import use_session
+    from tracing import TurnTracer
+    from trip_spec import find_trip_spec
+
+    # 每个场景都从冷缓存开始
+    geocode_cache.clear()
+    route_cache.clear()
+    search_cache.clear()
+    explorer_llm = ScriptedTripModel(role="explorer", trip=trip, latency_ms=args.llm_latency_ms)
+    planner_llm = ScriptedTripModel(role="planner", trip=trip, latency_ms=args.llm_latency_ms)
+    explorer, planner = create_explorer_agent(llm=explorer_llm), create_route_agent(llm=planner_llm)
+    request = f"我想去{trip['city']}玩{trip['days']}天"
+    handoff = None
+    rows = []
+    turns = [("explorer", explorer, None), ("planner_handoff", planner, "handoff"), ("planner_warm", planner, None),
+             ("planner_edit", planner, "edit")]
+    for turn_name, agent, mode in turns:
+        inputs = {"input": request, "chat_history": [HumanMessage(content=request)]}
+        if mode == "edit":
+            edit = trip["edit"]
+            inputs["input"] = f"把{edit['replace']}换成{edit['with']}"
+            inputs["chat_history"].append(AIMessage(content=f"这是您的{trip['city']}{trip['days']}日行程"))
+        if mode == "handoff" and handoff is not None:
+            inputs["trip_spec"] = handoff.to_prompt()
+        tracer = TurnTracer(session_id=name, agent=turn_name)
+        before = server.snapshot()
+        if args.memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        with use_session(name):
+            output = _run_turn(agent, inputs, tracer, not args.sync)
+        wall = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if args.memory else None
+        if args.memory:
+            tracemalloc.stop()
+        after = server.snapshot()
+        summary = tracer.finish()
+        if turn_name == "explorer":
+            handoff = find_trip_spec(output)
+            if args.prefetch_wait:
+                before_wait = server.snapshot()["requests"]
+                time.sleep(args.prefetch_wait)
+                with use_session(name):
+                    stats = route_prefetcher.stats()
+                print(f"--- ⏳ [benchmark] {name}: 等待 {args.prefetch_wait:.0f}s，后台预取了 "
+                      f"{server.snapshot()['requests'] - before_wait} 段交通 {stats} ---")
+        tools = {tool: entry["calls"] for tool, entry in summary["tools"].items()}
+        # 搜索结果被精简成空列表说明 condense_results 的预算分配出了问题(例如一段超长正文占满了预算)
+        empty_searches = sum(1 for span in tracer.spans
+                             if span["kind"] == "tool" and span["name"] == "tavily_search" and span.get("results") == 0)
+        rows.append({
+            "scenario": name, "turn": turn_name, "wall_s": round(wall, 3),
+            "llm_calls": summary["llm"]["calls"], "llm_s": round(summary["llm"]["wall_ms"] / 1000, 3),
+            "input_tokens": summary["llm"]["input_tokens"], "output_tokens": summary["llm"]["output_tokens"],
+            "tool_calls": summary["tool_calls"], "tools": tools,
+            "amap_requests": after["requests"] - before["requests"], "amap_bytes": after["bytes"] - before["bytes"],
+            "output_chars": len(output or ""), "empty_searches": empty_searches,
+            "peak_mem_mb": round(peak / 2 ** 20, 1) if peak is not None else None,
+        })
+        print(f"--- ✅ [benchmark] {name}/{turn_name}: {wall:.2f}s ---")
+    return rows
+
+
+def _print_table(rows):
+    header = (f"{'场景':<14}{'轮次':<18}{'耗时(s)':>9}{'LLM次数':>8}{'工具次数':>8}{'高德请求':>9}"
+              f"{'高德KB':>9}{'输入tok':>9}{'输出tok':>8}{'峰值MB':>8}")
+    print("\n" + header)
+    print("-" * len(header))
+    for row in rows:
+        peak = "-" if row["peak_mem_mb"] is None else f"{row['peak_mem_mb']:.1f}"
+        print(f"{row['scenario']:<14}{row['turn']:<18}{row['wall_s']:>9.2f}{row['llm_calls']:>8}{row['tool_calls']:>8}"
+              f"{row['amap_requests']:>9}{row['amap_bytes'] / 1024:>9.0f}{row['input_tokens']:>9}"
+              f"{row['output_tokens']:>8}{peak:>8}")
+    print(f"\n进程峰值常驻内存: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线端到端基准测试")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="只运行指定场景(可重复)，默认全部")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="模拟每次模型调用的耗时")
+    parser.add_argument("--amap-latency-ms", type=float, default=50.0, help="模拟高德接口的往返耗时")
+    parser.add_argument("--tavily-latency-ms", type=float, default=300.0, help="模拟Tavily接口的耗时")
+    parser.add_argument("--amap-qps", type=float, default=1000.0, help="高德QPS上限(默认不限流)")
+    parser.add_argument("--sync", action="store_true", help="用同步的 invoke() 驱动Agent(默认与界面一致用 astream_events)")
+    parser.add_argument("--memory", action="store_true", help="用 tracemalloc 统计每轮的峰值内存(会拖慢运行)")
+    parser.add_argument("--transport", choices=["live", "record", "replay"], default="live",
+                        help="外部API的传输方式: replay 时所有高德/Tavily应答都来自录制库")
+    parser.add_argument("--recordings", help="录制库路径(record/replay 时使用，默认放在临时目录)")
+    parser.add_argument("--prefetch-wait", type=float, default=0.0,
+                        help="探索家之后等待多少秒再开始规划(模拟用户切换页面)，期间由后台预取路线；默认不预取")
+    parser.add_argument("--json", help="把结果写入JSON文件，便于前后对比")
+    args = parser.parse_args(argv)
+    if args.transport == "replay" and not args.recordings:
+        parser.error("--transport replay 需要用 --recordings 指定录制库")
+
+    server = _prepare_environment(args)
+    sys.path.insert(0, os.getcwd())
+    from benchmarks.fake_tavily import install
+    install(args.tavily_latency_ms)
+
+    rows = []
+    try:
+        for name in args.scenario or list(SCENARIOS):
+            rows += run_scenario(name, SCENARIOS[name], server, args)
+    finally:
+        server.stop()
+    _print_table(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": rows}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+    empty = [f"{row['scenario']}/{row['turn']}" for row in rows if row["empty_searches"]]
+    if empty:
+        print(f"--- ❌ [benchmark] 搜索结果被精简为空: {', '.join(empty)} ---")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
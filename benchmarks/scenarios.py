@@ -0,0 +1,47 @@
+# benchmarks/scenarios.py (基准测试使用的代表性行程: 从2天大连到7天多景点；edit 为修改轮次中要替换的景点)
+
+SCENARIOS = {
+    "dalian_2d": {
+        "city": "大连", "days": 2, "mode": "transit",
+        "hotel": "大连香格里拉大酒店",
+        "arrival": {"station": "大连北站", "time": "2025-08-01 10:30"},
+        "departure": {"station": "大连站", "time": "2025-08-02 18:00"},
+        "spots": ["星海广场", "老虎滩海洋公园", "棒棰岛", "东港音乐喷泉"],
+        "restaurants": [],
+        "night_activities": [],
+        "edit": {"replace": "棒棰岛", "with": "付家庄公园"},
+    },
+    "dalian_3d": {
+        "city": "大连", "days": 3, "mode": "transit",
+        "hotel": "大连万达文华酒店",
+        "arrival": {"station": "大连周水子国际机场", "time": "2025-08-01 09:40"},
+        "departure": {"station": "大连北站", "time": "2025-08-03 17:00"},
+        "spots": ["星海广场", "老虎滩海洋公园", "金石滩", "俄罗斯风情街", "滨海路", "大连森林动物园"],
+        "restaurants": ["海鲜大排档", "天天渔港"],
+        "night_activities": ["东港夜景"],
+        "edit": {"replace": "金石滩", "with": "大连自然博物馆"},
+    },
+    "chengdu_5d": {
+        "city": "成都", "days": 5, "mode": "transit",
+        "hotel": "成都博舍酒店",
+        "arrival": {"station": "成都东站", "time": "2025-10-01 11:00"},
+        "departure": {"station": "成都天府国际机场", "time": "2025-10-05 19:30"},
+        "spots": ["宽窄巷子", "锦里", "武侯祠", "杜甫草堂", "大熊猫繁育研究基地", "春熙路", "人民公园",
+                  "文殊院", "青城山", "都江堰", "东郊记忆", "金沙遗址博物馆"],
+        "restaurants": ["陈麻婆豆腐", "蜀大侠火锅"],
+        "night_activities": ["九眼桥酒吧街"],
+        "edit": {"replace": "东郊记忆", "with": "四川博物院"},
+    },
+    "shanghai_7d": {
+        "city": "上海", "days": 7, "mode": "transit",
+        "hotel": "上海外滩华尔道夫酒店",
+        "arrival": {"station": "上海虹桥站", "time": "2025-07-10 10:00"},
+        "departure": {"station": "上海浦东国际机场", "time": "2025-07-16 20:00"},
+        "spots": ["外滩", "东方明珠", "豫园", "南京路步行街", "田子坊", "新天地", "武康路", "上海博物馆",
+                  "上海科技馆", "世纪公园", "七宝古镇", "朱家角古镇", "上海迪士尼乐园", "静安寺", "思南公馆",
+                  "徐家汇书院", "M50创意园", "陆家嘴滨江", "上海植物园", "中华艺术宫"],
+        "restaurants": ["南翔馒头店", "老正兴菜馆", "沈大成"],
+        "night_activities": ["外滩夜景", "黄浦江游船"],
+        "edit": {"replace": "上海植物园", "with": "上海自然博物馆"},
+    },
+}
@@ -0,0 +1,197 @@
+# cache_store.py (磁盘持久化的 TTL + LRU 缓存)
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import CACHE_DB_PATH
+
+# 内存前置缓存中的条目，距上次写回访问时间超过该秒数才会再次更新磁盘上的LRU时间戳
+_LRU_TOUCH_INTERVAL = 300
+# 每写入多少次执行一次过期清理与LRU淘汰
+_EVICT_EVERY_WRITES = 64
+
+# 同一个数据库文件在进程内只打开一个连接，由锁串行化访问 (Streamlit 的多个会话线程共享)
+_connections: Dict[str, Tuple[sqlite3.Connection, threading.Lock]] = {}
+_connections_lock = threading.Lock()
+
+
+def _get_connection(db_path: str) -> Tuple[sqlite3.Connection, threading.Lock]:
+    with _connections_lock:
+        if db_path not in _connections:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10, isolation_level=None)
+            # WAL 模式允许多个进程(例如批量规划的worker)同时读写同一个缓存文件
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT,"
+                " expires_at REAL NOT NULL, last_access REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_lru ON cache_entries (namespace, last_access)"
+            )
+            _connections[db_path] = (conn, threading.Lock())
+        return _connections[db_path]
+
+
+def normalize_key_part(text: str) -> str:
+    """
+    将缓存键的组成部分归一化: 全角转半角(NFKC)、去除首尾空白、合并连续空白、英文转小写。
+    这样 "星海广场 " 与 "星海广场"、"ＣＢＤ" 与 "cbd" 会命中同一个缓存条目。
+    """
+    text = unicodedata.normalize("NFKC", str(text or ""))
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class PersistentTTLCache:
+    """
+    一个以 SQLite 为后端、所有会话与进程共享的键值缓存。
+
+    - 每个条目都有有效期(TTL)，过期后视为未命中；
+    - 支持负缓存: `set(key, None)` 记录“确认不存在”的结果，使用单独的(通常更短的)有效期；
+    - 条目数超过 `max_entries` 时，按最近访问时间淘汰最旧的条目(LRU)；
+    - 进程内有一层小的内存前置缓存，热点键的读取无需访问磁盘。
+    """
+
+    def __init__(self, namespace: str, ttl_seconds: int, max_entries: int,
+                 negative_ttl_seconds: Optional[int] = None, db_path: str = CACHE_DB_PATH,
+                 memory_entries: int = 2048):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = ttl_seconds if negative_ttl_seconds is None else negative_ttl_seconds
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._memory_entries = max(0, min(memory_entries, max_entries))
+        # key -> (value, expires_at, touched_at)
+        self._memory: "OrderedDict[str, Tuple[Optional[str], float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self._stats = {"hits": 0, "negative_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    # --- 内部工具 ---
+    def _remember(self, key: str, value: Optional[str], expires_at: float, touched_at: float):
+        if not self._memory_entries:
+            return
+        with self._lock:
+            self._memory[key] = (value, expires_at, touched_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self._memory_entries:
+                self._memory.popitem(last=False)
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+    # --- 对外接口 ---
+    def get(self, key: str) -> Tuple[bool, Optional[str]]:
+        """返回 (是否命中, 缓存值)。命中负缓存时返回 (True, None)。"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._memory[key]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is not None:
+            value, expires_at, touched_at = entry
+            if now - touched_at > _LRU_TOUCH_INTERVAL:
+                conn, db_lock = _get_connection(self.db_path)
+                with db_lock:
+                    conn.execute("UPDATE cache_entries SET last_access=? WHERE namespace=? AND key=?",
+                                 (now, self.namespace, key))
+                self._remember(key, value, expires_at, now)
+            self._count("hits" if value is not None else "negative_hits")
+            return True, value
+
+        conn, db_lock = _get_connection(self.db_path)
+        with db_lock:
+            row = conn.execute("SELECT value, expires_at FROM cache_entries WHERE namespace=? AND key=?",
+                               (self.namespace, key)).fetchone()
+            if row is not None and row[1] > now:
+                conn.execute("UPDATE cache_entries SET last_access=? WHERE namespace=? AND key=?",
+                             (now, self.namespace, key))
+        if row is None or row[1] <= now:
+            self._count("misses")
+            return False, None
+        value, expires_at = row
+        self._remember(key, value, expires_at, now)
+        self._count("hits" if value is not None else "negative_hits")
+        return True, value
+
+    def set(self, key: str, value: Optional[str], ttl_seconds: Optional[int] = None):
+        """写入一个条目; value 为 None 表示负缓存。"""
+        now = time.time()
+        if ttl_seconds is None:
+            ttl_seconds = self.ttl_seconds if value is not None else self.negative_ttl_seconds
+        expires_at = now + ttl_seconds
+        conn, db_lock = _get_connection(self.db_path)
+        with db_lock:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, value, expires_at, now),
+            )
+        self._remember(key, value, expires_at, now)
+        with self._lock:
+            self._stats["writes"] += 1
+            self._writes_since_evict += 1
+            should_evict = self._writes_since_evict >= _EVICT_EVERY_WRITES
+            if should_evict:
+                self._writes_since_evict = 0
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """删除过期条目，并按LRU把条目数压回 max_entries 以内。返回删除的条目数。"""
+        now = time.time()
+        conn, db_lock = _get_connection(self.db_path)
+        with db_lock:
+            removed = conn.execute("DELETE FROM cache_entries WHERE namespace=? AND expires_at<=?",
+                                   (self.namespace, now)).rowcount
+            total = conn.execute("SELECT COUNT(*) FROM cache_entries WHERE namespace=?",
+                                 (self.namespace,)).fetchone()[0]
+            overflow = total - self.max_entries
+            if overflow > 0:
+                removed += conn.execute(
+                    "DELETE FROM cache_entries WHERE namespace=? AND key IN ("
+                    " SELECT key FROM cache_entries WHERE namespace=? ORDER BY last_access ASC LIMIT ?)",
+                    (self.namespace, self.namespace, overflow),
+                ).rowcount
+        if removed:
+            with self._lock:
+                self._memory.clear()
+            self._count("evictions", removed)
+        return removed
+
+    def items(self) -> List[Tuple[str, str]]:
+        """返回本命名空间中所有未过期、非负缓存的 (键, 值)，用于从缓存预热其他索引。不更新LRU时间戳。"""
+        conn, db_lock = _get_connection(self.db_path)
+        with db_lock:
+            return conn.execute("SELECT key, value FROM cache_entries WHERE namespace=? AND expires_at>?"
+                                " AND value IS NOT NULL", (self.namespace, time.time())).fetchall()
+
+    def clear(self):
+        conn, db_lock = _get_connection(self.db_path)
+        with db_lock:
+            conn.execute("DELETE FROM cache_entries WHERE namespace=?", (self.namespace,))
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """返回当前进程内的命中/未命中计数及命中率。"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["negative_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["negative_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
@@ -23,11 +23,143 @@ AMAP_API_KEY = os.getenv("AMAP_API_KEY")
 if not AMAP_API_KEY:
     raise ValueError("错误：未找到 AMAP_API_KEY。\n请在项目根目录下创建 .env 文件，并添加 AMAP_API_KEY='你的Key'。")
 
-# 高德地图API的基础URL
-AMAP_BASE_URL = "https://restapi.amap.com/v3"
+# 高德地图API的基础URL (基准测试时可以指向本地的模拟服务)
+AMAP_BASE_URL = os.getenv("AMAP_BASE_URL", "https://restapi.amap.com/v3")
 
 # 你可以在这里添加其他全局配置
 print("✅ 配置文件加载成功！")
 
 # --- Tavily 搜索API配置 ---
-TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
\ No newline at end of file
+TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+
+# --- 本地缓存配置 ---
+# 所有Streamlit会话(以及同一台机器上的其他进程)共享的磁盘缓存文件
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", ".cache/trip_planner_cache.sqlite3")
+
+# 地点搜索(search_place_info)缓存: 有效期(秒)、“找不到地点”的负缓存有效期(秒)、最大条目数
+GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", 30 * 24 * 3600))
+GEOCODE_NEGATIVE_TTL = int(os.getenv("GEOCODE_NEGATIVE_TTL", 6 * 3600))
+GEOCODE_CACHE_MAX_ENTRIES = int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", 50000))
+
+# 路线(get_route_info)缓存: 坐标吸附的小数位数(4位约等于10米)，各出行方式的有效期(秒)，无可用方案时的负缓存有效期(秒)
+ROUTE_COORD_PRECISION = int(os.getenv("ROUTE_COORD_PRECISION", 4))
+ROUTE_CACHE_TTL_TRANSIT = int(os.getenv("ROUTE_CACHE_TTL_TRANSIT", 3 * 24 * 3600))
+ROUTE_CACHE_TTL_WALKING = int(os.getenv("ROUTE_CACHE_TTL_WALKING", 30 * 24 * 3600))
+ROUTE_CACHE_TTL_DRIVING = int(os.getenv("ROUTE_CACHE_TTL_DRIVING", 6 * 3600))
+ROUTE_NEGATIVE_TTL = int(os.getenv("ROUTE_NEGATIVE_TTL", 3600))
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", 200000))
+
+# 批量路线矩阵(get_route_matrix): 单次最多地点数，以及并发查询的线程数上限
+ROUTE_MATRIX_MAX_LOCATIONS = int(os.getenv("ROUTE_MATRIX_MAX_LOCATIONS", 15))
+ROUTE_MATRIX_MAX_WORKERS = int(os.getenv("ROUTE_MATRIX_MAX_WORKERS", 8))
+
+# 行程优化器(optimize_itinerary): 超过该地点数时不再请求完整的路线矩阵，改用直线距离估算交通耗时
+OPTIMIZER_MAX_MATRIX_LOCATIONS = int(os.getenv("OPTIMIZER_MAX_MATRIX_LOCATIONS", 30))
+
+# --- 高德HTTP客户端配置 ---
+# 整个进程共享的QPS上限(请按自己Key的配额设置，个人开发者Key通常为3)，单次请求超时(秒)，临时错误的最大重试次数，连接池大小
+AMAP_QPS = float(os.getenv("AMAP_QPS", 3))
+AMAP_TIMEOUT = float(os.getenv("AMAP_TIMEOUT", 5))
+AMAP_MAX_RETRIES = int(os.getenv("AMAP_MAX_RETRIES", 3))
+AMAP_POOL_SIZE = int(os.getenv("AMAP_POOL_SIZE", 16))
+
+# --- 路线几何存储配置 ---
+# 折线简化容差(米)，每个会话最多保存的路线条数，最多同时保存的会话数
+GEOMETRY_SIMPLIFY_TOLERANCE_M = float(os.getenv("GEOMETRY_SIMPLIFY_TOLERANCE_M", 5))
+GEOMETRY_MAX_ROUTES_PER_SESSION = int(os.getenv("GEOMETRY_MAX_ROUTES_PER_SESSION", 500))
+GEOMETRY_MAX_SESSIONS = int(os.getenv("GEOMETRY_MAX_SESSIONS", 200))
+
+# --- 地图渲染配置 ---
+# 地图HTML的输出目录(每个会话一个文件)；折线简化容差(屏幕像素)；简化时比“全程一屏”多保留的缩放级数
+MAP_OUTPUT_DIR = os.getenv("MAP_OUTPUT_DIR", "maps")
+MAP_SIMPLIFY_PIXELS = float(os.getenv("MAP_SIMPLIFY_PIXELS", 1.0))
+MAP_DETAIL_ZOOM_OFFSET = int(os.getenv("MAP_DETAIL_ZOOM_OFFSET", 2))
+
+# --- 对话历史预算配置 ---
+# 传给模型的历史消息的token预算；超出时保留最近的消息条数，更早的消息压缩为摘要
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 6000))
+HISTORY_KEEP_RECENT_MESSAGES = int(os.getenv("HISTORY_KEEP_RECENT_MESSAGES", 6))
+# 同一轮对话中，最近多少步工具结果保持完整；更早的工具结果截断到多少个字符
+SCRATCHPAD_FULL_STEPS = int(os.getenv("SCRATCHPAD_FULL_STEPS", 12))
+OBSERVATION_MAX_CHARS = int(os.getenv("OBSERVATION_MAX_CHARS", 1500))
+
+# --- 耗时追踪配置 ---
+# 每次LLM/工具调用的耗时记录(JSONL)，超过大小后滚动，保留的旧文件个数
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", ".cache/trace.jsonl")
+TRACE_LOG_MAX_BYTES = int(os.getenv("TRACE_LOG_MAX_BYTES", 5 * 1024 * 1024))
+TRACE_LOG_BACKUPS = int(os.getenv("TRACE_LOG_BACKUPS", 3))
+
+# --- 外部API录制/回放配置 ---
+# live: 正常访问高德/Tavily；record: 访问的同时把应答写入录制库；replay: 只从录制库返回，完全不访问网络
+API_TRANSPORT_MODE = os.getenv("API_TRANSPORT_MODE", "live").lower()
+API_RECORD_PATH = os.getenv("API_RECORD_PATH", ".cache/api_recordings.sqlite3")
+# 回放时是否按录制时的耗时等待(复现慢会话)；默认立即返回
+API_REPLAY_LATENCY = os.getenv("API_REPLAY_LATENCY", "false").lower() in ("1", "true", "yes")
+
+# --- 行程状态配置 ---
+# 服务端最多同时保存多少个会话的当前行程(供修改时增量重算)，超出后按LRU淘汰
+ITINERARY_MAX_SESSIONS = int(os.getenv("ITINERARY_MAX_SESSIONS", 200))
+
+# --- 本地地点库配置 ---
+# 批量导入的地点文件(CSV带表头或JSONL，字段: city,name,location 或 lng+lat,address,category,aliases)，不存在时只使用查询过的地点
+POI_GAZETTEER_PATH = os.getenv("POI_GAZETTEER_PATH", "data/poi_gazetteer.csv")
+# 模糊匹配的最低得分(0~1，低于它交给高德解析)；空间网格边长(度，0.01约1公里)；附近查询最多返回的条数
+POI_MATCH_THRESHOLD = float(os.getenv("POI_MATCH_THRESHOLD", 0.7))
+POI_GRID_DEGREES = float(os.getenv("POI_GRID_DEGREES", 0.01))
+POI_NEARBY_MAX_RESULTS = int(os.getenv("POI_NEARBY_MAX_RESULTS", 20))
+
+# --- 规划服务配置 ---
+# 设置后 app.py 只作为瘦客户端，把每轮对话交给独立的规划服务执行；多个地址用逗号分隔，按会话ID固定分配到其中一个
+PLANNING_SERVICE_URL = os.getenv("PLANNING_SERVICE_URL", "")
+PLANNING_SERVICE_HOST = os.getenv("PLANNING_SERVICE_HOST", "127.0.0.1")
+PLANNING_SERVICE_PORT = int(os.getenv("PLANNING_SERVICE_PORT", 8765))
+# 同时执行的对话轮数，排队等待的上限(队列满时直接拒绝并提示稍后重试)，每个用户同时排队+执行的上限
+PLANNING_WORKERS = int(os.getenv("PLANNING_WORKERS", 4))
+PLANNING_QUEUE_SIZE = int(os.getenv("PLANNING_QUEUE_SIZE", 32))
+PLANNING_USER_MAX_JOBS = int(os.getenv("PLANNING_USER_MAX_JOBS", 2))
+# 同步工具使用的I/O线程数；行程优化等CPU密集计算的进程数(0 表示在I/O线程中直接计算)；单轮对话的超时(秒)
+PLANNING_IO_THREADS = int(os.getenv("PLANNING_IO_THREADS", 32))
+PLANNING_CPU_PROCESSES = int(os.getenv("PLANNING_CPU_PROCESSES", 0))
+PLANNING_JOB_TIMEOUT = float(os.getenv("PLANNING_JOB_TIMEOUT", 300))
+
+# --- 路线预取配置 ---
+# 会话中核实了新地点后，在后台以低优先级预先查询规划师大概率会用到的交通段(酒店<->景点、车站<->酒店、相邻景点之间)
+ROUTE_PREFETCH_ENABLED = os.getenv("ROUTE_PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+# 预取的出行方式(逗号分隔)；直线距离小于该值(米)的交通段额外预取步行路线
+ROUTE_PREFETCH_MODES = [mode.strip() for mode in os.getenv("ROUTE_PREFETCH_MODES", "transit").split(",") if mode.strip()]
+ROUTE_PREFETCH_WALK_METERS = float(os.getenv("ROUTE_PREFETCH_WALK_METERS", 1000))
+# 每个景点预取到最近的几个景点；每个会话最多预取的交通段数
+ROUTE_PREFETCH_NEIGHBORS = int(os.getenv("ROUTE_PREFETCH_NEIGHBORS", 3))
+ROUTE_PREFETCH_MAX_LEGS = int(os.getenv("ROUTE_PREFETCH_MAX_LEGS", 150))
+# 预取只使用令牌桶里的富余令牌，至少给前台请求保留的令牌数
+ROUTE_PREFETCH_RESERVE_TOKENS = float(os.getenv("ROUTE_PREFETCH_RESERVE_TOKENS", 1))
+# 地点集合变化后等待多久再开始(秒，合并同一步里并发核实的多个地点)；会话空闲多久后停止预取并丢弃(秒)
+ROUTE_PREFETCH_DEBOUNCE = float(os.getenv("ROUTE_PREFETCH_DEBOUNCE", 2))
+ROUTE_PREFETCH_IDLE_SECONDS = float(os.getenv("ROUTE_PREFETCH_IDLE_SECONDS", 1800))
+
+# --- 网络搜索(tavily_search)配置 ---
+# 搜索深度(advanced 结果更丰富，basic 更快更省)与每次返回的结果数
+TAVILY_SEARCH_DEPTH = os.getenv("TAVILY_SEARCH_DEPTH", "advanced")
+TAVILY_MAX_RESULTS = int(os.getenv("TAVILY_MAX_RESULTS", 5))
+# 搜索结果缓存(以归一化后的查询词为键): 有效期(秒)与最大条目数
+TAVILY_CACHE_TTL = int(os.getenv("TAVILY_CACHE_TTL", 3 * 24 * 3600))
+TAVILY_CACHE_MAX_ENTRIES = int(os.getenv("TAVILY_CACHE_MAX_ENTRIES", 5000))
+# 去重后交给探索家的搜索结果最多占用的token数
+TAVILY_TOKEN_BUDGET = int(os.getenv("TAVILY_TOKEN_BUDGET", 1200))
+
+# --- 批量规划配置 ---
+# batch_plan.py 默认的并发数与执行方式(thread: 单进程多线程，相同的高德请求可以合并、共用一个令牌桶；
+# process: 每个worker一个进程，行程优化和地图渲染不受GIL限制，但高德配额按进程平分)
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", 4))
+BATCH_POOL = os.getenv("BATCH_POOL", "thread")
+# 每个行程的地图(HTML)输出目录
+BATCH_MAP_DIR = os.getenv("BATCH_MAP_DIR", "batch_maps")
+
+# --- 多方式路线配置 ---
+# 每种出行方式保留的方案数(第一个完整保留，其余只保留耗时/距离/费用/步行距离)
+ROUTE_ALTERNATIVES = int(os.getenv("ROUTE_ALTERNATIVES", 3))
+# get_route_info(mode="auto") 的默认选择策略: fastest(最快) / cheapest(最便宜) / least_walking(步行最少)
+ROUTE_AUTO_POLICY = os.getenv("ROUTE_AUTO_POLICY", "fastest")
+# 直线距离超过该值(米)时不查询步行；低于该值(米)时只查询步行，公交和驾车没有意义
+ROUTE_AUTO_WALK_MAX_METERS = float(os.getenv("ROUTE_AUTO_WALK_MAX_METERS", 2500))
+ROUTE_AUTO_MIN_RIDE_METERS = float(os.getenv("ROUTE_AUTO_MIN_RIDE_METERS", 400))
@@ -1,22 +1,22 @@
 # explorer_agent_core.py (最终版 - 所有地点均核实坐标)
 
-from langchain_community.chat_models.tongyi import ChatTongyi
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from config import DASHSCOPE_API_KEY
-from map_tools import search_place_info
+from history_manager import budget_observations
+from llm_provider import get_chat_model
+from map_tools import search_place_info, find_nearby_places
 from explorer_tools import tavily_search
 
-def create_explorer_agent():
+def create_explorer_agent(llm=None):
     """
     创建一个用于前期探索和信息收集的“探索家Agent”。
     这个最终版Agent会核实所有地点的坐标信息，并以统一格式输出。
     """
     print("--- 正在创建最终版探索家Agent ---")
 
-    llm = ChatTongyi(model_name="qwen-plus", dashscope_api_key=DASHSCOPE_API_KEY, temperature=0.7)
+    llm = llm or get_chat_model()
 
-    tools = [search_place_info, tavily_search]
+    tools = [search_place_info, find_nearby_places, tavily_search]
 
     prompt = ChatPromptTemplate.from_messages([
         (
@@ -27,6 +27,8 @@ def create_explorer_agent():
             **你的工作流程与核心规则**:
 
             1.  **主动探索**: 当用户提出开放性问题时，使用 `tavily_search` 工具进行网络搜索，获取丰富的推荐信息。
+                -   `tavily_search` 返回的 `candidate_places` 是从搜索结果中提取的候选地点，可以直接拿来推荐和核实，不必为同一个问题换个说法重复搜索。
+                -   对于“XX附近有什么好吃的/好玩的”这类问题，先调用 `find_nearby_places`（本地地点库，不消耗网络请求）；结果为空或不够时再用 `tavily_search`。
 
             2.  **统一核实所有地点**:
                 -   在与用户的对话中，你需要识别出 **所有代表地理位置的实体**，这包括：**必去景点、指定餐厅、酒店、抵达车站/机场、离开车站/机场**。
@@ -59,7 +61,8 @@ def create_explorer_agent():
     ])
 
     agent = create_tool_calling_agent(llm, tools, prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True, name="探索家")
+    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True, name="探索家",
+                                   trim_intermediate_steps=budget_observations)
 
     print("✅ 最终版探索家Agent创建成功！")
     return agent_executor
\ No newline at end of file
@@ -1,8 +1,17 @@
 # explorer_tools.py (V3 - 手动封装最终版)
 
-from langchain_core.tools import tool
-from tavily import TavilyClient  # 我们只使用这个最底层的、最稳定的导入
-from config import TAVILY_API_KEY
+import json
+import threading
+import time
+
+from langchain_core.tools import StructuredTool
+from config import (TAVILY_API_KEY, TAVILY_SEARCH_DEPTH, TAVILY_MAX_RESULTS, TAVILY_CACHE_TTL,
+                    TAVILY_CACHE_MAX_ENTRIES, TAVILY_TOKEN_BUDGET)
+from api_recorder import api_recorder, request_key
+from cache_store import PersistentTTLCache
+from search_digest import condense_results, normalize_query
+from single_flight import SingleFlight
+from tracing import annotate
 from typing import List, Dict, Any
 
 # 检查Tavily API Key是否存在
@@ -12,45 +21,150 @@ if not TAVILY_API_KEY:
         "请在 .env 文件中添加 TAVILY_API_KEY='tvly-xxxxxxxxxx'。"
     )
 
-# 初始化底层的Tavily客户端
-# 我们只在模块加载时初始化一次，以提高效率
-try:
-    tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
-    print("✅ 底层Tavily客户端初始化成功！")
-except Exception as e:
-    raise RuntimeError(f"无法初始化Tavily客户端，请检查API Key或网络。错误: {e}")
+# 底层的Tavily客户端在第一次搜索时才初始化(进程内只初始化一次)，
+# 这样只和规划师对话、从不搜索的会话不必为它付出导入和初始化的开销
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(kind: str):
+    with _clients_lock:
+        if kind not in _clients:
+            try:
+                from tavily import TavilyClient, AsyncTavilyClient  # 我们只使用这个最底层的、最稳定的导入
+                # 异步客户端: Agent以异步方式运行时，同一步里的多个搜索可以并发执行
+                client_class = AsyncTavilyClient if kind == "async" else TavilyClient
+                _clients[kind] = client_class(api_key=TAVILY_API_KEY)
+                print(f"✅ 底层Tavily客户端({kind})初始化成功！")
+            except Exception as e:
+                raise RuntimeError(f"无法初始化Tavily客户端，请检查API Key或网络。错误: {e}")
+        return _clients[kind]
+
+
+def get_tavily_client():
+    return _get_client("sync")
+
+
+def get_async_tavily_client():
+    return _get_client("async")
+
+
+# 搜索参数固定，录制/回放时与查询词一起构成请求键
+# search_depth='advanced' 可以获取更丰富的结果
+_SEARCH_OPTIONS = {"search_depth": TAVILY_SEARCH_DEPTH, "max_results": TAVILY_MAX_RESULTS}
+
+# 搜索结果缓存: 以归一化后的查询词为键，所有会话共享；保存原始结果，精简在读取后进行(调整预算不需要清缓存)
+search_cache = PersistentTTLCache("tavily", ttl_seconds=TAVILY_CACHE_TTL, max_entries=TAVILY_CACHE_MAX_ENTRIES)
+
+# 多个会话同时搜索同一个查询词时只请求一次Tavily
+tavily_flight = SingleFlight("tavily")
+
+
+def _search(query: str) -> Dict[str, Any]:
+    params = {"query": query, **_SEARCH_OPTIONS}
+    return tavily_flight.do(request_key("tavily", "search", params), _search_upstream, params)
+
+
+async def _asearch(query: str) -> Dict[str, Any]:
+    params = {"query": query, **_SEARCH_OPTIONS}
+    return await tavily_flight.ado(request_key("tavily", "search", params), _asearch_upstream, params)
+
+
+def _search_upstream(params: Dict[str, Any]) -> Dict[str, Any]:
+    if api_recorder.replaying:
+        return api_recorder.replay("tavily", "search", params)
+    started = time.perf_counter()
+    response = get_tavily_client().search(**params)
+    if api_recorder.recording:
+        api_recorder.record("tavily", "search", params, response, elapsed_ms=(time.perf_counter() - started) * 1000)
+    return response
 
 
-@tool
-def tavily_search(query: str) -> List[Dict[str, Any]]:
+async def _asearch_upstream(params: Dict[str, Any]) -> Dict[str, Any]:
+    if api_recorder.replaying:
+        return await api_recorder.areplay("tavily", "search", params)
+    started = time.perf_counter()
+    response = await get_async_tavily_client().search(**params)
+    if api_recorder.recording:
+        api_recorder.record("tavily", "search", params, response, elapsed_ms=(time.perf_counter() - started) * 1000)
+    return response
+
+
+# 查询词归一化规则变化时递增，按旧规则合并的缓存条目自然失效
+_SEARCH_CACHE_VERSION = 2
+
+
+def search_cache_key(query: str) -> str:
+    return f"v{_SEARCH_CACHE_VERSION}|{TAVILY_SEARCH_DEPTH}|{TAVILY_MAX_RESULTS}|{normalize_query(query)}"
+
+
+def _cached_search(query: str):
+    print(f"--- 🛠️ 调用手动封装的搜索工具 [tavily_search]: 查询 '{query}' ---")
+    cache_key = search_cache_key(query)
+    hit, cached = search_cache.get(cache_key)
+    annotate(cache_hits=int(hit), cache_misses=int(not hit))
+    if hit:
+        print(f"--- ⚡ [tavily_search] 缓存命中: '{query}' ({cache_key}) ---")
+    return cache_key, (json.loads(cached) if hit and cached else None)
+
+
+def _store_search(cache_key: str, response: Dict[str, Any]) -> List[Dict[str, Any]]:
+    results = response.get('results', [])
+    if results:
+        # 只保存需要的字段，没有结果时不缓存(可能只是暂时的)
+        search_cache.set(cache_key, json.dumps([{k: r.get(k, '') for k in ('title', 'url', 'content')} for r in results],
+                                               ensure_ascii=False, separators=(',', ':')))
+    return results
+
+
+def _tavily_search(query: str) -> Dict[str, Any]:
     """
     一个网络搜索引擎工具，可以用来查询各种实时信息，如“xx有什么好玩的？”或“xx的背景知识”。
     这是探索未知信息时的首选工具。
     参数:
     - query: 你想要搜索的关键词或问题。
-    返回: 一个包含多个搜索结果的列表，每个结果都是一个包含'title', 'url', 'content'的字典。
+    返回: {"results": [{"title", "url", "content"}, ...], "candidate_places": [...]}。
+    results 已经去掉重复的网页和段落；candidate_places 是从结果中提取的候选地点名称，坐标仍需用 search_place_info 核实。
     """
-    print(f"--- 🛠️ 调用手动封装的搜索工具 [tavily_search]: 查询 '{query}' ---")
-    try:
-        # 使用底层客户端执行搜索
-        # search_depth='advanced' 可以获取更丰富的结果
-        response = tavily_client.search(query=query, search_depth="advanced", max_results=5)
+    cache_key, results = _cached_search(query)
+    if results is None:
+        try:
+            # 使用底层客户端执行搜索(或从录制库回放)
+            results = _store_search(cache_key, _search(query))
+        except Exception as e:
+            print(f"--- ❌ [tavily_search] 错误: 在执行搜索时发生异常: {e} ---")
+            # 在工具出错时，返回错误信息，让Agent知道发生了什么
+            return {"error": f"搜索时发生错误: {e}"}
+    return _digest(query, results)
+
 
-        # 我们只返回最重要的 'results' 部分
-        results = response.get('results', [])
+async def _atavily_search(query: str) -> Dict[str, Any]:
+    cache_key, results = _cached_search(query)
+    if results is None:
+        try:
+            results = _store_search(cache_key, await _asearch(query))
+        except Exception as e:
+            print(f"--- ❌ [tavily_search] 错误: 在执行搜索时发生异常: {e} ---")
+            return {"error": f"搜索时发生错误: {e}"}
+    return _digest(query, results)
+
+
+def _digest(query: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    raw_chars = sum(len(str(r.get('content', ''))) for r in results)
+    condensed, places = condense_results(results, TAVILY_TOKEN_BUDGET)
+    payload_chars = sum(len(r['content']) for r in condensed)
+    annotate(results=len(condensed), payload_chars=payload_chars, raw_chars=raw_chars)
+
+    if not condensed:
+        print(f"--- ⚠️ [tavily_search] 警告: 查询 '{query}' 没有返回结果。---")
+    else:
+        print(f"--- ✅ [tavily_search] 成功: 查询 '{query}' 返回了 {len(condensed)} 条结果"
+              f"(正文 {raw_chars} -> {payload_chars} 字)，候选地点 {len(places)} 个。---")
 
-        if not results:
-            print(f"--- ⚠️ [tavily_search] 警告: 查询 '{query}' 没有返回结果。---")
-        else:
-            # LangChain Agent能很好地处理字典列表
-            print(f"--- ✅ [tavily_search] 成功: 查询 '{query}' 返回了 {len(results)} 条结果。---")
+    return {"results": condensed, "candidate_places": places}
 
-        return results
 
-    except Exception as e:
-        print(f"--- ❌ [tavily_search] 错误: 在执行搜索时发生异常: {e} ---")
-        # 在工具出错时，返回一个包含错误信息的列表，让Agent知道发生了什么
-        return [{"error": f"搜索时发生错误: {e}"}]
+tavily_search = StructuredTool.from_function(func=_tavily_search, coroutine=_atavily_search, name="tavily_search")
 
 
 # 将我们手动创建的工具导出，给其他文件使用
@@ -70,8 +184,9 @@ if __name__ == '__main__':
     search_results = search_tool.invoke({"query": test_query})
 
     print("\n--- 工具返回的结果 ---")
-    if search_results and not search_results[0].get("error"):
-        for i, res in enumerate(search_results):
+    if search_results.get("results"):
+        print(f"候选地点: {search_results['candidate_places']}")
+        for i, res in enumerate(search_results["results"]):
             print(f"\n[结果 {i + 1}]")
             print(f"  标题: {res.get('title')}")
             print(f"  链接: {res.get('url')}")
@@ -0,0 +1,176 @@
+# geometry_store.py (路线几何的服务端存储 - 简化 + 差分/变长整数压缩，按会话隔离)
+
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import GEOMETRY_SIMPLIFY_TOLERANCE_M, GEOMETRY_MAX_ROUTES_PER_SESSION, GEOMETRY_MAX_SESSIONS
+from session_context import get_session_id
+
+Point = Tuple[float, float]  # (经度, 纬度)
+
+# 高德坐标精确到小数点后6位，编码时按 1e-6 度量化为整数
+_SCALE = 1_000_000
+_METERS_PER_DEGREE = 111_320.0
+
+
+def parse_polyline(polyline: str) -> List[Point]:
+    """把高德的 "lng,lat;lng,lat;..." 字符串解析为坐标列表，跳过格式不正确的点。"""
+    points = []
+    for pair in polyline.split(';'):
+        parts = pair.split(',')
+        if len(parts) == 2:
+            try:
+                points.append((float(parts[0]), float(parts[1])))
+            except ValueError:
+                continue
+    return points
+
+
+def simplify(points: Sequence[Point], tolerance_m: float) -> List[Point]:
+    """
+    Douglas-Peucker 折线简化(迭代实现，避免长路线递归过深)。
+    在局部等距投影下计算点到线段的距离，tolerance_m 以米为单位。
+    """
+    if len(points) < 3 or tolerance_m <= 0:
+        return list(points)
+    cos_lat = math.cos(math.radians(sum(lat for _, lat in points) / len(points)))
+    xy = [(lng * _METERS_PER_DEGREE * cos_lat, lat * _METERS_PER_DEGREE) for lng, lat in points]
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = xy[first], xy[last]
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+        farthest, max_dist = -1, tolerance_m
+        for i in range(first + 1, last):
+            px, py = xy[i]
+            if length_sq == 0:
+                dist = math.hypot(px - x1, py - y1)
+            else:
+                t = max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / length_sq))
+                dist = math.hypot(px - (x1 + t * dx), py - (y1 + t * dy))
+            if dist > max_dist:
+                farthest, max_dist = i, dist
+        if farthest > 0:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def encode_points(points: Sequence[Point]) -> bytes:
+    """量化到1e-6度后做差分，再经 zigzag + varint 编码；典型的城市路线每个点只需3~4个字节。"""
+    out = bytearray()
+    prev_lng = prev_lat = 0
+    for lng, lat in points:
+        ilng, ilat = round(lng * _SCALE), round(lat * _SCALE)
+        for delta in (ilng - prev_lng, ilat - prev_lat):
+            value = (delta << 1) ^ (delta >> 63)
+            while value >= 0x80:
+                out.append((value & 0x7F) | 0x80)
+                value >>= 7
+            out.append(value)
+        prev_lng, prev_lat = ilng, ilat
+    return bytes(out)
+
+
+def decode_points(data: bytes) -> List[Point]:
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append((value >> 1) ^ -(value & 1))
+        value = shift = 0
+    points = []
+    lng = lat = 0
+    for i in range(0, len(values) - 1, 2):
+        lng += values[i]
+        lat += values[i + 1]
+        points.append((lng / _SCALE, lat / _SCALE))
+    return points
+
+
+def decode_points_array(data: bytes) -> np.ndarray:
+    """decode_points 的向量化版本，返回形状为 (N, 2) 的 [经度, 纬度] 数组，用于批量渲染。"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if raw.size == 0:
+        return np.empty((0, 2))
+    ends = (raw & 0x80) == 0
+    value_index = np.concatenate(([0], np.cumsum(ends)[:-1]))
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    shifts = (np.arange(raw.size) - starts[value_index]) * 7
+    values = np.zeros(int(ends.sum()), dtype=np.int64)
+    np.add.at(values, value_index, (raw & 0x7F).astype(np.int64) << shifts)
+    deltas = (values >> 1) ^ -(values & 1)
+    pairs = deltas[: deltas.size // 2 * 2].reshape(-1, 2)
+    return np.cumsum(pairs, axis=0) / _SCALE
+
+
+class GeometryStore:
+    """
+    进程内的路线几何存储。polyline 不再进入LLM的上下文，工具只返回一个短的 route_id；
+    生成地图时再凭 route_id 取回坐标。数据按会话隔离，两级都按LRU淘汰。
+    """
+
+    def __init__(self, max_routes_per_session: int = GEOMETRY_MAX_ROUTES_PER_SESSION,
+                 max_sessions: int = GEOMETRY_MAX_SESSIONS, tolerance_m: float = GEOMETRY_SIMPLIFY_TOLERANCE_M):
+        self.max_routes_per_session = max_routes_per_session
+        self.max_sessions = max_sessions
+        self.tolerance_m = tolerance_m
+        self._sessions: "OrderedDict[str, OrderedDict[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"routes": 0, "raw_bytes": 0, "stored_bytes": 0}
+
+    def put(self, polyline: str, session_id: Optional[str] = None) -> Optional[str]:
+        """保存一条 polyline，返回 route_id；空的 polyline 返回 None。相同的几何得到相同的 route_id。"""
+        points = parse_polyline(polyline or "")
+        if not points:
+            return None
+        encoded = encode_points(simplify(points, self.tolerance_m))
+        route_id = "r" + hashlib.blake2b(encoded, digest_size=5).hexdigest()
+        session_id = session_id or get_session_id()
+        with self._lock:
+            routes = self._sessions.setdefault(session_id, OrderedDict())
+            self._sessions.move_to_end(session_id)
+            if route_id not in routes:
+                self._stats["routes"] += 1
+                self._stats["raw_bytes"] += len(polyline.encode())
+                self._stats["stored_bytes"] += len(encoded)
+            routes[route_id] = encoded
+            routes.move_to_end(route_id)
+            while len(routes) > self.max_routes_per_session:
+                routes.popitem(last=False)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return route_id
+
+    def get(self, route_id: str, session_id: Optional[str] = None) -> Optional[List[Point]]:
+        with self._lock:
+            encoded = self._sessions.get(session_id or get_session_id(), {}).get(route_id)
+        return decode_points(encoded) if encoded is not None else None
+
+    def get_array(self, route_id: str, session_id: Optional[str] = None) -> Optional[np.ndarray]:
+        with self._lock:
+            encoded = self._sessions.get(session_id or get_session_id(), {}).get(route_id)
+        return decode_points_array(encoded) if encoded is not None else None
+
+    def drop_session(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, sessions=len(self._sessions))
+
+
+geometry_store = GeometryStore()
@@ -0,0 +1,118 @@
+# history_manager.py (长对话的上下文预算 - 历史压缩、旧行程快照、工具结果截断)
+
+import re
+from typing import Any, List, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from config import (HISTORY_TOKEN_BUDGET, HISTORY_KEEP_RECENT_MESSAGES, OBSERVATION_MAX_CHARS,
+                    SCRATCHPAD_FULL_STEPS)
+
+# 探索家交给规划师的结构化摘要，永远原样保留
+HANDOFF_MARKER = "我已经为您整理好了所有精确信息"
+# 这些工具的结果要被模型原样引用(行程时间表、换乘步骤、Markdown行程单)，草稿区里从不截断
+VERBATIM_TOOLS = {"optimize_itinerary", "get_route_info", "render_itinerary", "edit_itinerary"}
+
+_CJK = re.compile(r'[　-〿㐀-鿿＀-￯]')
+_DAY_HEADER = re.compile(r'(第\s*[一二三四五六七八九十\d]+\s*天|Day\s*\d+)', re.IGNORECASE)
+_TIME_SLOT = re.compile(r'(\d{1,2}:\d{2})\s*[-–~—至到]+\s*(\d{1,2}:\d{2})\s*[:：|]?\s*(.*)')
+_MARKDOWN = re.compile(r'[*#>`|]+')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数: 中文约每字1个token，其余字符约每4个1个token。不需要精确，只用于预算控制。"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _message_tokens(message: BaseMessage) -> int:
+    return estimate_tokens(message.content if isinstance(message.content, str) else str(message.content)) + 4
+
+
+def is_itinerary(text: str) -> bool:
+    """带有多个时间段(例如 "09:00 - 11:00")的回复视为一份完整的行程单。"""
+    return len(_TIME_SLOT.findall(text)) >= 4
+
+
+def snapshot_itinerary(text: str, max_chars_per_item: int = 24) -> str:
+    """把一份Markdown行程单压缩为结构化快照: 每天一行，只保留时间段和活动名称，去掉交通细节。"""
+    days: List[Tuple[str, List[str]]] = []
+    for line in text.splitlines():
+        header = _DAY_HEADER.search(line)
+        slot = _TIME_SLOT.search(line)
+        if header and not slot:
+            days.append((header.group(1).replace(' ', ''), []))
+            continue
+        if slot:
+            if not days:
+                days.append(("行程", []))
+            title = _MARKDOWN.sub('', slot.group(3)).strip().lstrip(':：-— ')[:max_chars_per_item]
+            days[-1][1].append(f"{slot.group(1)}-{slot.group(2)} {title}".strip())
+    return "\n".join(f"{day}: " + "; ".join(items) for day, items in days if items)
+
+
+def _superseded(message: BaseMessage, keep_snapshot: bool) -> BaseMessage:
+    if not keep_snapshot:
+        return AIMessage(content="[更早版本的行程，已被后面的版本取代，此处省略]")
+    snapshot = snapshot_itinerary(message.content)
+    return AIMessage(content=f"[上一版行程(已被后面的版本取代)，结构化快照如下]\n{snapshot}")
+
+
+def _summarize(dropped: Sequence[BaseMessage], max_tokens: int) -> BaseMessage:
+    """把较早的对话压缩成一条摘要(抽取式，不额外调用模型)：保留用户的诉求，超出预算时从最早的开始丢弃。"""
+    lines = [f"用户: {' '.join(str(m.content).split())[:80]}" for m in dropped if isinstance(m, HumanMessage)]
+    summary = "[较早的对话摘要]\n" + "\n".join(lines)
+    while estimate_tokens(summary) > max_tokens and len(lines) > 1:
+        lines.pop(0)
+        summary = "[较早的对话摘要]\n" + "\n".join(lines)
+    return AIMessage(content=summary)
+
+
+def compact_history(messages: Sequence[BaseMessage], token_budget: int = HISTORY_TOKEN_BUDGET,
+                    keep_recent: int = HISTORY_KEEP_RECENT_MESSAGES) -> List[BaseMessage]:
+    """
+    返回一份适合作为 chat_history 传给Agent的压缩副本(不修改界面上显示的原始历史):
+    1. 只有最新的一份完整行程单原样保留，上一版替换为结构化快照，更早的版本替换为一行占位；
+    2. 总量仍超出 token_budget 时，把最近 keep_recent 条以外的旧消息合并为一条摘要；
+       探索家交接的结构化摘要(HANDOFF_MARKER)始终原样保留。
+    """
+    messages = list(messages)
+    plans = [i for i, m in enumerate(messages)
+             if isinstance(m, AIMessage) and isinstance(m.content, str) and is_itinerary(m.content)]
+    latest_plan = plans[-1] if plans else None
+    # 只有最新一版行程原样保留；上一版留一个结构化快照(便于对比修改)，更早的版本只留一行占位
+    replaced = {i: _superseded(messages[i], keep_snapshot=(n == len(plans) - 2)) for n, i in enumerate(plans[:-1])}
+    compacted = [replaced.get(i, m) for i, m in enumerate(messages)]
+
+    if sum(_message_tokens(m) for m in compacted) <= token_budget or len(compacted) <= keep_recent:
+        return compacted
+
+    split = len(compacted) - keep_recent
+    if latest_plan is not None and latest_plan < split:
+        # 最新的行程是后续修改的基础，连同它之后的消息一起保留
+        split = latest_plan
+    old, recent = compacted[:split], compacted[split:]
+    pinned = [m for m in old if isinstance(m.content, str) and HANDOFF_MARKER in m.content]
+    dropped = [m for m in old if not any(m is p for p in pinned)]
+    if not dropped:
+        return compacted
+    remaining = token_budget - sum(_message_tokens(m) for m in pinned + recent)
+    summary = _summarize(dropped, max(200, min(remaining, token_budget // 4)))
+    return pinned + [summary] + recent
+
+
+def budget_observations(steps: List[Tuple[Any, Any]]) -> List[Tuple[Any, Any]]:
+    """
+    用作 AgentExecutor 的 trim_intermediate_steps: 最近 SCRATCHPAD_FULL_STEPS 步的工具结果保持完整，
+    更早的工具结果截断到 OBSERVATION_MAX_CHARS 个字符，避免一轮对话内的草稿区无限增长。
+    VERBATIM_TOOLS 中的工具结果始终保持完整。
+    """
+    cutoff = len(steps) - SCRATCHPAD_FULL_STEPS
+    trimmed = []
+    for i, (action, observation) in enumerate(steps):
+        if i < cutoff and getattr(action, "tool", None) not in VERBATIM_TOOLS:
+            text = observation if isinstance(observation, str) else str(observation)
+            if len(text) > OBSERVATION_MAX_CHARS:
+                observation = f"{text[:OBSERVATION_MAX_CHARS]}…(已截断，原文共{len(text)}字)"
+        trimmed.append((action, observation))
+    return trimmed
@@ -0,0 +1,363 @@
+# itinerary_model.py (服务端的行程状态 - 每天的有序站点、交通段结果与时间表，修改后只重算受影响的部分)
+
+import copy
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from config import ITINERARY_MAX_SESSIONS
+from itinerary_optimizer import DayFrame, Place, TravelTimes, build_day_frames, insertion_cost, simulate_day
+from session_context import get_session_id
+
+Leg = Tuple[str, str]
+# 给定若干段 (起点坐标, 终点坐标)，按顺序返回路线结果(含 duration_minutes/steps/route_id)，无法规划时为None
+RouteFetcher = Callable[[List[Leg]], List[Optional[Dict]]]
+# 把修改指令里的地点(JSON对象)转换为 Place: make_place(item, kind)
+PlaceFactory = Callable[[Any, str], Place]
+
+# 补查交通段后，真实耗时可能让午餐/晚餐的位置变化而出现新的交通段，最多补查这么多轮
+_MAX_RESOLVE_ROUNDS = 3
+_MEALS = ('lunch', 'dinner')
+
+
+class ItineraryEditError(ValueError):
+    """修改指令无法执行(找不到目标地点、天数越界等)，错误信息会原样返回给模型。"""
+
+
+class Itinerary:
+    """
+    一个会话当前的行程: 每天的 DayFrame(有序景点、餐厅、夜间活动)、已查询过的交通段、推演出的时间表。
+    交通耗时优先使用已查询到的真实路线，其次使用优化时的路线矩阵(或直线估算)。
+    修改只重新推演受影响的天，并且只补查新出现的交通段；没变的交通段和时间表原样保留。
+    """
+
+    def __init__(self, city: str, mode: str, hotel: Place, frames: List[DayFrame], unscheduled: List[Place],
+                 estimates: TravelTimes, arrival: Optional[Place] = None, arrival_minute: Optional[int] = None,
+                 departure: Optional[Place] = None, departure_minute: Optional[int] = None):
+        self.city = city
+        self.mode = mode
+        self.hotel = hotel
+        self.frames = frames
+        self.unscheduled = unscheduled
+        self.arrival, self.arrival_minute = arrival, arrival_minute
+        self.departure, self.departure_minute = departure, departure_minute
+        self.estimates = estimates
+        self.legs: Dict[Leg, Optional[Dict]] = {}
+        self.days: List[Dict] = [{} for _ in frames]
+        self.overflow: List[float] = [0.0] * len(frames)
+        self.version = 1
+        self.lock = threading.RLock()
+        self._recompute(range(len(frames)))
+
+    # --- 交通耗时与推演 ---
+    def travel(self, a: Place, b: Place) -> int:
+        leg = self.legs.get((a.location, b.location))
+        if leg:
+            return int(leg['duration_minutes'])
+        return self.estimates(a, b)
+
+    def _refresh_bounds(self):
+        """酒店、抵达/离开或交通耗时变化后，重新计算每天的起止地点和可游玩时间(不动已安排的景点)。"""
+        bounds = build_day_frames(self.hotel, len(self.frames), self.travel, self.arrival, self.arrival_minute,
+                                  self.departure, self.departure_minute)
+        for frame, bound in zip(self.frames, bounds):
+            frame.start_place, frame.end_place = bound.start_place, bound.end_place
+            frame.start_minute, frame.spot_deadline = bound.start_minute, bound.spot_deadline
+            frame.arrival, frame.arrival_minute = bound.arrival, bound.arrival_minute
+            frame.departure_minute = bound.departure_minute
+
+    def _recompute(self, indexes: Iterable[int]):
+        self._refresh_bounds()
+        for i in sorted(set(indexes)):
+            self.days[i], self.overflow[i] = simulate_day(self.frames[i], self.frames[i].spots, self.travel)
+
+    def _day_legs(self, index: int) -> List[Leg]:
+        return [(item['origin'], item['destination']) for item in self.days[index]['schedule']
+                if item['type'] == 'travel']
+
+    def resolve(self, fetch: RouteFetcher, indexes: Optional[Iterable[int]] = None) -> Tuple[int, int]:
+        """
+        为指定的天(默认全部)补查还没有结果的交通段，拿到真实耗时后只重新推演包含这些段的天。
+        返回 (复用的交通段数, 新查询的交通段数)。
+        """
+        indexes = set(range(len(self.frames)) if indexes is None else indexes)
+        fetched = 0
+        for _ in range(_MAX_RESOLVE_ROUNDS):
+            pending = list(dict.fromkeys(leg for i in sorted(indexes) for leg in self._day_legs(i)
+                                         if leg not in self.legs))
+            if not pending:
+                break
+            for leg, result in zip(pending, fetch(pending)):
+                self.legs[leg] = result
+            fetched += len(pending)
+            touched = set(pending)
+            self._recompute(i for i in indexes if touched.intersection(self._day_legs(i)))
+        total = len({leg for i in indexes for leg in self._day_legs(i)})
+        return max(0, total - fetched), fetched
+
+    def plan(self) -> Dict:
+        """与 optimize_itinerary_plan 相同格式的结果。"""
+        return {
+            "days": self.days,
+            "unscheduled": [place.name for place in self.unscheduled],
+            "total_travel_minutes": sum(day["travel_minutes"] for day in self.days),
+            "estimated_legs": self.estimates.estimated_pairs,
+        }
+
+    def map_days(self) -> List[Dict]:
+        """generate_map_visualization / map_renderer 使用的按天数据: 有坐标的站点，以及已查询到路线的交通段。"""
+        result = []
+        for day in self.days:
+            spots = [{"name": item['name'], "location": item['location']}
+                     for item in day['schedule'] if item.get('location')]
+            routes = []
+            for item in day['schedule']:
+                leg = self.legs.get((item['origin'], item['destination'])) if item['type'] == 'travel' else None
+                if leg and leg.get('route_id'):
+                    routes.append({"route_id": leg['route_id']})
+            result.append({"day": day['day'], "spots": spots, "routes": routes})
+        return result
+
+    # --- 修改 ---
+    def _day_index(self, day: Any) -> int:
+        try:
+            index = int(day) - 1
+        except (TypeError, ValueError):
+            raise ItineraryEditError(f"无法识别的天数: {day!r}")
+        if not 0 <= index < len(self.frames):
+            raise ItineraryEditError(f"第{day}天不存在，行程共 {len(self.frames)} 天。")
+        return index
+
+    def _locate(self, name: Any) -> Tuple[str, Optional[int], Optional[int]]:
+        """
+        按名称找到一个已安排的地点，返回 (位置, 第几天的下标, 景点序号)。
+        位置为 spots / lunch / dinner / night / unscheduled；先精确匹配，再按唯一的包含关系匹配。
+        """
+        if not name:
+            raise ItineraryEditError("修改指令缺少 target(要修改的地点名称)。")
+        candidates = []
+        for frame in self.frames:
+            candidates += [('spots', frame.index, pos, place) for pos, place in enumerate(frame.spots)]
+            candidates += [(slot, frame.index, None, getattr(frame, slot)) for slot in ('lunch', 'dinner', 'night')
+                           if getattr(frame, slot) is not None]
+        candidates += [('unscheduled', None, pos, place) for pos, place in enumerate(self.unscheduled)]
+        for matches in ([c for c in candidates if c[3].name == name],
+                        [c for c in candidates if name in c[3].name or c[3].name in name]):
+            if len(matches) == 1:
+                return matches[0][:3]
+            if len(matches) > 1:
+                raise ItineraryEditError(f"'{name}' 匹配到多个地点: {'、'.join(c[3].name for c in matches)}，请写出完整名称。")
+        raise ItineraryEditError(f"行程中没有找到 '{name}'。")
+
+    def _take(self, name: Any) -> Tuple[Place, Set[int]]:
+        """把一个地点从行程中拿出来，返回 (地点, 受影响的天)。"""
+        slot, index, pos = self._locate(name)
+        if slot == 'unscheduled':
+            return self.unscheduled.pop(pos), set()
+        frame = self.frames[index]
+        if slot == 'spots':
+            return frame.spots.pop(pos), {index}
+        place = getattr(frame, slot)
+        setattr(frame, slot, None)
+        return place, {index}
+
+    def _insert(self, place: Place, day: Any = None) -> Set[int]:
+        """把景点插入到绕行最少的位置；没有指定天时优先选插入后仍然安排得下、且绕行最少的一天。"""
+        indexes = [self._day_index(day)] if day is not None else range(len(self.frames))
+        options = []
+        for i in indexes:
+            frame = self.frames[i]
+            cost, pos = insertion_cost(frame.spots, place, frame, self.travel)
+            trial = frame.spots[:pos] + [place] + frame.spots[pos:]
+            options.append((simulate_day(frame, trial, self.travel)[1] > 0, cost, i, pos))
+        *_, index, pos = min(options)
+        self.frames[index].spots.insert(pos, place)
+        return {index}
+
+    def _op_replace(self, edit: Dict, make_place: PlaceFactory) -> Set[int]:
+        slot, index, pos = self._locate(edit.get('target'))
+        kind = {'spots': 'spot', 'unscheduled': 'spot', 'night': 'night'}.get(slot, 'restaurant')
+        place = make_place(edit.get('place'), kind)
+        if slot == 'unscheduled':
+            self.unscheduled[pos] = place
+            return set()
+        if slot == 'spots':
+            self.frames[index].spots[pos] = place
+        else:
+            setattr(self.frames[index], slot, place)
+        return {index}
+
+    def _op_add(self, edit: Dict, make_place: PlaceFactory) -> Set[int]:
+        return self._insert(make_place(edit.get('place'), 'spot'), edit.get('day'))
+
+    def _op_remove(self, edit: Dict, make_place: PlaceFactory) -> Set[int]:
+        return self._take(edit.get('target'))[1]
+
+    def _op_move(self, edit: Dict, make_place: PlaceFactory) -> Set[int]:
+        if edit.get('day') is None:
+            raise ItineraryEditError("move 需要指定目标天数 day。")
+        slot, _, _ = self._locate(edit.get('target'))
+        if slot not in ('spots', 'unscheduled'):
+            raise ItineraryEditError("move 只能移动景点；餐厅和夜间活动请用 set_meal / set_night。")
+        place, affected = self._take(edit.get('target'))
+        return affected | self._insert(place, edit.get('day'))
+
+    def _op_swap(self, edit: Dict, make_place: PlaceFactory) -> Set[int]:
+        first, second = self._locate(edit.get('target')), self._locate(edit.get('with'))
+        if first[0] != 'spots' or second[0] != 'spots':
+            raise ItineraryEditError("swap 只能交换两个已安排的景点。")
+        a, b = self.frames[first[1]], self.frames[second[1]]
+        a.spots[first[2]], b.spots[second[2]] = b.spots[second[2]], a.spots[first[2]]
+        return {first[1], second[1]}
+
+    def _op_set_hotel(self, edit: Dict, make_place: PlaceFactory) -> Set[int]:
+        self.hotel = make_place(edit.get('place'), 'hotel')
+        return set(range(len(self.frames)))
+
+    def _op_set_meal(self, edit: Dict, make_place: PlaceFactory) -> Set[int]:
+        meal = edit.get('meal')
+        if meal not in _MEALS:
+            raise ItineraryEditError("set_meal 的 meal 必须是 lunch 或 dinner。")
+        index = self._day_index(edit.get('day'))
+        place = make_place(edit['place'], 'restaurant') if edit.get('place') else None
+        setattr(self.frames[index], meal, place)
+        return {index}
+
+    def _op_set_night(self, edit: Dict, make_place: PlaceFactory) -> Set[int]:
+        index = self._day_index(edit.get('day'))
+        if self.frames[index].is_departure_day:
+            raise ItineraryEditError(f"第{index + 1}天是离开的日子，不能安排夜间活动。")
+        self.frames[index].night = make_place(edit['place'], 'night') if edit.get('place') else None
+        return {index}
+
+    def _op_set_duration(self, edit: Dict, make_place: PlaceFactory) -> Set[int]:
+        slot, index, pos = self._locate(edit.get('target'))
+        try:
+            minutes = int(edit['minutes'])
+        except (KeyError, TypeError, ValueError):
+            raise ItineraryEditError("set_duration 需要整数的 minutes。")
+        place = self.frames[index].spots[pos] if slot == 'spots' else (
+            self.unscheduled[pos] if slot == 'unscheduled' else getattr(self.frames[index], slot))
+        place.dwell_minutes = max(0, minutes)
+        return {index} if index is not None else set()
+
+    OPERATIONS = ('replace', 'add', 'remove', 'move', 'swap', 'set_hotel', 'set_meal', 'set_night', 'set_duration')
+
+    def _snapshot(self):
+        frames = [copy.copy(frame) for frame in self.frames]
+        for frame in frames:
+            frame.spots = [copy.copy(place) for place in frame.spots]
+            frame.lunch, frame.dinner, frame.night = (copy.copy(place)
+                                                      for place in (frame.lunch, frame.dinner, frame.night))
+        return self.hotel, frames, [copy.copy(place) for place in self.unscheduled]
+
+    def apply(self, edits: Sequence[Dict], make_place: PlaceFactory, fetch: RouteFetcher) -> Dict:
+        """
+        依次执行修改指令(要么全部生效，要么出错时全部回滚)，然后只重新推演受影响的天、只补查新出现的交通段。
+        返回修改摘要: 版本号、受影响的天、每天的变化说明、复用/新查询的交通段数以及超时提醒。
+        """
+        with self.lock:
+            before = list(self.days)
+            snapshot = self._snapshot()
+            affected: Set[int] = set()
+            try:
+                for edit in edits:
+                    op = edit.get('op') if isinstance(edit, dict) else None
+                    if op not in self.OPERATIONS:
+                        raise ItineraryEditError(f"不支持的修改操作 {op!r}，可用的操作: {', '.join(self.OPERATIONS)}")
+                    affected |= getattr(self, f"_op_{op}")(edit, make_place)
+            except Exception:
+                self.hotel, self.frames, self.unscheduled = snapshot
+                raise
+            self._recompute(affected)
+            reused, fetched = self.resolve(fetch, affected)
+            changed = [i for i in sorted(affected) if before[i] != self.days[i]]
+            self.version += 1
+            return {
+                "version": self.version,
+                "changed_days": [i + 1 for i in changed],
+                "changes": [self._describe_change(before[i], self.days[i]) for i in changed],
+                "legs_reused": reused,
+                "legs_fetched": fetched,
+                "warnings": [f"第{i + 1}天的安排超出可用时间约{round(self.overflow[i])}分钟，建议移走一个景点"
+                             for i in sorted(affected) if self.overflow[i] > 0],
+            }
+
+    @staticmethod
+    def _describe_change(old: Dict, new: Dict) -> str:
+        def stops(day):
+            return [item['name'] for item in day['schedule'] if item['type'] not in ('travel', 'free')]
+
+        added = [name for name in stops(new) if name not in stops(old)]
+        removed = [name for name in stops(old) if name not in stops(new)]
+        parts = [f"新增 {'、'.join(added)}"] if added else []
+        parts += [f"移除 {'、'.join(removed)}"] if removed else []
+        if not parts:
+            parts.append("调整了游览顺序" if old['spots'] != new['spots'] else "时间表调整")
+        return (f"第{new['day']}天: {'；'.join(parts)}(交通共 {new['travel_minutes']} 分钟，"
+                f"原 {old['travel_minutes']} 分钟)")
+
+    # --- 渲染 ---
+    def to_markdown(self) -> str:
+        """渲染完整的行程单；交通段的步骤来自已查询到的路线结果(原样复制)，没有结果的段注明为估算。"""
+        lines = [f"# {self.city}{len(self.frames)}日行程"]
+        for day in self.days:
+            lines.append(f"\n## 第{day['day']}天")
+            for item in day['schedule']:
+                span = f"**{item['start']} - {item['end']}**"
+                if item['type'] == 'travel':
+                    leg = self.legs.get((item['origin'], item['destination']))
+                    details = [f"约{_minutes(item)}分钟"]
+                    if leg:
+                        details.append(f"{leg.get('distance_meters', 0)}米")
+                        if leg.get('cost_yuan'):
+                            details.append(f"{leg['cost_yuan']:g}元")
+                    else:
+                        details.append("耗时为估算")
+                    lines.append(f"- {span}: 交通 {item['from']} → {item['to']} ({'，'.join(details)})")
+                    lines += [f"  - {step}" for step in (leg or {}).get('steps', [])]
+                elif item['type'] == 'visit':
+                    lines.append(f"- {span}: 游览 {item['name']}")
+                elif item['type'] == 'night':
+                    lines.append(f"- {span}: 夜间活动 {item['name']}")
+                else:
+                    lines.append(f"- {span}: {item['name']}")
+            lines += [f"\n> ⚠️ {warning}" for warning in day['warnings']]
+        if self.unscheduled:
+            lines.append(f"\n**未能安排**: {'、'.join(place.name for place in self.unscheduled)}")
+        return "\n".join(lines)
+
+
+def _minutes(item: Dict) -> int:
+    start, end = (int(part[:2]) * 60 + int(part[3:]) for part in (item['start'], item['end']))
+    return end - start
+
+
+class ItineraryStore:
+    """进程内的行程状态，按会话保存各自当前的行程；会话数超过上限时按LRU淘汰。"""
+
+    def __init__(self, max_sessions: int = ITINERARY_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Itinerary]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, itinerary: Itinerary, session_id: Optional[str] = None):
+        with self._lock:
+            self._sessions[session_id or get_session_id()] = itinerary
+            self._sessions.move_to_end(session_id or get_session_id())
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def get(self, session_id: Optional[str] = None) -> Optional[Itinerary]:
+        with self._lock:
+            itinerary = self._sessions.get(session_id or get_session_id())
+            if itinerary is not None:
+                self._sessions.move_to_end(session_id or get_session_id())
+            return itinerary
+
+    def drop_session(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+itinerary_store = ItineraryStore()
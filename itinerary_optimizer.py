@@ -0,0 +1,478 @@
+# itinerary_optimizer.py (确定性行程优化引擎 - 分天 + 排序 + 时间表)
+
+import itertools
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# --- 规划规则 (与规划师提示词中的“时间计算规则”保持一致) ---
+DAY_START = 9 * 60                 # 日间活动从早上9:00开始
+DAY_END = 22 * 60                  # 晚间活动最晚到22:00
+LUNCH_WINDOW = (12 * 60, 14 * 60)  # 午餐时间窗口
+DINNER_WINDOW = (18 * 60, 20 * 60)  # 晚餐时间窗口
+SPOT_MINUTES = 120                 # 普通景点游玩时长
+LARGE_PARK_MINUTES = 240           # 大型公园游玩时长
+CHECK_IN_MINUTES = 60              # 办理入住
+LUGGAGE_MINUTES = 30               # 取行李
+RESTAURANT_MINUTES = 90            # 指定餐厅用餐
+FREE_MEAL_MINUTES = 60             # 未指定餐厅时预留的自由用餐时间
+NIGHT_MINUTES = 120                # 夜间活动默认时长
+TRAIN_BUFFER_MINUTES = 60          # 火车提前1小时到站
+FLIGHT_BUFFER_MINUTES = 120        # 飞机提前2小时到机场
+LARGE_PARK_KEYWORDS = ('乐园', '海洋公园', '海洋世界', '极地', '动物园', '野生动物', '森林公园', '度假区', '主题公园')
+
+# 缺少真实路线数据时，用直线距离粗略估算耗时: 绕行系数、平均速度(米/分钟)与固定的候车/换乘时间
+_DETOUR_FACTOR = 1.4
+_ESTIMATE_SPEED = 300
+_ESTIMATE_OVERHEAD = 10
+
+
+@dataclass
+class Place:
+    name: str
+    location: str
+    kind: str = 'spot'             # spot / restaurant / night / hotel / station
+    dwell_minutes: Optional[int] = None
+    meal: Optional[str] = None     # 餐厅可指定 'lunch' 或 'dinner'
+
+    def __post_init__(self):
+        if self.dwell_minutes is None:
+            self.dwell_minutes = default_dwell_minutes(self)
+
+
+def default_dwell_minutes(place: Place) -> int:
+    if place.kind == 'spot':
+        return LARGE_PARK_MINUTES if any(word in place.name for word in LARGE_PARK_KEYWORDS) else SPOT_MINUTES
+    if place.kind == 'restaurant':
+        return RESTAURANT_MINUTES
+    if place.kind == 'night':
+        return NIGHT_MINUTES
+    return 0
+
+
+def parse_clock(text: Optional[str]) -> Optional[int]:
+    """从 "2025-08-01 10:30"、"10点半"、"下午3点" 之类的文本中取出当天的分钟数；无法解析时返回None。"""
+    if not text:
+        return None
+    match = re.search(r'(\d{1,2})\s*[:：点时]\s*(半|\d{1,2})?', str(text))
+    if not match:
+        return None
+    hour = int(match.group(1))
+    minute = 30 if match.group(2) == '半' else int(match.group(2) or 0)
+    if re.search(r'(下午|晚上|傍晚)', str(text)) and hour < 12:
+        hour += 12
+    if hour > 23 or minute > 59:
+        return None
+    return hour * 60 + minute
+
+
+def format_clock(minutes: float) -> str:
+    minutes = int(round(minutes))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _lng_lat(location: str) -> Tuple[float, float]:
+    lng, lat = (float(part) for part in location.split(','))
+    return lng, lat
+
+
+def haversine_meters(a: str, b: str) -> float:
+    lng1, lat1 = map(math.radians, _lng_lat(a))
+    lng2, lat2 = map(math.radians, _lng_lat(b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(h))
+
+
+class TravelTimes:
+    """
+    地点之间的交通耗时(分钟)。以 location 字符串为索引，矩阵中缺失(None)的组合按直线距离估算。
+    """
+
+    def __init__(self, locations: Sequence[str], minutes: Optional[Sequence[Sequence[Optional[float]]]] = None):
+        self._index = {location: i for i, location in enumerate(locations)}
+        self._minutes = minutes
+        self._memo: Dict[Tuple[str, str], int] = {}
+        self.estimated_pairs = 0
+
+    def __call__(self, a: Place, b: Place) -> int:
+        key = (a.location, b.location)
+        if key not in self._memo:
+            self._memo[key] = self._lookup(*key)
+        return self._memo[key]
+
+    def _lookup(self, a: str, b: str) -> int:
+        if a == b:
+            return 0
+        if self._minutes is not None:
+            i, j = self._index.get(a), self._index.get(b)
+            if i is not None and j is not None and self._minutes[i][j] is not None:
+                return int(math.ceil(self._minutes[i][j]))
+        self.estimated_pairs += 1
+        return int(math.ceil(_ESTIMATE_OVERHEAD + haversine_meters(a, b) * _DETOUR_FACTOR / _ESTIMATE_SPEED))
+
+
+@dataclass
+class DayFrame:
+    """一天的边界条件: 从哪里出发、到哪里结束、景点最早开始和最晚结束的时间。"""
+    index: int
+    start_place: Place
+    end_place: Place
+    start_minute: int
+    spot_deadline: int
+    arrival: Optional[Place] = None
+    arrival_minute: Optional[int] = None
+    departure_minute: Optional[int] = None
+    spots: List[Place] = field(default_factory=list)
+    lunch: Optional[Place] = None
+    dinner: Optional[Place] = None
+    night: Optional[Place] = None
+
+    @property
+    def is_departure_day(self) -> bool:
+        return self.departure_minute is not None
+
+    def has_lunch(self) -> bool:
+        return self.start_minute < LUNCH_WINDOW[1] and self.spot_deadline > LUNCH_WINDOW[0]
+
+    def has_dinner(self) -> bool:
+        if self.is_departure_day:
+            # 离开当天只有在出发前还来得及吃完晚餐(并预留1小时路程)时才安排
+            latest = self.departure_minute - _departure_buffer(self.end_place) - 60
+            return latest >= DINNER_WINDOW[0] + RESTAURANT_MINUTES
+        return True
+
+    def capacity(self) -> int:
+        lunch = RESTAURANT_MINUTES if self.lunch else FREE_MEAL_MINUTES
+        return max(0, self.spot_deadline - self.start_minute - (lunch if self.has_lunch() else 0))
+
+
+def _departure_buffer(station: Place) -> int:
+    return FLIGHT_BUFFER_MINUTES if '机场' in station.name else TRAIN_BUFFER_MINUTES
+
+
+def build_day_frames(hotel: Place, days: int, travel: TravelTimes,
+                     arrival: Optional[Place] = None, arrival_minute: Optional[int] = None,
+                     departure: Optional[Place] = None, departure_minute: Optional[int] = None) -> List[DayFrame]:
+    frames = []
+    for index in range(max(1, days)):
+        frame = DayFrame(index=index, start_place=hotel, end_place=hotel,
+                         start_minute=DAY_START, spot_deadline=DINNER_WINDOW[0])
+        if index == 0 and arrival is not None:
+            frame.arrival = arrival
+            frame.arrival_minute = arrival_minute if arrival_minute is not None else DAY_START
+            # 抵达 -> 取行李 -> 前往酒店 -> 办理入住，之后才开始游玩
+            ready = frame.arrival_minute + LUGGAGE_MINUTES + travel(arrival, hotel) + CHECK_IN_MINUTES
+            frame.start_minute = max(DAY_START, ready)
+        if index == max(1, days) - 1 and departure is not None:
+            frame.end_place = departure
+            frame.departure_minute = departure_minute if departure_minute is not None else DINNER_WINDOW[0]
+            latest = frame.departure_minute - _departure_buffer(departure) - travel(hotel, departure)
+            frame.spot_deadline = min(DINNER_WINDOW[0], int(latest))
+        frames.append(frame)
+    return frames
+
+
+# --- 单日排序: 最近邻 + 2-opt (固定起点和终点的开放路径) ---
+def _path_cost(sequence: Sequence[Place], start: Place, end: Place, travel: TravelTimes) -> float:
+    stops = [start, *sequence, end]
+    return sum(travel(stops[i], stops[i + 1]) for i in range(len(stops) - 1))
+
+
+def order_day(spots: Sequence[Place], start: Place, end: Place, travel: TravelTimes) -> List[Place]:
+    remaining = list(spots)
+    sequence: List[Place] = []
+    current = start
+    while remaining:
+        nearest = min(remaining, key=lambda place: (travel(current, place), place.name))
+        sequence.append(nearest)
+        remaining.remove(nearest)
+        current = nearest
+
+    best_cost = _path_cost(sequence, start, end, travel)
+    improved = True
+    while improved:
+        improved = False
+        for i, j in itertools.combinations(range(len(sequence)), 2):
+            candidate = sequence[:i] + sequence[i:j + 1][::-1] + sequence[j + 1:]
+            cost = _path_cost(candidate, start, end, travel)
+            if cost < best_cost - 1e-6:
+                sequence, best_cost, improved = candidate, cost, True
+    return sequence
+
+
+# --- 分天: 带容量约束的聚类 ---
+def _cluster_spots(spots: List[Place], frames: List[DayFrame], travel: TravelTimes) -> List[List[Place]]:
+    """
+    以远点优先选出种子，再按“遗憾值”(最优与次优簇的代价差)从大到小，把景点分配到容量允许且最近的簇，
+    最后迭代几轮把种子替换为簇内的中心点。返回的簇与天数一一对应之前还需要 _assign_clusters_to_days。
+    """
+    usable = [frame for frame in frames if frame.capacity() > 0] or frames
+    k = min(len(usable), len(spots))
+    if k == 0:
+        return []
+    ordered = sorted(spots, key=lambda place: place.name)
+    # 按下标选种子: Place 按值比较，重复的景点用 "not in" 判断会提前耗尽候选
+    chosen = [max(range(len(ordered)), key=lambda i: travel(frames[0].start_place, ordered[i]))]
+    while len(chosen) < k:
+        chosen.append(max((i for i in range(len(ordered)) if i not in chosen),
+                          key=lambda i: min(travel(ordered[c], ordered[i]) for c in chosen)))
+    seeds = [ordered[i] for i in chosen]
+    capacities = sorted((frame.capacity() for frame in usable), reverse=True)[:k]
+
+    clusters: List[List[Place]] = []
+    for _ in range(5):
+        clusters = [[] for _ in seeds]
+        loads = [0.0] * len(seeds)
+
+        def regret(place: Place) -> float:
+            costs = sorted(travel(seed, place) for seed in seeds)
+            return costs[1] - costs[0] if len(costs) > 1 else 0.0
+
+        for place in sorted(ordered, key=lambda p: (-regret(p), p.name)):
+            needed = place.dwell_minutes + 30
+            choices = sorted(range(len(seeds)), key=lambda c: (travel(seeds[c], place), c))
+            target = next((c for c in choices if loads[c] + needed <= capacities[c]), None)
+            if target is None:
+                target = min(range(len(seeds)), key=lambda c: (loads[c] - capacities[c], c))
+            clusters[target].append(place)
+            loads[target] += needed
+
+        new_seeds = [min(cluster, key=lambda p: (sum(travel(p, q) for q in cluster), p.name)) if cluster else seed
+                     for cluster, seed in zip(clusters, seeds)]
+        if new_seeds == seeds:
+            break
+        seeds = new_seeds
+    return clusters
+
+
+def _assign_clusters_to_days(clusters: List[List[Place]], frames: List[DayFrame], travel: TravelTimes):
+    """把簇分配到具体的某一天: 容量不足的惩罚 + 从当天起点出发/回到终点的绕行代价之和最小。"""
+    def cost(cluster: List[Place], frame: DayFrame) -> float:
+        if not cluster:
+            return 0.0
+        load = sum(place.dwell_minutes + 30 for place in cluster)
+        overflow = max(0.0, load - frame.capacity())
+        reach = min(travel(frame.start_place, place) for place in cluster)
+        leave = min(travel(place, frame.end_place) for place in cluster)
+        return overflow * 10 + reach + leave
+
+    padded = clusters + [[] for _ in range(len(frames) - len(clusters))]
+    if len(frames) <= 7:
+        best = min(itertools.permutations(range(len(frames))),
+                   key=lambda perm: sum(cost(padded[c], frames[d]) for d, c in enumerate(perm)))
+    else:
+        best, free = [], set(range(len(padded)))
+        for frame in frames:
+            choice = min(sorted(free), key=lambda c: cost(padded[c], frame))
+            best.append(choice)
+            free.remove(choice)
+    for day, cluster_index in enumerate(best):
+        frames[day].spots = list(padded[cluster_index])
+
+
+# --- 时间表推演 ---
+class _Timeline:
+    def __init__(self, frame: DayFrame, travel: TravelTimes):
+        self.frame = frame
+        self.travel = travel
+        self.items: List[Dict] = []
+        self.clock = float(frame.start_minute)
+        self.current = frame.start_place
+        self.travel_minutes = 0.0
+        self.warnings: List[str] = []
+
+    def add(self, kind: str, minutes: float, **fields):
+        self.items.append({"start": format_clock(self.clock), "end": format_clock(self.clock + minutes),
+                           "type": kind, **fields})
+        self.clock += minutes
+
+    def go(self, place: Place):
+        minutes = self.travel(self.current, place)
+        if minutes > 0:
+            self.add('travel', minutes, **{"from": self.current.name, "to": place.name,
+                                           "origin": self.current.location, "destination": place.location})
+            self.travel_minutes += minutes
+        self.current = place
+
+    def wait_until(self, minute: int, reason: str):
+        if self.clock < minute:
+            self.add('free', minute - self.clock, name=reason)
+
+    def meal(self, label: str, restaurant: Optional[Place], window: Tuple[int, int]):
+        if restaurant is not None:
+            self.go(restaurant)
+            self.wait_until(window[0] - 30, "自由活动")
+            self.add('meal', restaurant.dwell_minutes, name=f"{label}: {restaurant.name}",
+                     location=restaurant.location)
+        else:
+            self.wait_until(window[0] - 30, "自由活动")
+            self.add('meal', FREE_MEAL_MINUTES, name=f"{label}: 自由用餐")
+        if self.clock > window[1] + 30:
+            self.warnings.append(f"第{self.frame.index + 1}天的{label}结束时间({format_clock(self.clock)})超出了用餐窗口")
+
+
+def simulate_day(frame: DayFrame, sequence: Sequence[Place], travel: TravelTimes) -> Tuple[Dict, float]:
+    """
+    按规则推演一天的详细时间表。返回 (当天的时间表, 景点超出截止时间的分钟数)。
+    超时分钟数 > 0 表示当天安排不下，需要把某些景点挪到其他天。
+    """
+    timeline = _Timeline(frame, travel)
+    if frame.arrival is not None:
+        timeline.clock = frame.arrival_minute
+        timeline.current = frame.arrival
+        timeline.add('arrive', 0, name=f"抵达 {frame.arrival.name}", location=frame.arrival.location)
+        timeline.add('luggage', LUGGAGE_MINUTES, name="取行李")
+        timeline.go(frame.start_place)
+        timeline.add('check_in', CHECK_IN_MINUTES, name=f"办理入住: {frame.start_place.name}")
+        timeline.wait_until(frame.start_minute, "休息")
+
+    lunch_pending = frame.has_lunch()
+    lunch_minutes = frame.lunch.dwell_minutes if frame.lunch else FREE_MEAL_MINUTES
+    for place in sequence:
+        # 已到饭点，或者先去下一个景点会导致午餐无法在窗口内吃完时，先吃午餐
+        visit = travel(timeline.current, place) + place.dwell_minutes
+        late = timeline.clock + visit + lunch_minutes > LUNCH_WINDOW[1] + 30
+        if lunch_pending and (timeline.clock >= LUNCH_WINDOW[0] - 30 or late):
+            if timeline.clock >= LUNCH_WINDOW[0] - 60:
+                timeline.meal("午餐", frame.lunch, LUNCH_WINDOW)
+                lunch_pending = False
+        timeline.go(place)
+        timeline.add('visit', place.dwell_minutes, name=place.name, location=place.location)
+    if lunch_pending and timeline.clock < LUNCH_WINDOW[1]:
+        timeline.meal("午餐", frame.lunch, LUNCH_WINDOW)
+
+    if frame.is_departure_day:
+        limit = frame.departure_minute - _departure_buffer(frame.end_place) - travel(timeline.current, frame.end_place)
+        overflow = max(0.0, timeline.clock - limit)
+        if frame.has_dinner() and timeline.clock <= DINNER_WINDOW[1]:
+            timeline.meal("晚餐", frame.dinner, DINNER_WINDOW)
+        timeline.go(frame.end_place)
+        timeline.add('depart', 0, name=f"离开 {frame.end_place.name}，出发时间 {format_clock(frame.departure_minute)}",
+                     location=frame.end_place.location)
+        if timeline.clock > frame.departure_minute - _departure_buffer(frame.end_place):
+            timeline.warnings.append(f"第{frame.index + 1}天到达{frame.end_place.name}的时间过晚，可能赶不上出发")
+    else:
+        overflow = max(0.0, timeline.clock - frame.spot_deadline - 30)
+        timeline.meal("晚餐", frame.dinner, DINNER_WINDOW)
+        if frame.night is not None:
+            timeline.go(frame.night)
+            back = travel(frame.night, frame.end_place)
+            minutes = min(frame.night.dwell_minutes, max(0.0, DAY_END - back - timeline.clock))
+            timeline.add('night', minutes, name=frame.night.name, location=frame.night.location)
+        timeline.go(frame.end_place)
+        if timeline.clock > DAY_END:
+            timeline.warnings.append(f"第{frame.index + 1}天回到酒店的时间({format_clock(timeline.clock)})晚于22:00")
+
+    day = {"day": frame.index + 1, "spots": [place.name for place in sequence], "schedule": timeline.items,
+           "travel_minutes": round(timeline.travel_minutes), "warnings": timeline.warnings}
+    return day, overflow
+
+
+def insertion_cost(sequence: List[Place], place: Place, frame: DayFrame, travel: TravelTimes) -> Tuple[float, int]:
+    stops = [frame.start_place, *sequence, frame.end_place]
+    return min(((travel(stops[i], place) + travel(place, stops[i + 1]) - travel(stops[i], stops[i + 1]), i)
+                for i in range(len(stops) - 1)), key=lambda item: item[0])
+
+
+def _assign_meals_and_nights(frames: List[DayFrame], restaurants: Sequence[Place], nights: Sequence[Place],
+                             travel: TravelTimes):
+    """把指定餐厅放进绕行最少的午餐/晚餐空位，把夜间活动放进离当天晚餐地点最近的一晚。"""
+    for restaurant in restaurants:
+        slots = []
+        for frame in frames:
+            if restaurant.meal != 'dinner' and frame.has_lunch() and frame.lunch is None:
+                slots.append((insertion_cost(frame.spots, restaurant, frame, travel)[0], frame.index, 'lunch'))
+            if restaurant.meal != 'lunch' and frame.has_dinner() and frame.dinner is None:
+                anchor = frame.spots[-1] if frame.spots else frame.start_place
+                detour = travel(anchor, restaurant) + travel(restaurant, frame.end_place) - travel(anchor, frame.end_place)
+                slots.append((detour, frame.index, 'dinner'))
+        if slots:
+            _, index, meal = min(slots)
+            setattr(frames[index], meal, restaurant)
+
+    for night in nights:
+        options = [frame for frame in frames if not frame.is_departure_day and frame.night is None]
+        if not options:
+            break
+        best = min(options, key=lambda frame: (travel(frame.dinner or (frame.spots[-1] if frame.spots else frame.start_place), night)
+                                               + travel(night, frame.end_place), frame.index))
+        best.night = night
+
+
+def plan_frames(hotel: Place, spots: Sequence[Place], days: int, travel: TravelTimes,
+                arrival: Optional[Place] = None, arrival_minute: Optional[int] = None,
+                departure: Optional[Place] = None, departure_minute: Optional[int] = None,
+                restaurants: Sequence[Place] = (), night_activities: Sequence[Place] = ()
+                ) -> Tuple[List[DayFrame], List[Place]]:
+    """
+    行程优化的核心(纯计算，不访问网络):
+    1. 根据抵达/离开时间计算每天可用于游玩的时间；
+    2. 按交通耗时把景点聚类并分配到各天(带容量约束)；
+    3. 每天用最近邻 + 2-opt 求解游览顺序；
+    4. 安排指定餐厅与夜间活动；安排不下的景点会被挪到其他天或列入 unscheduled。
+    返回 (每天的 DayFrame，其中 spots 已按游览顺序排好; 未能安排的景点)。
+    """
+    frames = build_day_frames(hotel, days, travel, arrival, arrival_minute, departure, departure_minute)
+    _assign_clusters_to_days(_cluster_spots(list(spots), frames, travel), frames, travel)
+    _assign_meals_and_nights(frames, restaurants, night_activities, travel)
+
+    def simulate_all() -> Dict[int, Tuple[Dict, float]]:
+        return {frame.index: simulate_day(frame, order_day(frame.spots, frame.start_place, frame.end_place, travel),
+                                          travel) for frame in frames}
+
+    unscheduled: List[Place] = []
+    for _ in range(len(spots)):
+        results = simulate_all()
+        crowded = [frame for frame in frames if results[frame.index][1] > 0 and frame.spots]
+        if not crowded:
+            break
+        # 从最超时的一天里拿出“移除后节省最多”的景点，尝试放到还有余量的另一天
+        frame = max(crowded, key=lambda f: (results[f.index][1], -f.index))
+        sequence = order_day(frame.spots, frame.start_place, frame.end_place, travel)
+        victim = max(sequence, key=lambda place: (
+            place.dwell_minutes + _path_cost(sequence, frame.start_place, frame.end_place, travel)
+            - _path_cost([p for p in sequence if p is not place], frame.start_place, frame.end_place, travel),
+            place.name))
+        frame.spots.remove(victim)
+        targets = []
+        for other in frames:
+            if other is frame:
+                continue
+            trial = order_day(other.spots + [victim], other.start_place, other.end_place, travel)
+            if simulate_day(other, trial, travel)[1] == 0:
+                targets.append((insertion_cost(other.spots, victim, other, travel)[0], other.index))
+        if targets:
+            frames[min(targets)[1]].spots.append(victim)
+        else:
+            unscheduled.append(victim)
+
+    # 最后再尝试把未安排的景点塞进仍有空闲的某一天
+    for victim in list(unscheduled):
+        for _, index in sorted((insertion_cost(frame.spots, victim, frame, travel)[0], frame.index) for frame in frames):
+            frame = frames[index]
+            trial = order_day(frame.spots + [victim], frame.start_place, frame.end_place, travel)
+            if simulate_day(frame, trial, travel)[1] == 0:
+                frame.spots.append(victim)
+                unscheduled.remove(victim)
+                break
+
+    for frame in frames:
+        frame.spots = order_day(frame.spots, frame.start_place, frame.end_place, travel)
+    return frames, unscheduled
+
+
+def optimize_itinerary_plan(hotel: Place, spots: Sequence[Place], days: int, travel: TravelTimes,
+                            arrival: Optional[Place] = None, arrival_minute: Optional[int] = None,
+                            departure: Optional[Place] = None, departure_minute: Optional[int] = None,
+                            restaurants: Sequence[Place] = (), night_activities: Sequence[Place] = ()) -> Dict:
+    """行程优化主入口: plan_frames 分天排序后，推演每天的分钟级时间表。"""
+    frames, unscheduled = plan_frames(hotel, spots, days, travel, arrival, arrival_minute,
+                                      departure, departure_minute, restaurants, night_activities)
+    plan_days = [simulate_day(frame, frame.spots, travel)[0] for frame in frames]
+    return {
+        "days": plan_days,
+        "unscheduled": [place.name for place in unscheduled],
+        "total_travel_minutes": sum(day["travel_minutes"] for day in plan_days),
+        "estimated_legs": travel.estimated_pairs,
+    }
@@ -0,0 +1,22 @@
+# llm_provider.py (进程内共享的大模型客户端 - 所有会话、所有Agent共用)
+
+import threading
+
+from config import DASHSCOPE_API_KEY
+
+_chat_models = {}
+_lock = threading.Lock()
+
+
+def get_chat_model(model_name: str = "qwen-plus", temperature: float = 0.7):
+    """
+    返回按 (模型名, 温度) 缓存的聊天模型实例。客户端本身不保存对话状态，可以被所有会话安全共享；
+    langchain_community 的导入也推迟到第一次真正需要模型时。
+    """
+    key = (model_name, temperature)
+    with _lock:
+        if key not in _chat_models:
+            from langchain_community.chat_models.tongyi import ChatTongyi
+            _chat_models[key] = ChatTongyi(model_name=model_name, dashscope_api_key=DASHSCOPE_API_KEY,
+                                           temperature=temperature)
+        return _chat_models[key]
@@ -0,0 +1,197 @@
+# map_renderer.py (行程地图渲染 - NumPy批量解析 / 按缩放级别简化 / 每天一个GeoJSON图层 / 按会话输出)
+
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import folium
+import numpy as np
+
+from config import MAP_OUTPUT_DIR, MAP_SIMPLIFY_PIXELS, MAP_DETAIL_ZOOM_OFFSET
+from geometry_store import geometry_store, parse_polyline
+from session_context import get_session_id
+
+AMAP_TILES = 'https://webrd01.is.autonavi.com/appmaptile?lang=zh_cn&size=1&scale=1&style=8&x={x}&y={y}&z={z}'
+DAY_COLORS = ['#1f77b4', '#2ca02c', '#9467bd', '#ff7f0e', '#d62728', '#e377c2', '#8c564b']
+
+# 按默认视口(像素)估算把全部行程放进一屏时的缩放级别
+_VIEWPORT = (1000, 700)
+_EARTH_CIRCUMFERENCE_M = 40_075_016.686
+_METERS_PER_DEGREE = 111_320.0
+# 输出坐标保留5位小数(约1米)，足够地图显示，又能明显缩小页面
+_COORD_DECIMALS = 5
+
+
+def polyline_to_array(polyline: str) -> np.ndarray:
+    """一次性把 "lng,lat;lng,lat;..." 解析为 (N, 2) 数组；格式不规整时逐点解析并跳过坏点。"""
+    text = (polyline or "").strip().strip(';')
+    if not text:
+        return np.empty((0, 2))
+    try:
+        values = np.array(text.replace(';', ',').split(','), dtype=float)
+        if values.size % 2 == 0:
+            return values.reshape(-1, 2)
+    except ValueError:
+        pass
+    return np.array(parse_polyline(text), dtype=float).reshape(-1, 2)
+
+
+def fit_zoom(bounds: np.ndarray, viewport: Tuple[int, int] = _VIEWPORT) -> int:
+    """bounds 为 [[最小经度, 最小纬度], [最大经度, 最大纬度]]，返回能完整显示该范围的Web墨卡托缩放级别。"""
+    (min_lng, min_lat), (max_lng, max_lat) = bounds
+
+    def mercator_y(lat: float) -> float:
+        s = math.sin(math.radians(lat))
+        return math.log((1 + s) / (1 - s)) / (4 * math.pi)
+
+    width = max((max_lng - min_lng) / 360.0, 1e-9)
+    height = max(abs(mercator_y(max_lat) - mercator_y(min_lat)), 1e-9)
+    zoom = min(math.log2(viewport[0] / 256 / width), math.log2(viewport[1] / 256 / height))
+    return max(0, min(18, int(math.floor(zoom))))
+
+
+def meters_per_pixel(zoom: int, lat: float) -> float:
+    return _EARTH_CIRCUMFERENCE_M * math.cos(math.radians(lat)) / (256 * 2 ** zoom)
+
+
+def simplify_array(points: np.ndarray, tolerance_m: float) -> np.ndarray:
+    """Douglas-Peucker 简化的NumPy版本: 每一段的点到线段距离一次性向量化计算。"""
+    n = len(points)
+    if n < 3 or tolerance_m <= 0:
+        return points
+    cos_lat = math.cos(math.radians(float(points[:, 1].mean())))
+    xy = points * np.array([_METERS_PER_DEGREE * cos_lat, _METERS_PER_DEGREE])
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, segment = xy[first], xy[last] - xy[first]
+        inner = xy[first + 1:last] - start
+        length_sq = float(segment @ segment)
+        if length_sq == 0:
+            dist = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            t = np.clip(inner @ segment / length_sq, 0.0, 1.0)
+            offset = inner - t[:, None] * segment
+            dist = np.hypot(offset[:, 0], offset[:, 1])
+        farthest = int(dist.argmax())
+        if dist[farthest] > tolerance_m:
+            index = first + 1 + farthest
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return points[keep]
+
+
+def _route_points(route: Dict[str, Any], session_id: str) -> Optional[np.ndarray]:
+    if route.get('route_id'):
+        return geometry_store.get_array(route['route_id'], session_id)
+    # 兼容直接传入 polyline 字符串的旧格式
+    return polyline_to_array(route.get('polyline') or "")
+
+
+def _spot_point(spot: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    try:
+        lng, lat = (float(part) for part in str(spot['location']).split(','))
+    except (KeyError, ValueError):
+        return None
+    return lng, lat
+
+
+def build_day_layers(list_of_days: List[Dict[str, Any]], session_id: Optional[str] = None):
+    """
+    把按天组织的行程转换为每天一个 GeoJSON FeatureCollection(景点为 Point，路线为 LineString)。
+    路线按整体范围对应的缩放级别简化(多保留 MAP_DETAIL_ZOOM_OFFSET 级的细节，便于放大查看)。
+    返回 (图层列表, 整体范围 bounds, 找不到的 route_id 列表)。
+    """
+    session_id = session_id or get_session_id()
+    missing_routes: List[str] = []
+    days = []
+    all_points = []
+    for day_plan in list_of_days:
+        spots = [(spot.get('name', ''), point) for spot in day_plan.get('spots', [])
+                 if (point := _spot_point(spot)) is not None]
+        lines = []
+        for route in day_plan.get('routes', []):
+            if not route:
+                continue
+            points = _route_points(route, session_id)
+            if points is None:
+                missing_routes.append(route['route_id'])
+            elif len(points) >= 2:
+                lines.append(points)
+        all_points.append(np.array([point for _, point in spots], dtype=float).reshape(-1, 2))
+        all_points.extend(lines)
+        days.append((day_plan.get('day', len(days) + 1), spots, lines))
+
+    stacked = np.concatenate([points for points in all_points if len(points)] or [np.empty((0, 2))])
+    if not len(stacked):
+        return [], None, missing_routes
+    bounds = np.array([stacked.min(axis=0), stacked.max(axis=0)])
+    zoom = min(18, fit_zoom(bounds) + MAP_DETAIL_ZOOM_OFFSET)
+    tolerance_m = MAP_SIMPLIFY_PIXELS * meters_per_pixel(zoom, float(bounds[:, 1].mean()))
+
+    layers = []
+    for day, spots, lines in days:
+        features = []
+        for index, points in enumerate(lines, start=1):
+            coords = np.round(simplify_array(points, tolerance_m), _COORD_DECIMALS).tolist()
+            features.append({"type": "Feature", "properties": {"name": f"Day {day} 路线{index}"},
+                             "geometry": {"type": "LineString", "coordinates": coords}})
+        for name, (lng, lat) in spots:
+            features.append({"type": "Feature", "properties": {"name": name},
+                             "geometry": {"type": "Point",
+                                          "coordinates": [round(lng, _COORD_DECIMALS), round(lat, _COORD_DECIMALS)]}})
+        layers.append({"day": day, "geojson": {"type": "FeatureCollection", "features": features}})
+    return layers, bounds, missing_routes
+
+
+def render_trip_map(list_of_days: List[Dict[str, Any]], session_id: Optional[str] = None):
+    """生成 folium 地图对象，返回 (地图, 找不到的 route_id 列表)；没有任何可绘制的坐标时地图为 None。"""
+    layers, bounds, missing_routes = build_day_layers(list_of_days, session_id)
+    if bounds is None:
+        return None, missing_routes
+    center = bounds.mean(axis=0)
+    m = folium.Map(location=[center[1], center[0]], tiles=AMAP_TILES, attr='高德地图')
+    for i, layer in enumerate(layers):
+        color = DAY_COLORS[i % len(DAY_COLORS)]
+        folium.GeoJson(
+            layer['geojson'], name=f"Day {layer['day']}",
+            style_function=lambda feature, color=color: {"color": color, "weight": 5, "opacity": 0.8,
+                                                         "fillColor": color, "fillOpacity": 0.9},
+            marker=folium.CircleMarker(radius=7, weight=2),
+            tooltip=folium.GeoJsonTooltip(fields=["name"], labels=False),
+        ).add_to(m)
+    folium.LayerControl(collapsed=False).add_to(m)
+    (min_lng, min_lat), (max_lng, max_lat) = bounds
+    m.fit_bounds([[min_lat, min_lng], [max_lat, max_lng]])
+    return m, missing_routes
+
+
+def render_trip_map_html(list_of_days: List[Dict[str, Any]], session_id: Optional[str] = None):
+    """与 render_trip_map 相同，但直接返回HTML字符串(不落盘)，便于嵌入页面。"""
+    m, missing_routes = render_trip_map(list_of_days, session_id)
+    return (m.get_root().render() if m is not None else None), missing_routes
+
+
+def trip_map_path(session_id: Optional[str] = None) -> str:
+    """每个会话一个独立的输出文件，并发会话之间不会互相覆盖。"""
+    safe_id = re.sub(r'[^0-9A-Za-z_-]', '', session_id or get_session_id()) or "default"
+    return os.path.join(MAP_OUTPUT_DIR, f"trip_map_{safe_id}.html")
+
+
+def save_trip_map(list_of_days: List[Dict[str, Any]], session_id: Optional[str] = None):
+    """渲染并保存到当前会话的输出文件，返回 (文件路径, 找不到的 route_id 列表)；无可绘制内容时路径为 None。"""
+    m, missing_routes = render_trip_map(list_of_days, session_id)
+    if m is None:
+        return None, missing_routes
+    path = trip_map_path(session_id)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    m.save(tmp_path)
+    os.replace(tmp_path, path)
+    return path, missing_routes
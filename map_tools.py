@@ -1,16 +1,140 @@
 # map_tools.py (V6.1 - 终极健壮与可视化版)
 
-import requests
+import asyncio
+import contextvars
 import json
-import folium
-from typing import Optional, List, Dict
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Dict, Tuple
 from langchain.tools import tool
-from config import AMAP_API_KEY, AMAP_BASE_URL
+from langchain_core.tools import StructuredTool
+from config import (GEOCODE_CACHE_TTL, GEOCODE_NEGATIVE_TTL,
+                    GEOCODE_CACHE_MAX_ENTRIES, ROUTE_COORD_PRECISION, ROUTE_CACHE_TTL_TRANSIT,
+                    ROUTE_CACHE_TTL_WALKING, ROUTE_CACHE_TTL_DRIVING, ROUTE_NEGATIVE_TTL, ROUTE_CACHE_MAX_ENTRIES,
+                    ROUTE_MATRIX_MAX_LOCATIONS, ROUTE_MATRIX_MAX_WORKERS, POI_NEARBY_MAX_RESULTS, ROUTE_ALTERNATIVES,
+                    ROUTE_AUTO_POLICY, ROUTE_AUTO_WALK_MAX_METERS, ROUTE_AUTO_MIN_RIDE_METERS)
+from amap_client import amap_get, amap_get_async
+from cache_store import PersistentTTLCache, normalize_key_part
+from geometry_store import geometry_store
+from itinerary_optimizer import haversine_meters
+from poi_gazetteer import POI, gazetteer
+from tracing import annotate
 
+# 地点搜索结果缓存: 以归一化后的 (城市, 地点名) 为键，所有会话共享；“找不到”的结果也会被短期缓存
+geocode_cache = PersistentTTLCache("geocode", ttl_seconds=GEOCODE_CACHE_TTL, max_entries=GEOCODE_CACHE_MAX_ENTRIES,
+                                   negative_ttl_seconds=GEOCODE_NEGATIVE_TTL)
 
-# search_place_info 工具函数保持不变，它工作得很好
-@tool
-def search_place_info(place_name: str, city: str) -> Optional[str]:
+# 路线结果缓存: 以 (出行方式, 城市, 吸附后的起点, 吸附后的终点) 为键，不同出行方式使用不同的有效期
+route_cache = PersistentTTLCache("route", ttl_seconds=ROUTE_CACHE_TTL_TRANSIT, max_entries=ROUTE_CACHE_MAX_ENTRIES,
+                                 negative_ttl_seconds=ROUTE_NEGATIVE_TTL)
+ROUTE_CACHE_TTLS = {'transit': ROUTE_CACHE_TTL_TRANSIT, 'walking': ROUTE_CACHE_TTL_WALKING,
+                    'driving': ROUTE_CACHE_TTL_DRIVING}
+
+
+def snap_location(location: str, precision: int = ROUTE_COORD_PRECISION) -> str:
+    """
+    将"经度,纬度"吸附到固定的小数位数(默认4位，约10米)，让几乎重合的点共享同一个路线缓存条目。
+    无法解析的输入原样返回(去除空白)，交给高德去报错。
+    """
+    try:
+        lng, lat = (float(part) for part in str(location).split(','))
+    except ValueError:
+        return str(location).strip()
+    return f"{lng:.{precision}f},{lat:.{precision}f}"
+
+
+# 路线结果的格式或请求参数变化(例如新增 alternatives/walking_meters、驾车多策略)时递增，旧的缓存条目自然失效
+_ROUTE_CACHE_VERSION = 3
+
+
+def route_cache_key(origin: str, destination: str, city: str, mode: str) -> str:
+    return f"v{_ROUTE_CACHE_VERSION}|{mode}|{normalize_key_part(city)}|{snap_location(origin)}|{snap_location(destination)}"
+
+
+def place_cache_key(place_name: str, city: str) -> str:
+    return f"{normalize_key_part(city)}|{normalize_key_part(place_name)}"
+
+
+def remember_place(place_name: str, city: str, location: str, address: str = ""):
+    """把别处已经核实过的坐标(例如探索家交接的地点)写入地点缓存和本地地点库，之后按同名查询时不再请求高德。"""
+    result = {"name": place_name, "location": location, "address": address}
+    geocode_cache.set(place_cache_key(place_name, city), json.dumps(result, ensure_ascii=False))
+    _learn_place(result, place_name, city)
+
+
+def _learn_place(result: Dict, place_name: str, city: str):
+    """把一次成功的地点解析加入本地地点库，用户的原始叫法作为别名(例如"老虎滩" -> 老虎滩海洋公园)。"""
+    try:
+        gazetteer.add(POI(name=result["name"], location=result["location"], city=city,
+                          address=result.get("address") or "", aliases=(place_name,)))
+    except ValueError as e:
+        print(f"--- ⚠️ [poi_gazetteer] 无法加入本地地点库: {e} ---")
+
+
+def _cached_pois():
+    """本地地点库的种子: 地点缓存中所有未过期的解析结果(键为 "城市|查询词")。"""
+    for key, value in geocode_cache.items():
+        city, _, query = key.partition("|")
+        try:
+            data = json.loads(value)
+            yield POI(name=data["name"], location=data["location"], city=city,
+                      address=data.get("address") or "", aliases=(query,))
+        except (KeyError, TypeError, ValueError):
+            continue
+
+
+def _local_place(place_name: str, city: str) -> Optional[str]:
+    """第二级解析: 本地地点库中名称或别名完全相同且唯一时不再请求高德(模糊匹配只用于 find_nearby_places)。"""
+    gazetteer.bootstrap(_cached_pois)
+    poi = gazetteer.resolve(place_name, city, fuzzy=False)
+    annotate(gazetteer_hits=int(poi is not None))
+    if poi is None:
+        return None
+    result_str = json.dumps(poi.to_dict(), ensure_ascii=False)
+    print(f"--- ⚡ [search_place_info] 本地地点库命中: '{place_name}' -> {result_str} ---")
+    return result_str
+
+
+# search_place_info 工具函数: 先查共享缓存，再查本地地点库，都未命中才请求高德 (同步/异步两套实现共用解析逻辑)
+def _verified(result_str: Optional[str], city: str) -> Optional[str]:
+    """当前会话核实了一个地点: 交给路线预取器，在后台预先查询规划师大概率会用到的交通段。"""
+    if result_str:
+        from route_prefetcher import route_prefetcher
+        place = json.loads(result_str)
+        route_prefetcher.observe(city, place["name"], place["location"])
+    return result_str
+
+
+def _cached_place(place_name: str, city: str):
+    print(f"--- 🛠️ 调用工具 [search_place_info]: 在'{city}'搜索'{place_name}' ---")
+    cache_key = place_cache_key(place_name, city)
+    hit, cached = geocode_cache.get(cache_key)
+    annotate(cache_hits=int(hit), cache_misses=int(not hit))
+    if hit:
+        print(f"--- ⚡ [search_place_info] 缓存命中: '{place_name}' -> {cached} ---")
+    return cache_key, hit, cached
+
+
+def _parse_place(data: Dict, place_name: str, city: str, cache_key: str) -> Optional[str]:
+    if data['status'] == '1' and data.get('tips'):
+        best_tip = data['tips'][0]
+        if isinstance(best_tip.get('location'), str) and ',' in best_tip['location']:
+            result = {"name": best_tip.get("name", place_name), "location": best_tip.get("location"),
+                      "address": best_tip.get("address", "") if isinstance(best_tip.get("address"),
+                                                                           str) else best_tip.get('district', '')}
+            result_str = json.dumps(result, ensure_ascii=False)
+            geocode_cache.set(cache_key, result_str)
+            _learn_place(result, place_name, city)
+            print(f"--- ✅ [search_place_info] 成功: '{place_name}' -> {result_str} ---")
+            return result_str
+    if data['status'] == '1':
+        # 高德正常返回但没有可用坐标: 记录负缓存，避免短时间内反复查询同一个不存在的地点
+        geocode_cache.set(cache_key, None)
+    print(f"--- ⚠️ [search_place_info] 警告: 无法为'{place_name}'找到有效坐标。---")
+    return None
+
+
+def _search_place_info(place_name: str, city: str) -> Optional[str]:
     """
     【铁律1: 必须最先调用】此工具用于精确查找任何地点的官方名称、地址和经纬度坐标('location')。
     在进行任何路线规划之前，必须对用户提到的每一个地点（包括景点、酒店、餐厅、车站）都使用此工具。
@@ -20,155 +144,493 @@ def search_place_info(place_name: str, city: str) -> Optional[str]:
     - 输入: place_name="东方明珠", city="上海"
     - 返回: 包含精确"location"的JSON字符串。
     """
-    # (此函数代码与您之前的版本完全相同，无需修改)
-    print(f"--- 🛠️ 调用工具 [search_place_info]: 在'{city}'搜索'{place_name}' ---")
-    url = f"{AMAP_BASE_URL}/assistant/inputtips"
-    params = {'key': AMAP_API_KEY, 'keywords': place_name, 'city': city, 'datatype': 'poi'}
+    cache_key, hit, cached = _cached_place(place_name, city)
+    if hit and cached:
+        return _verified(cached, city)
+    local = _local_place(place_name, city)
+    if local or hit:
+        return _verified(local, city)
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        if data['status'] == '1' and data.get('tips'):
-            best_tip = data['tips'][0]
-            if isinstance(best_tip.get('location'), str) and ',' in best_tip['location']:
-                result = {"name": best_tip.get("name", place_name), "location": best_tip.get("location"),
-                          "address": best_tip.get("address", "") if isinstance(best_tip.get("address"),
-                                                                               str) else best_tip.get('district', '')}
-                result_str = json.dumps(result, ensure_ascii=False)
-                print(f"--- ✅ [search_place_info] 成功: '{place_name}' -> {result_str} ---")
-                return result_str
-        print(f"--- ⚠️ [search_place_info] 警告: 无法为'{place_name}'找到有效坐标。---")
+        data = amap_get("/assistant/inputtips", {'keywords': place_name, 'city': city, 'datatype': 'poi'})
+        return _verified(_parse_place(data, place_name, city, cache_key), city)
+    except Exception as e:
+        print(f"--- ❌ [search_place_info] 错误: {e} ---")
         return None
+
+
+async def _asearch_place_info(place_name: str, city: str) -> Optional[str]:
+    cache_key, hit, cached = _cached_place(place_name, city)
+    if hit and cached:
+        return _verified(cached, city)
+    local = _local_place(place_name, city)
+    if local or hit:
+        return _verified(local, city)
+    try:
+        data = await amap_get_async("/assistant/inputtips", {'keywords': place_name, 'city': city, 'datatype': 'poi'})
+        return _verified(_parse_place(data, place_name, city, cache_key), city)
     except Exception as e:
         print(f"--- ❌ [search_place_info] 错误: {e} ---")
         return None
 
 
-# --- 【核心修正】get_route_info 函数 ---
+search_place_info = StructuredTool.from_function(func=_search_place_info, coroutine=_asearch_place_info,
+                                                 name="search_place_info")
+
+
 @tool
-def get_route_info(origin: str, destination: str, city: str, mode: str = 'transit') -> Optional[str]:
+def find_nearby_places(location: str, city: str, radius_meters: int = 1500, keyword: str = "", limit: int = 10) -> str:
+    """
+    【附近地点工具】在本地地点库中查找某个位置附近的地点(景点、餐厅、酒店等)，不调用任何外部API，瞬间返回。
+    适合回答“酒店附近有什么好吃的/好玩的”，或者为某一天挑选顺路的餐厅。
+    参数:
+    - location: "经度,纬度"，也可以直接写地点名称(会先在本地地点库中解析)
+    - city: 城市
+    - radius_meters: 搜索半径(米)，默认1500
+    - keyword: 可选，按名称/类别/地址过滤，例如"火锅"、"博物馆"
+    - limit: 最多返回多少个，默认10
+    返回: JSON列表，按距离从近到远: [{"name", "location", "address", "category", "distance_meters"}]。
+    本地地点库只包含导入的数据和之前查询过的地点；结果为空或不够时，请改用 tavily_search 搜索推荐，再用 search_place_info 核实坐标。
+    """
+    print(f"--- 🛠️ 调用工具 [find_nearby_places]: '{location}' 附近 {radius_meters}米 '{keyword}' in {city} ---")
+    gazetteer.bootstrap(_cached_pois)
+    if ',' not in location:
+        poi = gazetteer.resolve(location, city)
+        if poi is None:
+            return f"错误: 本地地点库中没有'{location}'，请先用 search_place_info 获取它的坐标。"
+        location = poi.location
+    try:
+        results = gazetteer.nearby(location, city, radius_m=radius_meters,
+                                   k=max(1, min(int(limit), POI_NEARBY_MAX_RESULTS)), keyword=keyword)
+    except ValueError as e:
+        return f"错误: {e}"
+    print(f"--- ✅ [find_nearby_places] 成功: 找到 {len(results)} 个地点 ---")
+    return json.dumps([{**poi.to_dict(), "category": poi.category, "distance_meters": distance}
+                       for distance, poi in results], ensure_ascii=False)
+
+
+# --- 【核心修正】get_route_info 函数 ---
+def _get_route_info(origin: str, destination: str, city: str, mode: str = 'transit',
+                    policy: str = ROUTE_AUTO_POLICY) -> Optional[str]:
     """
     【铁律2: 必须在获取坐标后调用】此工具用于计算两个地点之间的实际交通路线。
     严禁直接使用地名作为'origin'或'destination'参数，必须使用`search_place_info`工具返回的"经度,纬度"格式的'location'值。
     在规划行程中，只要涉及从A点到B点的移动，就必须调用此工具获取真实的交通数据。
+    mode 可以是 transit / walking / driving；不确定用哪种方式(公交可能没有方案、距离可能很近)时用 mode="auto"，
+    一次调用就会同时查询所有合适的方式，并按 policy(fastest 最快 / cheapest 最便宜 / least_walking 步行最少)选出一种，
+    不要再为同一段交通逐个尝试不同的 mode。
 
     例如:
     - 输入: origin="121.4997,31.2397", destination="121.5063,31.2451", city="上海", mode="transit"
-    - 返回: 一个包含详细交通步骤('steps')的JSON字符串。
+    - 返回: 一个包含详细交通步骤('steps')的JSON字符串，其中的'route_id'是这条路线几何的编号，生成地图时原样传入即可；
+      'alternatives' 是同一方式下的其他方案(只有耗时、距离、费用、步行距离；公交和驾车才有，步行只有一条路线)。
+      mode="auto" 时另外返回选中的 'mode'、各方式按 policy 排好序的 'options'，以及因距离不合适而跳过的方式 'skipped'。
     """
     print(f"--- 🛠️ 调用工具 [get_route_info-v3]: 从 {origin} 到 {destination} by {mode} in {city} ---")
+    error = _check_route_args(origin, destination, mode, policy)
+    if error:
+        return error
+    if mode == 'auto':
+        return _format_auto(*fetch_route_auto(origin, destination, city), policy)
+    return _format_route(fetch_route(origin, destination, city, mode))
 
-    if mode == 'transit':
-        url = f"{AMAP_BASE_URL}/direction/transit/integrated"
-        params = {'key': AMAP_API_KEY, 'origin': origin, 'destination': destination, 'city': city}
-    elif mode in ['walking', 'driving']:
-        api_path = 'walking' if mode == 'walking' else 'driving'
-        url = f"{AMAP_BASE_URL}/direction/{api_path}"
-        params = {'key': AMAP_API_KEY, 'origin': origin, 'destination': destination}
+
+async def _aget_route_info(origin: str, destination: str, city: str, mode: str = 'transit',
+                           policy: str = ROUTE_AUTO_POLICY) -> Optional[str]:
+    print(f"--- 🛠️ 调用工具 [get_route_info-v3]: 从 {origin} 到 {destination} by {mode} in {city} ---")
+    error = _check_route_args(origin, destination, mode, policy)
+    if error:
+        return error
+    if mode == 'auto':
+        return _format_auto(*await afetch_route_auto(origin, destination, city), policy)
+    return _format_route(await afetch_route(origin, destination, city, mode))
+
+
+def _check_route_args(origin: str, destination: str, mode: str, policy: str) -> Optional[str]:
+    if mode != 'auto' and mode not in ROUTE_CACHE_TTLS:
+        return f"错误: 不支持的交通方式 '{mode}'。"
+    if mode == 'auto':
+        if policy not in ROUTE_POLICIES:
+            return f"错误: 不支持的选择策略 '{policy}'，可选 {', '.join(ROUTE_POLICIES)}。"
+        try:
+            haversine_meters(origin, destination)
+        except (TypeError, ValueError):
+            return "错误: origin 和 destination 必须是'经度,纬度'格式的坐标。"
+    return None
+
+
+def route_summary(result: Optional[Dict]) -> Optional[Dict]:
+    """polyline 动辄上千个坐标点，只存到服务端的几何存储里，对外的路线结果里用短的 route_id 代替。"""
+    if not result:
+        return None
+    output = {key: value for key, value in result.items() if key != 'polyline'}
+    output['route_id'] = geometry_store.put(result.get('polyline', ''))
+    return output
+
+
+def _format_route(result: Optional[Dict]) -> Optional[str]:
+    output = route_summary(result)
+    if output:
+        print(f"--- ✅ [get_route_info] 成功: 返回了路线数据，几何已保存为 {output['route_id']} ---")
+        return json.dumps(output, ensure_ascii=False)
+    return None
+
+
+# 多方式比较时的排序键: 先比主要指标，相同时再比次要指标
+ROUTE_POLICIES = {
+    'fastest': lambda option: (option['duration_minutes'], option['walking_meters'], option['cost_yuan']),
+    'cheapest': lambda option: (option['cost_yuan'], option['duration_minutes']),
+    'least_walking': lambda option: (option['walking_meters'], option['duration_minutes']),
+}
+
+
+def auto_modes(origin: str, destination: str) -> Tuple[List[str], Dict[str, str]]:
+    """直线距离预检: 返回 (值得查询的出行方式, {明显不合适而跳过的方式: 原因})。"""
+    distance = haversine_meters(origin, destination)
+    modes, skipped = [], {}
+    if distance <= ROUTE_AUTO_WALK_MAX_METERS:
+        modes.append('walking')
+    else:
+        skipped['walking'] = f"直线距离{distance / 1000:.1f}公里，步行太远"
+    if distance >= ROUTE_AUTO_MIN_RIDE_METERS:
+        modes += ['transit', 'driving']
     else:
+        skipped['transit'] = skipped['driving'] = f"直线距离仅{distance:.0f}米，步行即可"
+    return modes, skipped
+
+
+def fetch_route_auto(origin: str, destination: str, city: str) -> Tuple[Dict[str, Optional[Dict]], Dict[str, str]]:
+    """并发查询预检后留下的所有出行方式，返回 ({方式: fetch_route 的结果}, 跳过的方式)。"""
+    modes, skipped = auto_modes(origin, destination)
+    with ThreadPoolExecutor(max_workers=max(1, len(modes))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, fetch_route, origin, destination, city, mode)
+                   for mode in modes]
+        return {mode: future.result() for mode, future in zip(modes, futures)}, skipped
+
+
+async def afetch_route_auto(origin: str, destination: str,
+                            city: str) -> Tuple[Dict[str, Optional[Dict]], Dict[str, str]]:
+    """fetch_route_auto 的异步版本。"""
+    modes, skipped = auto_modes(origin, destination)
+    results = await asyncio.gather(*(afetch_route(origin, destination, city, mode) for mode in modes))
+    return dict(zip(modes, results)), skipped
+
+
+def _compact_route(result: Dict) -> Dict:
+    compact = {key: result.get(key, 0) for key in ('duration_minutes', 'distance_meters', 'cost_yuan', 'walking_meters')}
+    if result.get('summary'):
+        compact['summary'] = result['summary']
+    return compact
+
+
+def _format_auto(results: Dict[str, Optional[Dict]], skipped: Dict[str, str], policy: str) -> Optional[str]:
+    """按 policy 给各方式的首选方案排序，返回排第一的方式的完整路线，以及所有方式的精简对比。"""
+    skipped = dict(skipped, **{mode: "没有可用方案" for mode, result in results.items() if not result})
+    options = sorted(({"mode": mode, **_compact_route(result)} for mode, result in results.items() if result),
+                     key=ROUTE_POLICIES[policy])
+    if not options:
+        print(f"--- ⚠️ [get_route_info] 所有出行方式都无法规划: {skipped} ---")
+        return None
+    best = options[0]['mode']
+    output = {"mode": best, "policy": policy, **route_summary(results[best]), "options": options, "skipped": skipped}
+    print(f"--- ✅ [get_route_info] 成功: 比较了 {len(options)} 种方式，按 {policy} 选择 {best}，"
+          f"几何已保存为 {output['route_id']} ---")
+    return json.dumps(output, ensure_ascii=False)
+
+
+get_route_info = StructuredTool.from_function(func=_get_route_info, coroutine=_aget_route_info,
+                                              name="get_route_info")
+
+
+def _get_route_matrix(locations: List[str], city: str, mode: str = 'transit') -> str:
+    """
+    【批量路线工具】一次性并发计算多个地点两两之间的交通耗时、距离和费用。
+    当需要比较多个地点之间的远近(例如决定每天去哪些景点、按什么顺序游览)时，应优先调用此工具，而不是逐对调用`get_route_info`。
+    参数 locations 必须是`search_place_info`返回的"经度,纬度"字符串列表。
+    注意: 结果中不包含换乘步骤，最终行程单中每一段交通的'steps'仍需通过`get_route_info`获取。
+
+    例如:
+    - 输入: locations=["121.58,38.88", "121.67,38.87", "121.62,38.91"], city="大连", mode="transit"
+    - 返回: JSON字符串，其中 matrix[i][j] 为从第i个地点到第j个地点的 [耗时分钟, 距离米, 费用元]，无法规划时为 null。
+    """
+    error = _check_matrix_args(locations, city, mode)
+    return error or _format_matrix(locations, mode, compute_route_matrix(locations, city, mode))
+
+
+async def _aget_route_matrix(locations: List[str], city: str, mode: str = 'transit') -> str:
+    error = _check_matrix_args(locations, city, mode)
+    return error or _format_matrix(locations, mode, await acompute_route_matrix(locations, city, mode))
+
+
+def _check_matrix_args(locations: List[str], city: str, mode: str) -> Optional[str]:
+    print(f"--- 🛠️ 调用工具 [get_route_matrix]: {len(locations)} 个地点 by {mode} in {city} ---")
+    if mode not in ROUTE_CACHE_TTLS:
         return f"错误: 不支持的交通方式 '{mode}'。"
+    if len(locations) > ROUTE_MATRIX_MAX_LOCATIONS:
+        return f"错误: 一次最多计算 {ROUTE_MATRIX_MAX_LOCATIONS} 个地点之间的路线，请分批调用。"
+    return None
+
+
+def _format_matrix(locations: List[str], mode: str, routes: List[List[Optional[Dict]]]) -> str:
+    matrix = [[None if route is None else [route['duration_minutes'], route['distance_meters'],
+                                           route.get('cost_yuan', 0.0)] for route in row] for row in routes]
+    missing = sum(cell is None for i, row in enumerate(matrix) for j, cell in enumerate(row) if i != j)
+    print(f"--- ✅ [get_route_matrix] 成功: {len(locations)}x{len(locations)} 矩阵，{missing} 段无法规划 ---")
+    return json.dumps({"locations": locations, "mode": mode,
+                       "fields": ["duration_minutes", "distance_meters", "cost_yuan"], "matrix": matrix},
+                      ensure_ascii=False, separators=(',', ':'))
+
+
+get_route_matrix = StructuredTool.from_function(func=_get_route_matrix, coroutine=_aget_route_matrix,
+                                                name="get_route_matrix")
+
+
+_SAME_POINT = {'duration_minutes': 0, 'distance_meters': 0, 'cost_yuan': 0.0, 'steps': [], 'polyline': ''}
+
+
+def _matrix_pairs(locations: List[str]):
+    """返回 (初始矩阵, {(吸附后的起点, 吸附后的终点): [(i, j), ...]})。坐标相同的两点直接视为0耗时。"""
+    size = len(locations)
+    snapped = [snap_location(location) for location in locations]
+    routes: List[List[Optional[Dict]]] = [[None] * size for _ in range(size)]
+    pairs: Dict[tuple, List[tuple]] = {}
+    for i in range(size):
+        for j in range(size):
+            if snapped[i] == snapped[j]:
+                routes[i][j] = _SAME_POINT
+            else:
+                pairs.setdefault((snapped[i], snapped[j]), []).append((i, j))
+    return routes, pairs
+
+
+def compute_route_matrix(locations: List[str], city: str, mode: str = 'transit') -> List[List[Optional[Dict]]]:
+    """
+    并发查询所有 起点->终点 组合(使用有上限的线程池)，返回 routes[i][j] 为 fetch_route 的结果。
+    对角线以及坐标相同的两点直接视为0耗时，不发请求；重复的组合只查询一次。
+    """
+    routes, pairs = _matrix_pairs(locations)
+    if pairs:
+        with ThreadPoolExecutor(max_workers=min(ROUTE_MATRIX_MAX_WORKERS, len(pairs))) as pool:
+            # 每个任务带上调用方的 contextvars 副本(会话ID、追踪 span)
+            futures = {pool.submit(contextvars.copy_context().run, fetch_route, origin, destination, city, mode): cells
+                       for (origin, destination), cells in pairs.items()}
+            for future in as_completed(futures):
+                for i, j in futures[future]:
+                    routes[i][j] = future.result()
+    return routes
+
+
+def compute_routes(pairs: List[tuple], city: str, mode: str = 'transit') -> List[Optional[Dict]]:
+    """并发查询给定的若干段 (起点, 终点)，按输入顺序返回 fetch_route 的结果。用于只补查行程中新出现的交通段。"""
+    if not pairs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(ROUTE_MATRIX_MAX_WORKERS, len(pairs))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, fetch_route, origin, destination, city, mode)
+                   for origin, destination in pairs]
+        return [future.result() for future in futures]
+
+
+async def acompute_route_matrix(locations: List[str], city: str, mode: str = 'transit') -> List[List[Optional[Dict]]]:
+    """compute_route_matrix 的异步版本，用信号量把并发数限制在 ROUTE_MATRIX_MAX_WORKERS 以内。"""
+    routes, pairs = _matrix_pairs(locations)
+    semaphore = asyncio.Semaphore(ROUTE_MATRIX_MAX_WORKERS)
+
+    async def fetch(origin: str, destination: str):
+        async with semaphore:
+            return await afetch_route(origin, destination, city, mode)
+
+    results = await asyncio.gather(*(fetch(origin, destination) for origin, destination in pairs))
+    for cells, result in zip(pairs.values(), results):
+        for i, j in cells:
+            routes[i][j] = result
+    return routes
+
+
+def _cached_route(origin: str, destination: str, city: str, mode: str):
+    cache_key = route_cache_key(origin, destination, city, mode)
+    hit, cached = route_cache.get(cache_key)
+    annotate(cache_hits=int(hit), cache_misses=int(not hit))
+    if hit:
+        print(f"--- ⚡ [get_route_info] 缓存命中: {cache_key} ---")
+    return cache_key, hit, (json.loads(cached) if cached else None)
+
+
+def _store_route(cache_key: str, mode: str, found: bool, result: Optional[Dict]):
+    if result:
+        route_cache.set(cache_key, json.dumps(result, ensure_ascii=False), ttl_seconds=ROUTE_CACHE_TTLS[mode])
+    elif found:
+        # 高德正常应答但没有可用方案(例如两点之间没有公交): 短期负缓存
+        route_cache.set(cache_key, None)
 
+
+def fetch_route(origin: str, destination: str, city: str, mode: str = 'transit') -> Optional[Dict]:
+    """带缓存的单段路线查询，返回解析后的结果字典；无法规划时返回None。供各个路线工具共用。"""
+    cache_key, hit, cached = _cached_route(origin, destination, city, mode)
+    if hit:
+        return cached
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-
-        if data.get('status') == '1' and 'route' in data:
-            result = {}
-            # --- 处理公交/地铁(transit)的详细逻辑 ---
-            if mode == 'transit' and data['route'].get('transits'):
-                plan = data['route']['transits'][0]
-
-                # --- 更健壮的步骤和polyline提取逻辑 ---
-                steps_description = []
-                polyline_parts = []
-
-                for segment in plan.get('segments', []):
-                    # 步行部分
-                    walking = segment.get('walking', {})
-                    if walking and walking.get('distance') and int(walking['distance']) > 0:
-                        steps_description.append(
-                            f"步行约{int(walking.get('duration', 0)) // 60}分钟 ({walking.get('distance')}米)")
-                        if walking.get('polyline'):
-                            polyline_parts.append(walking['polyline'])
-
-                    # 公交部分
-                    bus = segment.get('bus', {})
-                    if bus and bus.get('buslines'):
-                        # buslines 是一个列表，需要安全地处理
-                        for busline in bus.get('buslines', []):
-                            steps_description.append(
-                                f"在「{busline.get('departure_stop', {}).get('name', '')}」站乘坐「{busline.get('name', '')}」，经过{busline.get('via_num', 0)}站后，在「{busline.get('arrival_stop', {}).get('name', '')}」站下车")
-                            if busline.get('polyline'):
-                                polyline_parts.append(busline['polyline'])
-
-                result = {
-                    "duration_minutes": int(plan.get('duration', 0)) // 60,
-                    "distance_meters": int(plan.get('distance', 0)),
-                    "cost_yuan": float(plan.get('cost', 0)),
-                    "steps": steps_description,
-                    "polyline": ";".join(polyline_parts)
-                }
-
-            # --- 处理步行(walking)或驾车(driving)的逻辑 ---
-            elif mode in ['walking', 'driving'] and data['route'].get('paths'):
-                path = data['route']['paths'][0]
-
-                # 安全地拼接所有步骤的polyline
-                polyline_parts = [step.get('polyline') for step in path.get('steps', []) if step.get('polyline')]
-
-                result = {
-                    "duration_minutes": int(path.get('duration', 0)) // 60,
-                    "distance_meters": int(path.get('distance', 0)),
-                    "polyline": ";".join(polyline_parts)
-                }
-
-            if result:
-                result_str = json.dumps(result, ensure_ascii=False)
-                print(f"--- ✅ [get_route_info] 成功: 返回了包含polyline的数据 ---")
-                return result_str
-
-        print(f"--- ⚠️ [get_route_info] 警告: 无法规划路线。高德返回: {data.get('info', '')} ---")
-        return None
+        found, result = _parse_route(amap_get(*_route_request(origin, destination, city, mode)), mode)
     except Exception as e:
         import traceback
         traceback.print_exc()  # 打印详细的错误堆栈信息
         print(f"--- ❌ [get_route_info] 错误: {e} ---")
         return None
+    _store_route(cache_key, mode, found, result)
+    return result
+
+
+def prefetch_route(origin: str, destination: str, city: str, mode: str = 'transit') -> bool:
+    """
+    路线预取器使用的低优先级查询: 已有缓存(包括负缓存)时直接返回 False；否则只用富余的高德配额查询并写入缓存，返回 True。
+    没有富余配额时抛出 AmapQuotaBusy，由调用方稍后重试。
+    """
+    cache_key = route_cache_key(origin, destination, city, mode)
+    if route_cache.get(cache_key)[0]:
+        return False
+    found, result = _parse_route(amap_get(*_route_request(origin, destination, city, mode), background=True), mode)
+    _store_route(cache_key, mode, found, result)
+    return True
+
+
+async def afetch_route(origin: str, destination: str, city: str, mode: str = 'transit') -> Optional[Dict]:
+    """fetch_route 的异步版本。"""
+    cache_key, hit, cached = _cached_route(origin, destination, city, mode)
+    if hit:
+        return cached
+    try:
+        data = await amap_get_async(*_route_request(origin, destination, city, mode))
+        found, result = _parse_route(data, mode)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"--- ❌ [get_route_info] 错误: {e} ---")
+        return None
+    _store_route(cache_key, mode, found, result)
+    return result
+
+
+# 高德驾车的多策略: 一次返回至多3条路线(速度优先、费用优先、距离优先等)，默认策略只返回1条
+_DRIVING_MULTI_STRATEGY = 10
+
+
+def _route_request(origin: str, destination: str, city: str, mode: str):
+    if mode == 'transit':
+        return "/direction/transit/integrated", {'origin': origin, 'destination': destination, 'city': city}
+    if mode == 'driving':
+        params = {'origin': origin, 'destination': destination}
+        if ROUTE_ALTERNATIVES > 1:
+            params['strategy'] = _DRIVING_MULTI_STRATEGY
+        return "/direction/driving", params
+    # 步行路线高德只返回一条，没有备选方案
+    return "/direction/walking", {'origin': origin, 'destination': destination}
+
+
+def _transit_plan(plan: Dict) -> Dict:
+    """解析一个公交/地铁方案: 步骤描述、拼接的polyline、步行总距离，以及乘坐线路的简要说明。"""
+    # --- 更健壮的步骤和polyline提取逻辑 ---
+    steps_description = []
+    polyline_parts = []
+    lines = []
+    walking_meters = 0
+
+    for segment in plan.get('segments', []):
+        # 步行部分
+        walking = segment.get('walking', {})
+        if walking and walking.get('distance') and int(walking['distance']) > 0:
+            walking_meters += int(walking['distance'])
+            steps_description.append(
+                f"步行约{int(walking.get('duration', 0)) // 60}分钟 ({walking.get('distance')}米)")
+            if walking.get('polyline'):
+                polyline_parts.append(walking['polyline'])
+
+        # 公交部分
+        bus = segment.get('bus', {})
+        if bus and bus.get('buslines'):
+            # buslines 是一个列表，需要安全地处理
+            for busline in bus.get('buslines', []):
+                lines.append(busline.get('name', ''))
+                steps_description.append(
+                    f"在「{busline.get('departure_stop', {}).get('name', '')}」站乘坐「{busline.get('name', '')}」，经过{busline.get('via_num', 0)}站后，在「{busline.get('arrival_stop', {}).get('name', '')}」站下车")
+                if busline.get('polyline'):
+                    polyline_parts.append(busline['polyline'])
+
+    return {
+        "duration_minutes": int(plan.get('duration', 0)) // 60,
+        "distance_meters": int(plan.get('distance', 0)),
+        "cost_yuan": float(plan.get('cost') or 0),
+        "walking_meters": walking_meters,
+        "summary": " → ".join(line for line in lines if line),
+        "steps": steps_description,
+        "polyline": ";".join(polyline_parts)
+    }
+
+
+def _path_plan(path: Dict, mode: str, route: Dict) -> Dict:
+    """解析一个步行/驾车方案；驾车的费用使用高德估算的打车费。"""
+    # 安全地拼接所有步骤的polyline
+    polyline_parts = [step.get('polyline') for step in path.get('steps', []) if step.get('polyline')]
+    distance = int(path.get('distance', 0))
+    return {
+        "duration_minutes": int(path.get('duration', 0)) // 60,
+        "distance_meters": distance,
+        "cost_yuan": float(route.get('taxi_cost') or 0) if mode == 'driving' else 0.0,
+        "walking_meters": distance if mode == 'walking' else 0,
+        "polyline": ";".join(polyline_parts)
+    }
 
 
-# generate_map_visualization 工具函数保持不变
+def _parse_route(data: Dict, mode: str, alternatives: int = ROUTE_ALTERNATIVES):
+    """
+    解析高德路线规划应答: 第一个方案完整保留(步骤、polyline)，之后的至多 alternatives-1 个方案
+    以精简形式放在 'alternatives' 中(重复的方案只保留一个)。
+    返回 (高德是否正常应答, 解析后的结果字典或None)。
+    """
+    if data.get('status') == '1' and 'route' in data:
+        route = data['route']
+        if mode == 'transit':
+            plans = [_transit_plan(plan) for plan in (route.get('transits') or [])[:alternatives]]
+        elif mode in ['walking', 'driving']:
+            plans = [_path_plan(path, mode, route) for path in (route.get('paths') or [])[:alternatives]]
+        else:
+            plans = []
+
+        if plans:
+            result = plans[0]
+            seen = {json.dumps(_compact_route(result), sort_keys=True)}
+            others = []
+            for plan in plans[1:]:
+                key = json.dumps(_compact_route(plan), sort_keys=True)
+                if key not in seen:
+                    seen.add(key)
+                    others.append(_compact_route(plan))
+            if others:
+                result["alternatives"] = others
+            return True, result
+
+    print(f"--- ⚠️ [get_route_info] 警告: 无法规划路线。高德返回: {data.get('info', '')} ---")
+    return data.get('status') == '1', None
+
+
+# generate_map_visualization 工具函数: 渲染交给 map_renderer(每天一个GeoJSON图层，按会话输出到独立文件)
 @tool
 def generate_map_visualization(daily_plans: str) -> str:
-    """【可视化工具】... (文档字符串与之前版本相同)"""
-    # (此函数代码与V6.0版本完全相同，无需修改)
+    """
+    【可视化工具】把每日行程画到一张交互式地图上，并保存为HTML文件。
+    参数 daily_plans 为JSON字符串，是一个按天组织的列表:
+    [{"day": 1, "spots": [{"name": "星海广场", "location": "121.58,38.88"}, ...],
+      "routes": [{"route_id": "get_route_info 返回的 route_id"}, ...]}, ...]
+    """
+    from map_renderer import save_trip_map
     print(f"--- 🛠️ 调用工具 [generate_map_visualization]: 正在生成地图... ---")
     try:
         list_of_days = json.loads(daily_plans)
         if not list_of_days: return "错误: 没有路线数据，无法生成地图。"
-        first_spot_loc_str = list_of_days[0]['spots'][0]['location']
-        lng, lat = map(float, first_spot_loc_str.split(','))
-        map_center = [lat, lng]
-        m = folium.Map(location=map_center, zoom_start=12,
-                       tiles='https://webrd01.is.autonavi.com/appmaptile?lang=zh_cn&size=1&scale=1&style=8&x={x}&y={y}&z={z}',
-                       attr='高德地图')
-        colors = ['blue', 'green', 'purple', 'orange', 'darkred', 'lightred', 'beige']
-        for i, day_plan in enumerate(list_of_days):
-            color = colors[i % len(colors)]
-            for spot in day_plan['spots']:
-                lng, lat = map(float, spot['location'].split(','))
-                folium.Marker(location=[lat, lng], popup=f"<strong>{spot['name']}</strong><br>Day {day_plan['day']}",
-                              tooltip=spot['name'], icon=folium.Icon(color=color, icon='flag')).add_to(m)
-            for route in day_plan.get('routes', []):
-                if route and route.get('polyline'):
-                    points = [p.split(',') for p in route['polyline'].split(';') if p]
-                    lat_lng_points = [[float(p[1]), float(p[0])] for p in points if len(p) == 2]
-                    if lat_lng_points:
-                        folium.PolyLine(locations=lat_lng_points, color=color, weight=5, opacity=0.8).add_to(m)
-        map_filename = "trip_map.html"
-        m.save(map_filename)
+        map_filename, missing_routes = save_trip_map(list_of_days)
+        if map_filename is None:
+            return "错误: 行程中没有可绘制的坐标，无法生成地图。"
+        annotate(map_bytes=os.path.getsize(map_filename), missing_routes=len(missing_routes))
         print(f"--- ✅ [generate_map_visualization] 成功: 地图已保存至 {map_filename} ---")
-        return f"地图已成功生成，并保存为 {map_filename} 文件。请在浏览器中打开它查看。"
+        note = f"（有 {len(missing_routes)} 条路线已过期，未能绘制: {', '.join(missing_routes)}）" if missing_routes else ""
+        return f"地图已成功生成，并保存为 {map_filename} 文件。请在浏览器中打开它查看。{note}"
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -0,0 +1,168 @@
+# planner_tools.py (规划师专用工具 - 行程优化、服务端行程的渲染与增量修改)
+
+import json
+from typing import Any, Dict, List, Optional
+
+from langchain_core.tools import tool
+
+from async_runtime import run_cpu_bound
+from config import OPTIMIZER_MAX_MATRIX_LOCATIONS
+from itinerary_model import Itinerary, ItineraryEditError, itinerary_store
+from itinerary_optimizer import Place, TravelTimes, parse_clock, plan_frames
+from map_tools import compute_route_matrix, compute_routes, route_summary
+
+
+def _to_place(item: Any, kind: str) -> Place:
+    if not isinstance(item, dict) or not item.get('name'):
+        raise ValueError(f"无法识别的地点: {item!r}")
+    location = item.get('location')
+    if not isinstance(location, str) or ',' not in location:
+        raise ValueError(f"地点'{item['name']}'缺少'经度,纬度'格式的坐标，请先调用 search_place_info。")
+    return Place(name=item['name'], location=location, kind=kind,
+                 dwell_minutes=item.get('duration_minutes'), meal=item.get('meal'))
+
+
+def _unique_places(places: List[Place]) -> List[Place]:
+    """模型有时会把同一个景点写两遍: 名称和坐标都相同的只保留第一个。"""
+    seen, unique = set(), []
+    for place in places:
+        if (place.name, place.location) not in seen:
+            seen.add((place.name, place.location))
+            unique.append(place)
+    if len(unique) < len(places):
+        print(f"--- ⚠️ [optimize_itinerary] 去掉了 {len(places) - len(unique)} 个重复的景点 ---")
+    return unique
+
+
+def _station(block: Optional[Dict]) -> Optional[Place]:
+    if not block or not block.get('station'):
+        return None
+    return _to_place(block['station'], 'station')
+
+
+def _build_travel_times(places: List[Place], city: str, mode: str) -> TravelTimes:
+    """用真实路线矩阵(走缓存并发查询)构造耗时表；地点过多时退化为直线距离估算，避免一次打出过多请求。"""
+    locations = list(dict.fromkeys(place.location for place in places))
+    if len(locations) > OPTIMIZER_MAX_MATRIX_LOCATIONS:
+        print(f"--- ⚠️ [optimize_itinerary] {len(locations)} 个地点超过上限，交通耗时改用直线距离估算 ---")
+        return TravelTimes(locations)
+    routes = compute_route_matrix(locations, city, mode)
+    minutes = [[None if route is None else route['duration_minutes'] for route in row] for row in routes]
+    return TravelTimes(locations, minutes)
+
+
+@tool
+def optimize_itinerary(trip_spec: str) -> str:
+    """
+    【行程优化工具】在获取了所有地点坐标后调用一次，它会确定性地完成: 把景点分配到每一天、安排每天的游览顺序、
+    按规则(游玩时长、午餐/晚餐窗口、入住、提前到站)推演出分钟级时间表。你只需根据返回结果撰写行程单。
+    参数 trip_spec 为JSON字符串，格式如下(location 均为 search_place_info 返回的"经度,纬度"):
+    {"city": "大连", "days": 3, "mode": "transit",
+     "hotel": {"name": "...", "location": "..."},
+     "arrival": {"station": {"name": "...", "location": "..."}, "time": "2025-08-01 10:30"},
+     "departure": {"station": {"name": "...", "location": "..."}, "time": "2025-08-03 17:00"},
+     "spots": [{"name": "...", "location": "...", "duration_minutes": 可选}],
+     "restaurants": [{"name": "...", "location": "...", "meal": "lunch或dinner，可选"}],
+     "night_activities": [{"name": "...", "location": "..."}]}
+    返回: JSON字符串，包含每天的 schedule(时间段、类型、地点)以及安排不下的景点 unscheduled。
+    schedule 中 type 为 travel 的每一段都带有 origin/destination 坐标，可直接用于 get_route_info 获取换乘步骤。
+    """
+    print(f"--- 🛠️ 调用工具 [optimize_itinerary]: 正在优化行程... ---")
+    try:
+        spec = json.loads(trip_spec)
+        city, mode = spec['city'], spec.get('mode', 'transit')
+        hotel = _to_place(spec['hotel'], 'hotel')
+        arrival, departure = _station(spec.get('arrival')), _station(spec.get('departure'))
+        spots = _unique_places([_to_place(item, 'spot') for item in spec.get('spots', [])])
+        restaurants = [_to_place(item, 'restaurant') for item in spec.get('restaurants', [])]
+        nights = [_to_place(item, 'night') for item in spec.get('night_activities', [])]
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        print(f"--- ❌ [optimize_itinerary] 参数错误: {e} ---")
+        return f"错误: trip_spec 格式不正确: {e}"
+
+    places = [hotel, *spots, *restaurants, *nights, *(p for p in (arrival, departure) if p is not None)]
+    arrival_minute = parse_clock((spec.get('arrival') or {}).get('time'))
+    departure_minute = parse_clock((spec.get('departure') or {}).get('time'))
+    try:
+        travel = _build_travel_times(places, city, mode)
+        # 分天与排序是纯计算，规划服务配置了进程池时在子进程中完成
+        frames, unscheduled = run_cpu_bound(
+            plan_frames, hotel, spots, int(spec.get('days', 1)), travel,
+            arrival=arrival, arrival_minute=arrival_minute, departure=departure, departure_minute=departure_minute,
+            restaurants=restaurants, night_activities=nights)
+    except Exception as e:
+        # 优化器的异常或子进程崩溃(BrokenProcessPool)不能中断整轮对话，和其他工具一样把错误交给模型
+        import traceback
+        traceback.print_exc()
+        print(f"--- ❌ [optimize_itinerary] 错误: {e} ---")
+        return f"错误: 行程优化失败: {e}"
+    # 行程状态保存在服务端，之后的渲染和修改都基于它，只重算发生变化的部分
+    itinerary = Itinerary(city, mode, hotel, frames, unscheduled, travel, arrival=arrival,
+                          arrival_minute=arrival_minute, departure=departure, departure_minute=departure_minute)
+    itinerary_store.put(itinerary)
+    plan = itinerary.plan()
+    print(f"--- ✅ [optimize_itinerary] 成功: {len(plan['days'])} 天，"
+          f"{len(plan['unscheduled'])} 个景点未能安排，总交通 {plan['total_travel_minutes']} 分钟 ---")
+    return json.dumps(plan, ensure_ascii=False, separators=(',', ':'))
+
+
+def _route_fetcher(itinerary: Itinerary):
+    """只为行程中还没有结果的交通段并发查询路线(走共享缓存)，几何存入当前会话的几何存储。"""
+    def fetch(legs):
+        return [route_summary(route) for route in compute_routes(legs, itinerary.city, itinerary.mode)]
+    return fetch
+
+
+@tool
+def render_itinerary() -> str:
+    """
+    【行程单工具】在 optimize_itinerary 之后调用一次，它会并发补齐行程中每一段交通的真实路线(换乘步骤、耗时)，
+    并返回完整的Markdown行程单。你应当把它原样输出给用户，不需要再逐段调用 get_route_info。
+    """
+    print(f"--- 🛠️ 调用工具 [render_itinerary]: 正在生成行程单... ---")
+    itinerary = itinerary_store.get()
+    if itinerary is None:
+        return "错误: 当前会话还没有行程，请先调用 optimize_itinerary。"
+    with itinerary.lock:
+        reused, fetched = itinerary.resolve(_route_fetcher(itinerary))
+        markdown = itinerary.to_markdown()
+    print(f"--- ✅ [render_itinerary] 成功: 复用 {reused} 段交通，新查询 {fetched} 段 ---")
+    return markdown
+
+
+@tool
+def edit_itinerary(edits: str) -> str:
+    """
+    【行程修改工具】用户对已生成的行程提出修改时调用，只重算受影响的那几天和新出现的交通段，返回修改摘要和更新后的完整行程单。
+    新地点必须先用 search_place_info 获取坐标。参数 edits 为JSON数组，按顺序执行(任何一条出错则全部不生效):
+    [{"op": "replace", "target": "武侯祠", "place": {"name": "杜甫草堂", "location": "..."}},   # 替换景点/餐厅/夜间活动
+     {"op": "add", "place": {"name": "...", "location": "..."}, "day": 2},   # 新增景点，day 可省略(自动选绕行最少的一天)
+     {"op": "remove", "target": "锦里"},
+     {"op": "move", "target": "春熙路", "day": 3},   # 把景点(包括未能安排的景点)挪到某一天
+     {"op": "swap", "target": "宽窄巷子", "with": "文殊院"},   # 交换两个景点的位置
+     {"op": "set_hotel", "place": {"name": "...", "location": "..."}},
+     {"op": "set_meal", "day": 1, "meal": "lunch或dinner", "place": {"name": "...", "location": "..."}或null},
+     {"op": "set_night", "day": 1, "place": {"name": "...", "location": "..."}或null},
+     {"op": "set_duration", "target": "大熊猫繁育研究基地", "minutes": 240}]
+    """
+    print(f"--- 🛠️ 调用工具 [edit_itinerary]: {edits} ---")
+    itinerary = itinerary_store.get()
+    if itinerary is None:
+        return "错误: 当前会话还没有行程，请先调用 optimize_itinerary。"
+    try:
+        parsed = json.loads(edits)
+        if isinstance(parsed, dict):
+            parsed = [parsed]
+        summary = itinerary.apply(parsed, _to_place, _route_fetcher(itinerary))
+    except (ItineraryEditError, KeyError, TypeError, ValueError) as e:
+        print(f"--- ❌ [edit_itinerary] 修改失败: {e} ---")
+        return f"错误: 修改没有生效: {e}"
+    print(f"--- ✅ [edit_itinerary] 成功: 第 {summary['changed_days']} 天发生变化，"
+          f"复用 {summary['legs_reused']} 段交通，新查询 {summary['legs_fetched']} 段 ---")
+    lines = [f"修改已生效(行程版本 {summary['version']})。"]
+    lines += [f"- {change}" for change in summary['changes']] or ["- 行程没有变化"]
+    lines += [f"- ⚠️ {warning}" for warning in summary['warnings']]
+    lines.append(f"(复用了 {summary['legs_reused']} 段已有的交通路线，新查询 {summary['legs_fetched']} 段)")
+    with itinerary.lock:
+        lines += ["", itinerary.to_markdown()]
+    return "\n".join(lines)
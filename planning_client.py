@@ -0,0 +1,96 @@
+# planning_client.py (规划服务的事件协议与瘦客户端 - Agent逐token的流式输出转为事件，按NDJSON逐行读取)
+
+import json
+import zlib
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+import requests
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from config import PLANNING_SERVICE_URL, PLANNING_JOB_TIMEOUT
+
+# 工具结果在界面上只展示开头一段
+OBSERVATION_PREVIEW_CHARS = 300
+
+
+async def agent_events(agent, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    执行一轮对话，把 astream_events 的细粒度事件转换为界面事件: token(模型逐字输出，包括调用工具前的思考)、
+    action(开始调用工具)、observation(工具结果预览)，最后是带完整回复的 done。
+    模型本身不支持流式输出时，回复在结束时作为一条 message 事件一次性给出。
+    本地执行和规划服务使用同一套事件，界面只需要一种渲染方式。
+    """
+    root_id = None
+    answer: List[str] = []  # 最后一次模型调用输出的片段，最后 join 一次，而不是逐个拼接字符串
+    output = None
+    async for event in agent.astream_events(inputs, config=config, version="v2"):
+        kind = event["event"]
+        if root_id is None:
+            root_id = event["run_id"]
+        if kind == "on_chat_model_stream":
+            content = event["data"]["chunk"].content
+            if isinstance(content, str) and content:
+                answer.append(content)
+                yield {"event": "token", "content": content}
+        elif kind == "on_tool_start":
+            # 调用工具之前输出的文本是中间思考，不属于最终回复
+            answer.clear()
+            yield {"event": "action", "tool": event["name"]}
+        elif kind == "on_tool_end":
+            observation = event["data"].get("output")
+            yield {"event": "observation", "tool": event["name"],
+                   "content": str(getattr(observation, "content", observation))[:OBSERVATION_PREVIEW_CHARS]}
+        elif kind == "on_chain_end" and event["run_id"] == root_id:
+            result = event["data"].get("output")
+            output = result.get("output") if isinstance(result, dict) else None
+    streamed = "".join(answer)
+    if output and not streamed:
+        yield {"event": "message", "content": output}
+    yield {"event": "done", "output": output if isinstance(output, str) else streamed}
+
+
+def dump_history(messages: Sequence[BaseMessage]) -> List[Dict[str, str]]:
+    return [{"role": "user" if isinstance(m, HumanMessage) else "ai", "content": m.content} for m in messages]
+
+
+def load_history(items: Sequence[Dict[str, str]]) -> List[BaseMessage]:
+    return [(HumanMessage if item.get("role") == "user" else AIMessage)(content=str(item.get("content", "")))
+            for item in items]
+
+
+class PlanningServiceError(RuntimeError):
+    """规划服务不可用，或者因为排队已满/该用户的并发已满而拒绝了请求(retry_after 为建议的重试秒数)。"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def service_url(session_id: str, urls: str = PLANNING_SERVICE_URL) -> str:
+    """多个服务实例时按会话ID固定选择其中一个: 行程状态保存在执行它的服务进程里，同一会话必须落在同一实例。"""
+    candidates = [url.strip().rstrip("/") for url in urls.split(",") if url.strip()]
+    if not candidates:
+        raise PlanningServiceError("没有配置 PLANNING_SERVICE_URL")
+    return candidates[zlib.crc32(session_id.encode()) % len(candidates)]
+
+
+def stream_turn(agent: str, prompt: str, history: Sequence[BaseMessage], session_id: str, user_id: str = None,
+                trip_spec: Optional[Dict[str, Any]] = None, timeout: float = PLANNING_JOB_TIMEOUT) -> Iterator[Dict[str, Any]]:
+    """
+    把一轮对话提交给规划服务，逐个产出服务推送的事件(queued/started/token/action/observation/message/done/error)。
+    服务拒绝请求或无法连接时抛出 PlanningServiceError。
+    """
+    payload = {"agent": agent, "input": prompt, "chat_history": dump_history(history), "session_id": session_id,
+               "user_id": user_id or session_id, "trip_spec": trip_spec}
+    try:
+        response = requests.post(f"{service_url(session_id)}/turns", json=payload, stream=True, timeout=(5, timeout))
+    except requests.RequestException as e:
+        raise PlanningServiceError(f"无法连接规划服务: {e}")
+    with response:
+        if response.status_code != 200:
+            retry_after = response.headers.get("Retry-After")
+            raise PlanningServiceError(response.text or f"HTTP {response.status_code}",
+                                       float(retry_after) if retry_after else None)
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
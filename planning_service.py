@@ -0,0 +1,280 @@
+# planning_service.py (独立的异步规划服务 - 有界任务队列 + 工作协程池 + 按用户限流，NDJSON 流式推送进度)
+#
+# 用法: python planning_service.py  然后在 app.py 所在环境设置 PLANNING_SERVICE_URL=http://127.0.0.1:8765
+#   POST /turns   提交一轮对话，应答为 application/x-ndjson，每行一个事件
+#   GET  /health  队列长度、执行中的任务数、累计统计
+
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from aiohttp import web
+
+import async_runtime
+from config import (PLANNING_SERVICE_HOST, PLANNING_SERVICE_PORT, PLANNING_WORKERS, PLANNING_QUEUE_SIZE,
+                    PLANNING_USER_MAX_JOBS, PLANNING_IO_THREADS, PLANNING_CPU_PROCESSES, PLANNING_JOB_TIMEOUT)
+from history_manager import compact_history
+from planning_client import agent_events, load_history
+from session_context import use_session
+from tracing import TurnTracer
+from trip_spec import TripSpec, TripSpecError, find_trip_spec
+
+# 结束一轮对话的事件，客户端读到它就停止
+TERMINAL_EVENTS = ("done", "error")
+
+
+class ServiceBusyError(RuntimeError):
+    """队列已满或该用户的并发已满；status 为返回给客户端的HTTP状态码。"""
+
+    def __init__(self, message: str, status: int, retry_after: int = 5):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+@dataclass
+class PlanningJob:
+    user_id: str
+    session_id: str
+    agent: str
+    inputs: Dict[str, Any]
+    trip_spec: Optional[TripSpec] = None
+    id: int = 0
+    events: "asyncio.Queue[Dict[str, Any]]" = field(default_factory=asyncio.Queue)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    cancelled: bool = False
+    task: Optional["asyncio.Task"] = None
+
+
+def _default_agent_factories() -> Dict[str, Callable[[], Any]]:
+    from explorer_agent_core import create_explorer_agent
+    from route_agent_core import create_route_agent
+    return {"explorer": create_explorer_agent, "planner": create_route_agent}
+
+
+class PlanningService:
+    """
+    在一个事件循环里托管探索家和规划师。请求先进入有界队列，由 workers 个工作协程取出执行:
+    工具里的网络请求走I/O线程池(事件循环的默认执行器)，行程优化这类CPU密集计算走进程池。
+    队列满或同一用户的任务过多时立即拒绝，而不是无限堆积线程。
+    """
+
+    def __init__(self, workers: int = PLANNING_WORKERS, queue_size: int = PLANNING_QUEUE_SIZE,
+                 user_max_jobs: int = PLANNING_USER_MAX_JOBS, io_threads: int = PLANNING_IO_THREADS,
+                 cpu_processes: int = PLANNING_CPU_PROCESSES, job_timeout: float = PLANNING_JOB_TIMEOUT,
+                 agent_factories: Dict[str, Callable[[], Any]] = None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.user_max_jobs = user_max_jobs
+        self.io_threads = io_threads
+        self.cpu_processes = cpu_processes
+        self.job_timeout = job_timeout
+        self._agent_factories = agent_factories
+        self._agents: Dict[str, Any] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks = []
+        self._cpu_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._user_jobs: Dict[str, int] = {}
+        self._running = 0
+        self._ids = itertools.count(1)
+        self._stats = {"accepted": 0, "rejected": 0, "completed": 0, "failed": 0, "cancelled": 0}
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # LangChain 在默认执行器中运行同步工具，固定它的大小，流量突增时排队而不是不断新建线程
+        loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(self.io_threads, thread_name_prefix="planning-io"))
+        if self.cpu_processes > 0:
+            # spawn 而不是 fork: 父进程里已经有事件循环和线程
+            self._cpu_pool = concurrent.futures.ProcessPoolExecutor(
+                self.cpu_processes, mp_context=multiprocessing.get_context("spawn"))
+            async_runtime.set_cpu_executor(self._cpu_pool)
+        factories = self._agent_factories or _default_agent_factories()
+        # Agent执行器本身不保存对话状态，所有任务共享一份
+        self._agents = {name: await loop.run_in_executor(None, factory) for name, factory in factories.items()}
+        self._queue = asyncio.Queue(self.queue_size)
+        self._worker_tasks = [asyncio.create_task(self._worker(), name=f"planning-worker-{i}")
+                              for i in range(self.workers)]
+        print(f"--- ✅ [planning_service] 已启动: {self.workers} 个工作协程，队列上限 {self.queue_size}，"
+              f"I/O线程 {self.io_threads}，CPU进程 {self.cpu_processes} ---")
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        if self._cpu_pool is not None:
+            async_runtime.set_cpu_executor(None)
+            self._cpu_pool.shutdown(cancel_futures=True)
+
+    def submit(self, job: PlanningJob):
+        """把任务放入队列；该用户的任务数或队列已满时抛出 ServiceBusyError。"""
+        if job.agent not in self._agents:
+            raise ValueError(f"未知的 agent: {job.agent!r}，可选 {sorted(self._agents)}")
+        if self._user_jobs.get(job.user_id, 0) >= self.user_max_jobs:
+            self._stats["rejected"] += 1
+            raise ServiceBusyError(f"您已有 {self.user_max_jobs} 个请求在处理中，请等它们完成后再试。", 429, 2)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._stats["rejected"] += 1
+            raise ServiceBusyError("规划服务繁忙，请稍后再试。", 503)
+        job.id = next(self._ids)
+        self._user_jobs[job.user_id] = self._user_jobs.get(job.user_id, 0) + 1
+        self._stats["accepted"] += 1
+        job.events.put_nowait({"event": "queued", "job_id": job.id, "position": self._queue.qsize()})
+
+    def cancel(self, job: PlanningJob):
+        """客户端断开时调用: 还在排队的任务被跳过，正在执行的任务被取消。"""
+        job.cancelled = True
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+
+    def _release(self, job: PlanningJob):
+        remaining = self._user_jobs.get(job.user_id, 1) - 1
+        if remaining > 0:
+            self._user_jobs[job.user_id] = remaining
+        else:
+            self._user_jobs.pop(job.user_id, None)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.cancelled:
+                    self._stats["cancelled"] += 1
+                    continue
+                self._running += 1
+                job.task = asyncio.create_task(self._execute(job))
+                try:
+                    await job.task
+                except asyncio.CancelledError:
+                    if not job.cancelled:
+                        raise
+                    self._stats["cancelled"] += 1
+                finally:
+                    self._running -= 1
+            finally:
+                self._release(job)
+                self._queue.task_done()
+
+    async def _execute(self, job: PlanningJob):
+        job.events.put_nowait({"event": "started", "queue_ms": round((time.perf_counter() - job.enqueued_at) * 1000)})
+        try:
+            output = await asyncio.wait_for(self._run_agent(job), self.job_timeout)
+        except asyncio.TimeoutError:
+            self._stats["failed"] += 1
+            job.events.put_nowait({"event": "error", "message": f"本轮对话超过 {self.job_timeout:.0f} 秒仍未完成，已停止。"})
+        except Exception as e:
+            self._stats["failed"] += 1
+            print(f"--- ❌ [planning_service] 任务 {job.id} 失败: {e} ---")
+            job.events.put_nowait({"event": "error", "message": f"规划服务执行出错: {e}"})
+        else:
+            self._stats["completed"] += 1
+            job.events.put_nowait(output)
+
+    async def _run_agent(self, job: PlanningJob) -> Dict[str, Any]:
+        tracer = TurnTracer(session_id=job.session_id, agent=job.agent)
+        done: Dict[str, Any] = {"event": "done", "output": ""}
+        # 在任务所属会话的上下文中执行，工具据此隔离按会话保存的数据(路线几何、行程状态)
+        with use_session(job.session_id):
+            async for event in agent_events(self._agents[job.agent], job.inputs, config={"callbacks": [tracer]}):
+                if event["event"] == "done":
+                    done = event
+                else:
+                    job.events.put_nowait(event)
+        final_response = done["output"]
+        spec = find_trip_spec(final_response) if job.agent == "explorer" and final_response else None
+        if spec is not None:
+            await _aremember_trip_spec(spec, job.session_id)
+        return dict(done, trace=tracer.finish(), trip_spec=spec.to_dict() if spec is not None else None)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, queued=self._queue.qsize() if self._queue else 0, running=self._running,
+                    workers=self.workers, queue_size=self.queue_size, users=len(self._user_jobs))
+
+
+def _remember_trip_spec(spec: TripSpec, session_id: str):
+    """交接信息中已核实的坐标写入地点缓存，本进程的工具再次查询时不会请求高德；同时开始预取这些地点之间的路线。"""
+    from map_tools import remember_place
+    from route_prefetcher import route_prefetcher
+    for place in spec.places():
+        remember_place(place.name, spec.city, place.location)
+    route_prefetcher.observe_trip_spec(spec, session_id=session_id)
+
+
+def build_job(body: Dict[str, Any]) -> PlanningJob:
+    """校验请求体并构造任务；历史消息按token预算压缩。交接信息等任务被接受后才写入地点缓存(见 handle_turn)。"""
+    prompt = body.get("input")
+    session_id = body.get("session_id")
+    if not isinstance(prompt, str) or not prompt.strip() or not isinstance(session_id, str) or not session_id:
+        raise ValueError("需要非空的 input 和 session_id")
+    inputs = {"input": prompt, "chat_history": compact_history(load_history(body.get("chat_history") or []))}
+    spec = TripSpec.from_dict(body["trip_spec"]) if body.get("trip_spec") else None
+    if spec is not None:
+        inputs["trip_spec"] = spec.to_prompt()
+    return PlanningJob(user_id=str(body.get("user_id") or session_id), session_id=session_id,
+                       agent=str(body.get("agent", "planner")), inputs=inputs, trip_spec=spec)
+
+
+async def _aremember_trip_spec(spec: TripSpec, session_id: str):
+    """_remember_trip_spec 要写SQLite缓存，放到I/O线程池中执行，不阻塞事件循环；失败只影响缓存和预取，不影响本轮对话。"""
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, _remember_trip_spec, spec, session_id)
+    except Exception as e:
+        print(f"--- ⚠️ [planning_service] 交接信息写入地点缓存失败: {e} ---")
+
+
+async def handle_turn(request: web.Request) -> web.StreamResponse:
+    service: PlanningService = request.app["service"]
+    try:
+        job = build_job(await request.json())
+        service.submit(job)
+    except ServiceBusyError as e:
+        return web.Response(status=e.status, text=str(e), headers={"Retry-After": str(e.retry_after)})
+    except (ValueError, TripSpecError) as e:
+        return web.Response(status=400, text=f"请求格式不正确: {e}")
+    if job.trip_spec is not None:
+        # 被拒绝(429/503)的请求不写缓存、不开始预取
+        await _aremember_trip_spec(job.trip_spec, job.session_id)
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson; charset=utf-8"})
+    await response.prepare(request)
+    try:
+        while True:
+            event = await job.events.get()
+            await response.write(json.dumps(event, ensure_ascii=False).encode() + b"\n")
+            if event["event"] in TERMINAL_EVENTS:
+                break
+    except (ConnectionResetError, asyncio.CancelledError):
+        # 客户端断开(例如页面被刷新)，不再为它继续执行
+        service.cancel(job)
+        raise
+    await response.write_eof()
+    return response
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response(request.app["service"].stats())
+
+
+def create_app(service: PlanningService = None) -> web.Application:
+    app = web.Application()
+    app["service"] = service or PlanningService()
+
+    async def lifecycle(app: web.Application):
+        await app["service"].start()
+        yield
+        await app["service"].stop()
+
+    app.cleanup_ctx.append(lifecycle)
+    app.router.add_post("/turns", handle_turn)
+    app.router.add_get("/health", handle_health)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host=PLANNING_SERVICE_HOST, port=PLANNING_SERVICE_PORT)
@@ -0,0 +1,376 @@
+# poi_gazetteer.py (本地地点库 - 按城市的名称/别名模糊索引 + 网格空间索引，离线解析地点、查询附近)
+
+import bisect
+import csv
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from cache_store import normalize_key_part
+from config import POI_GAZETTEER_PATH, POI_MATCH_THRESHOLD, POI_GRID_DEGREES
+
+_EARTH_RADIUS = 6371000
+_LOCATION = re.compile(r'^\s*(-?\d{1,3}(?:\.\d+)?)\s*,\s*(-?\d{1,2}(?:\.\d+)?)\s*$')
+_PUNCTUATION = re.compile(r"[\s·・\-—_,，.。'\"“”‘’()（）\[\]【】]")
+_PARENTHESIS = re.compile(r"[(（][^)）]*[)）]")
+# 交通设施、出入口的名称里常常带着景点名(例如"星海广场地铁站")，只有查询里也带这些词时才让它们参与模糊匹配
+_FACILITY_SUFFIXES = ('地铁站', '公交站', '停车场', '出入口', '售票处', '入口', '出口', '站')
+# 同名且相距不到这么多米的地点视为同一个(合并别名)；更远的同名地点(连锁店的不同分店)分别保存
+_SAME_PLACE_METERS = 500
+# 模糊匹配时，第二名与第一名的得分差距小于它且两者不是同一个地点，就认为有歧义，交给高德解析
+_AMBIGUITY_MARGIN = 0.05
+# 一次模糊匹配最多给多少个候选打分(候选来自前缀匹配和最稀有的两个二元组的交集)
+_MAX_CANDIDATES = 500
+
+
+def normalize_name(text: str) -> str:
+    """地点名称的匹配键: 全角转半角、小写，去掉空白和标点。"""
+    return _PUNCTUATION.sub("", normalize_key_part(text))
+
+
+def distance_meters(lng1: float, lat1: float, lng2: float, lat2: float) -> float:
+    """城市尺度上足够精确的等距圆柱投影距离(米)，比 haversine 便宜。"""
+    x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return _EARTH_RADIUS * math.hypot(x, y)
+
+
+def parse_location(location: Any) -> Tuple[float, float]:
+    match = _LOCATION.match(str(location or ''))
+    if not match:
+        raise ValueError(f"坐标不是'经度,纬度'格式: {location!r}")
+    lng, lat = float(match.group(1)), float(match.group(2))
+    if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+        raise ValueError(f"坐标超出范围: {location!r}")
+    return lng, lat
+
+
+@dataclass(frozen=True, slots=True)
+class POI:
+    name: str
+    location: str  # "经度,纬度"
+    city: str
+    address: str = ""
+    category: str = ""
+    aliases: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], city: Optional[str] = None) -> "POI":
+        """从导入文件的一行构造地点: 需要 city/name，以及 location 或 lng+lat；aliases 可以是列表或用 | 、分隔的字符串。"""
+        name = str(record.get('name') or '').strip()
+        city = str(city or record.get('city') or '').strip()
+        if not name or not city:
+            raise ValueError(f"缺少 name 或 city: {record!r}")
+        location = record.get('location') or f"{record.get('lng')},{record.get('lat')}"
+        lng, lat = parse_location(location)
+        aliases = record.get('aliases') or ()
+        if isinstance(aliases, str):
+            aliases = re.split(r'[|、;；]', aliases)
+        return cls(name=name, location=f"{lng},{lat}", city=city, address=str(record.get('address') or ''),
+                   category=str(record.get('category') or ''),
+                   aliases=tuple(alias.strip() for alias in aliases if alias and alias.strip()))
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"name": self.name, "location": self.location, "address": self.address}
+
+
+def _bigrams(text: str) -> Set[str]:
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+def match_score(query: str, key: str) -> float:
+    """
+    归一化后的查询与名称/别名之间的匹配得分(0~1):
+    完全相同 1.0 > 名称以查询开头(例如"老虎滩" -> "老虎滩海洋公园") > 名称包含查询 / 查询包含名称 > 二元组相似度。
+    """
+    if query == key:
+        return 1.0
+    if len(query) < 2 or len(key) < 2:
+        return 0.0
+    if key.startswith(query):
+        score = 0.6 + 0.4 * len(query) / len(key)
+    elif query in key:
+        score = 0.5 + 0.3 * len(query) / len(key)
+    elif key in query:
+        score = 0.5 + 0.3 * len(key) / len(query)
+    else:
+        a, b = _bigrams(query), _bigrams(key)
+        score = 0.8 * 2 * len(a & b) / (len(a) + len(b))
+    if key.endswith(_FACILITY_SUFFIXES) and not query.endswith(_FACILITY_SUFFIXES):
+        score -= 0.3
+    return score
+
+
+class CityIndex:
+    """一个城市的地点: 名称/别名 -> 地点 的精确索引、二元组倒排索引(模糊匹配候选)、经纬度网格(附近查询)。"""
+
+    def __init__(self, city: str, grid_degrees: float = POI_GRID_DEGREES):
+        self.city = city
+        self.grid_degrees = grid_degrees
+        self.pois: List[POI] = []
+        self._coords: List[Tuple[float, float]] = []
+        self._names: List[Set[str]] = []  # 每个地点归一化后的名称和别名
+        self._texts: List[str] = []  # 附近查询按关键词过滤用的 名称/类别/地址
+        self._keys: Dict[str, Set[int]] = {}
+        self._sorted_keys: Optional[List[str]] = []  # 用于前缀匹配；批量导入期间为None，用到时再排序
+        self._bigrams: Dict[str, Set[int]] = {}
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        self._extent: Optional[List[int]] = None  # 网格范围 [min_x, min_y, max_x, max_y]
+
+    def _cell(self, lng: float, lat: float) -> Tuple[int, int]:
+        return math.floor(lng / self.grid_degrees), math.floor(lat / self.grid_degrees)
+
+    @staticmethod
+    def _match_keys(poi: POI) -> Set[str]:
+        names = {poi.name, _PARENTHESIS.sub("", poi.name), *poi.aliases}
+        return {key for key in map(normalize_name, names) if key}
+
+    def _index_keys(self, index: int, keys: Set[str]):
+        self._names[index] |= keys
+        poi = self.pois[index]
+        self._texts[index] = "\n".join(map(normalize_name, (poi.name, poi.category, poi.address)))
+        for key in keys:
+            if key not in self._keys and self._sorted_keys is not None:
+                bisect.insort(self._sorted_keys, key)
+            self._keys.setdefault(key, set()).add(index)
+            for gram in _bigrams(key):
+                self._bigrams.setdefault(gram, set()).add(index)
+
+    def add(self, poi: POI) -> bool:
+        """加入一个地点，返回是否是新地点。同名且相距很近的地点只合并别名和缺失的地址/类别。"""
+        lng, lat = parse_location(poi.location)
+        for index in self._keys.get(normalize_name(poi.name), ()):
+            existing = self.pois[index]
+            if existing.name == poi.name and distance_meters(lng, lat, *self._coords[index]) < _SAME_PLACE_METERS:
+                aliases = tuple(dict.fromkeys(existing.aliases + poi.aliases))
+                self.pois[index] = replace(existing, aliases=aliases, address=existing.address or poi.address,
+                                           category=existing.category or poi.category)
+                self._index_keys(index, self._match_keys(poi))
+                return False
+        index = len(self.pois)
+        self.pois.append(poi)
+        self._coords.append((lng, lat))
+        self._names.append(set())
+        self._texts.append("")
+        self._index_keys(index, self._match_keys(poi))
+        cell = self._cell(lng, lat)
+        self._grid.setdefault(cell, []).append(index)
+        if self._extent is None:
+            self._extent = [cell[0], cell[1], cell[0], cell[1]]
+        else:
+            self._extent = [min(self._extent[0], cell[0]), min(self._extent[1], cell[1]),
+                            max(self._extent[2], cell[0]), max(self._extent[3], cell[1])]
+        return True
+
+    # --- 名称匹配 ---
+    def search(self, name: str, limit: int = 5) -> List[Tuple[float, POI]]:
+        """按得分从高到低返回 [(得分, 地点)]。查询前面带的城市名会被去掉(例如"大连星海广场")。"""
+        query = normalize_name(name)
+        city = normalize_name(self.city)
+        if query.startswith(city) and len(query) > len(city) + 1:
+            query = query[len(city):]
+        if not query:
+            return []
+        scored = []
+        for index in self._candidates(query):
+            score = max(match_score(query, key) for key in self._names[index])
+            if score > 0:
+                scored.append((score, index))
+        scored.sort(key=lambda item: (-item[0], len(self.pois[item[1]].name), item[1]))
+        return [(round(score, 3), self.pois[index]) for score, index in scored[:limit]]
+
+    def begin_bulk(self):
+        """批量导入前调用: 暂停维护有序键表，导入完成后第一次前缀匹配时一次性排序。"""
+        self._sorted_keys = None
+
+    def _candidates(self, query: str) -> Set[int]:
+        """
+        需要打分的候选: 精确命中的名称/别名、以查询开头的名称(有序键表上二分查找)，
+        再加上同时包含查询中最稀有的两个二元组的地点(包含关系和相似度匹配)。
+        """
+        if self._sorted_keys is None:
+            self._sorted_keys = sorted(self._keys)
+        candidates = set(self._keys.get(query, ()))
+        start = bisect.bisect_left(self._sorted_keys, query)
+        for key in self._sorted_keys[start:start + _MAX_CANDIDATES]:
+            if not key.startswith(query):
+                break
+            candidates |= self._keys[key]
+        postings = sorted((self._bigrams.get(gram, set()) for gram in _bigrams(query)), key=len)
+        shared = postings[0] & postings[1] if len(postings) > 1 else postings[0]
+        for index in shared:
+            if len(candidates) >= _MAX_CANDIDATES:
+                break
+            candidates.add(index)
+        return candidates
+
+    def resolve(self, name: str, threshold: float = POI_MATCH_THRESHOLD, fuzzy: bool = True) -> Optional[POI]:
+        """
+        得分足够高且没有歧义时返回最匹配的地点；否则返回None，交给高德解析。
+        fuzzy=False 时只接受名称或别名完全相同的唯一地点: 前缀匹配会把"西湖"解析成"西湖银泰城"，不能代替高德。
+        """
+        exact = self._keys.get(normalize_name(name), ())
+        if len(exact) == 1:
+            # 名称或别名完全相同且只有一个地点: 不需要模糊匹配
+            return self.pois[next(iter(exact))]
+        if not fuzzy:
+            return None
+        results = self.search(name, limit=2)
+        if not results or results[0][0] < threshold:
+            return None
+        if len(results) > 1 and results[0][0] - results[1][0] < _AMBIGUITY_MARGIN:
+            (_, best), (_, second) = results
+            if distance_meters(*parse_location(best.location), *parse_location(second.location)) >= _SAME_PLACE_METERS:
+                return None
+        return results[0][1]
+
+    # --- 空间查询 ---
+    def nearby(self, lng: float, lat: float, radius_m: Optional[float] = None, k: int = 10,
+               keyword: str = "") -> List[Tuple[float, POI]]:
+        """
+        返回按距离排序的 [(距离米, 地点)]，最多 k 个，可限定半径和关键词(匹配名称/类别/地址)。
+        从查询点所在的网格开始一圈圈向外扩展，已找到 k 个且第 k 个比下一圈的最近距离还近时停止；
+        一圈的网格数比有数据的网格还多时(稀疏数据、大半径)改为直接遍历全部地点。与查询点重合的地点(例如酒店本身)不返回。
+        """
+        if not self.pois:
+            return []
+        keyword = normalize_name(keyword)
+        cx, cy = self._cell(lng, lat)
+        # 一个网格在东西方向上最窄，用它保守地估计“下一圈网格”的最近距离
+        cell_m = (math.radians(self.grid_degrees) * _EARTH_RADIUS
+                  * max(0.01, math.cos(math.radians(abs(lat) + self.grid_degrees))))
+        min_x, min_y, max_x, max_y = self._extent
+        max_ring = max(cx - min_x, max_x - cx, cy - min_y, max_y - cy, 0)
+        if radius_m is not None:
+            max_ring = min(max_ring, int(radius_m // cell_m) + 1)
+
+        found: List[Tuple[float, int]] = []
+
+        def consider(indexes: Iterable[int]):
+            for index in indexes:
+                distance = distance_meters(lng, lat, *self._coords[index])
+                if distance < 1 or (radius_m is not None and distance > radius_m):
+                    continue
+                if keyword and keyword not in self._texts[index]:
+                    continue
+                found.append((distance, index))
+
+        for ring in range(max_ring + 1):
+            if 8 * ring > len(self._grid):
+                # 这一圈的网格数已经超过有数据的网格数(数据稀疏或半径很大)，直接遍历全部地点更快
+                found.clear()
+                consider(range(len(self.pois)))
+                break
+            for x in range(cx - ring, cx + ring + 1):
+                step = 1 if abs(x - cx) == ring else 2 * ring
+                for y in range(cy - ring, cy + ring + 1, max(1, step)):
+                    consider(self._grid.get((x, y), ()))
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= ring * cell_m:
+                    break
+        found.sort()
+        return [(round(distance), self.pois[index]) for distance, index in found[:k]]
+
+
+class Gazetteer:
+    """
+    进程内共享的本地地点库，按城市分别建索引。数据来源:
+    - 启动后第一次使用时，导入 POI_GAZETTEER_PATH(CSV或JSONL)以及 bootstrap 传入的种子(例如地点缓存中已有的结果)；
+    - 之后每次高德解析成功都会把结果(连同用户的原始叫法作为别名)加进来。
+    """
+
+    def __init__(self, path: Optional[str] = POI_GAZETTEER_PATH):
+        self.path = path
+        self._cities: Dict[str, CityIndex] = {}
+        self._lock = threading.RLock()
+        self._bootstrapped = False
+
+    def bootstrap(self, seed: Optional[Callable[[], Iterable[POI]]] = None):
+        if self._bootstrapped:
+            return
+        with self._lock:
+            if self._bootstrapped:
+                return
+            started = time.perf_counter()
+            loaded = self.load(self.path) if self.path and os.path.exists(self.path) else 0
+            seeded = sum(self.add(poi) for poi in seed()) if seed else 0
+            self._bootstrapped = True
+            print(f"--- ✅ [poi_gazetteer] 本地地点库就绪: 文件 {loaded} 个，地点缓存 {seeded} 个，"
+                  f"用时 {(time.perf_counter() - started) * 1000:.0f}ms ---")
+
+    def _index(self, city: str, create: bool = False) -> Optional[CityIndex]:
+        key = normalize_name(city)
+        if create and key not in self._cities:
+            self._cities[key] = CityIndex(city)
+            self._cities[key].begin_bulk()
+        return self._cities.get(key)
+
+    def add(self, poi: POI) -> bool:
+        with self._lock:
+            return self._index(poi.city, create=True).add(poi)
+
+    def load(self, path: str) -> int:
+        """批量导入 CSV(带表头) 或 JSONL 文件，返回新增的地点数；格式不对的行会被跳过。"""
+        added = skipped = 0
+        with self._lock:
+            for index in self._cities.values():
+                index.begin_bulk()
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            if path.endswith((".jsonl", ".json")):
+                records = (json.loads(line) for line in f if line.strip())
+            else:
+                records = csv.DictReader(f)
+            for record in records:
+                try:
+                    added += self.add(POI.from_record(record))
+                except (ValueError, TypeError):
+                    skipped += 1
+        if skipped:
+            print(f"--- ⚠️ [poi_gazetteer] {path} 中有 {skipped} 行格式不正确，已跳过 ---")
+        return added
+
+    def search(self, name: str, city: str, limit: int = 5) -> List[Tuple[float, POI]]:
+        with self._lock:
+            index = self._index(city)
+            return index.search(name, limit) if index else []
+
+    def resolve(self, name: str, city: str, fuzzy: bool = True) -> Optional[POI]:
+        with self._lock:
+            index = self._index(city)
+            return index.resolve(name, fuzzy=fuzzy) if index else None
+
+    def nearby(self, location: str, city: str, radius_m: Optional[float] = None, k: int = 10,
+               keyword: str = "") -> List[Tuple[float, POI]]:
+        lng, lat = parse_location(location)
+        with self._lock:
+            index = self._index(city)
+            return index.nearby(lng, lat, radius_m, k, keyword) if index else []
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {city.city: len(city.pois) for city in self._cities.values()}
+
+
+gazetteer = Gazetteer()
+
+
+if __name__ == '__main__':
+    # 用法: python poi_gazetteer.py 地点文件.csv [城市 查询词]  -> 导入并打印各城市的地点数，可选地测一次匹配和附近查询的耗时
+    book = Gazetteer(path=sys.argv[1] if len(sys.argv) > 1 else POI_GAZETTEER_PATH)
+    book.bootstrap()
+    print(json.dumps(book.stats(), ensure_ascii=False, indent=2))
+    if len(sys.argv) > 3:
+        started = time.perf_counter()
+        poi = book.resolve(sys.argv[3], sys.argv[2])
+        print(f"resolve: {poi} ({(time.perf_counter() - started) * 1e6:.0f}us)")
+        if poi:
+            started = time.perf_counter()
+            results = book.nearby(poi.location, sys.argv[2], radius_m=2000, k=10)
+            print(f"nearby: {[(d, p.name) for d, p in results]} ({(time.perf_counter() - started) * 1e6:.0f}us)")
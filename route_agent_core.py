@@ -1,21 +1,23 @@
 # route_agent_core.py (V5.0 - 最终融合版)
 
-from langchain_community.chat_models.tongyi import ChatTongyi
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from config import DASHSCOPE_API_KEY
-from map_tools import search_place_info, get_route_info
+from history_manager import budget_observations
+from llm_provider import get_chat_model
+from map_tools import search_place_info, get_route_info, get_route_matrix, find_nearby_places
+from planner_tools import optimize_itinerary, render_itinerary, edit_itinerary
 
 
-def create_route_agent():
+def create_route_agent(llm=None):
     """
     创建一个融合了V3.5高质量规划能力和V5.0交互能力的最终版Agent执行器。
     """
     print("--- 正在创建最终版交互式路线规划Agent (V5.0) ---")
 
     # 1. 大脑与工具箱 (保持不变)
-    llm = ChatTongyi(model_name="qwen-plus", dashscope_api_key=DASHSCOPE_API_KEY, temperature=0.7)
-    tools = [search_place_info, get_route_info]
+    llm = llm or get_chat_model()
+    tools = [search_place_info, get_route_info, get_route_matrix, find_nearby_places, optimize_itinerary,
+             render_itinerary, edit_itinerary]
 
     # 2. 【核心】设计最终版的、带有“记忆”和“高质量指令”的系统提示
     # 我们将V3.5的详细指令原封不动地搬过来，并加入了交互逻辑
@@ -41,6 +43,7 @@ def create_route_agent():
             
             1.  **全面获取坐标**:
                 -   对于用户提到的 **每一个地点**（景点、指定餐厅、酒店、车站、机场等），你 **必须、逐一地** 调用 `search_place_info` 工具来获取其精确坐标。这是后续所有规划的基石，绝不能跳过。
+                -   **例外**: 下方“已核实的行程信息”中列出的地点，坐标已经由探索家核实过，**直接使用，不要再调用** `search_place_info`；只对其中没有的新地点调用工具。该信息可以原样作为 `optimize_itinerary` 的 trip_spec 参数。
             
             2.  **找不到地点时的交互规则**:
                 -   **当且仅当** `search_place_info` 工具返回了错误、空结果、或者明确提示“找不到地点”时，你 **必须立即暂停** 后续的所有工具调用。
@@ -56,6 +59,9 @@ def create_route_agent():
             #### **第三阶段：思考、计算与行程生成【核心规划区】**
             1.  **行程草案 (内部思考)**:
                 - 根据地理位置远近，将景点和指定的餐厅合理地分配到每一天。
+                - **优先使用优化器**: 拿到所有坐标后，调用 **一次** `optimize_itinerary`，它会按下面的时间计算规则确定性地完成分天、排序和时间表推演。你应当直接采用它的结果，不要自己重新排序；如果它返回了 `unscheduled`（安排不下的景点），要如实告诉用户并给出取舍建议。
+                - **先批量、后逐段**: 如果需要手动比较多个地点的远近，调用 **一次** `get_route_matrix` 获取两两之间的耗时；**不要**为了比较远近而逐对调用 `get_route_info`。
+                - **顺路推荐**: 用户没有指定餐厅、或者想在某处附近加一个去处时，可以用 `find_nearby_places` 查找附近的地点。
 
             2.  **精确时间表推演**:
                 - **时间计算规则**:
@@ -63,7 +69,7 @@ def create_route_agent():
                     - **用餐时间**: 午餐(12-14点)、晚餐(18-20点)时间窗口内，如果用户指定了餐厅，则规划前往并安排1.5小时；如果未指定，则在行程中预留1小时自由用餐时间。
                     - **活动时段**: 日间活动从早上9:00开始，晚间活动最晚可到22:00。
                 - **路线计算【最高优先级铁律】**:
-                    - 在规划 **任意两点之间** 的交通时，你 **必须** 调用 `get_route_info` 工具。
+                    - 在规划 **任意两点之间** 的交通时，你 **必须** 使用工具返回的真实路线。调用过 `optimize_itinerary` 后，调用 **一次** `render_itinerary`，它会为每个 `travel` 段补齐 `get_route_info` 的结果；只有不经过优化器的零散交通段才需要你自己调用 `get_route_info`。这时如果不确定该坐公交、步行还是打车(例如距离很近，或者公交可能没有方案)，用 `mode="auto"` 调用 **一次**，它会同时比较各种方式并选出最合适的，**不要**为同一段交通逐个尝试不同的 mode。
                     - **你绝对不被允许自己“想象”或“编造”交通细节。你输出的每一个关于交通的字，都必须直接来源于 `get_route_info` 工具返回的JSON结果中的'steps', 'duration_minutes'等字段。**
                 - **行程逻辑**:
                     - **抵达/离开**: 严格处理第一天从“抵达站”开始和最后一天到“离开站”结束的全程逻辑，并进行严格的时间合理性检查（火车提前1小时，飞机提前2小时）。
@@ -72,12 +78,19 @@ def create_route_agent():
             3.  **输出最终行程单**:
                 - 输出格式必须是带有具体时间区间的Markdown，清晰地展示所有活动，包括景点游玩、交通、办理入住、**用餐**等。
                 - 在交通部分，**必须原样复制** `get_route_info` 工具返回的 `steps` 列表中的所有内容，不得删减。
+                - 如果调用了 `render_itinerary`，直接原样输出它返回的Markdown行程单，可以在前后补充简短的提示。
 
             ---
             ### **后续修改工作流程**
             - 当用户提出修改意见时，回顾 **chat_history**，理解用户的修改意图。
             - **高效修改**: 只重新调用工具查询和计算发生改变的部分，而不是全盘重来。
+                - 行程保存在服务端。替换/增删/挪动景点、换酒店、换餐厅或夜间活动、调整游玩时长时，调用 **一次** `edit_itinerary`（新地点先用 `search_place_info` 查坐标），它只重算受影响的那几天和新出现的交通段，并返回更新后的完整行程单。
+                - 修改时 **不要** 重新调用 `optimize_itinerary`，也 **不要** 为没有变化的交通段调用 `get_route_info`；只有城市、天数、抵达/离开时间这类根本性的变化才需要重新优化。
             - **输出更新版计划**: 生成一份修改后的完整行程单，并可以简要说明修改了哪些部分。
+
+            ---
+            ### **已核实的行程信息** (来自探索家，JSON；为“无”时按上面的流程自行收集)
+            {trip_spec}
             """
         ),
         # 这里会插入历史对话
@@ -86,7 +99,7 @@ def create_route_agent():
         ("human", "{input}"),
         # 这里是Agent的思考区
         ("placeholder", "{agent_scratchpad}"),
-    ])
+    ]).partial(trip_spec="无")
 
     # 3. 创建Agent与执行器 (保持不变)
     agent = create_tool_calling_agent(llm, tools, prompt)
@@ -94,7 +107,9 @@ def create_route_agent():
         agent=agent,
         tools=tools,
         max_iterations=100,  # 仍然建议保留一个上限
-        handle_parsing_errors=True
+        handle_parsing_errors=True,
+        # 一轮规划可能调用几十次工具，较早的工具结果只保留开头部分，控制草稿区的长度
+        trim_intermediate_steps=budget_observations
     )
 
     print("✅ 最终版交互式Agent创建成功！")
@@ -0,0 +1,197 @@
+# route_prefetcher.py (路线预取 - 会话核实了新地点后，在后台用富余的高德配额预先查询规划师大概率会用到的交通段)
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from amap_client import AmapQuotaBusy
+from config import (AMAP_QPS, ROUTE_PREFETCH_ENABLED, ROUTE_PREFETCH_MODES, ROUTE_PREFETCH_WALK_METERS,
+                    ROUTE_PREFETCH_NEIGHBORS, ROUTE_PREFETCH_MAX_LEGS, ROUTE_PREFETCH_DEBOUNCE,
+                    ROUTE_PREFETCH_IDLE_SECONDS)
+from itinerary_optimizer import haversine_meters
+from map_tools import prefetch_route, snap_location
+from session_context import get_session_id
+
+# 从地点名称猜测类型(探索家核实地点时并不说明它是酒店还是景点)
+_STATION_KEYWORDS = ('站', '机场', '航站楼')
+_HOTEL_KEYWORDS = ('酒店', '宾馆', '民宿', '客栈', '旅馆', '公寓', 'hotel', 'inn')
+_KIND_RANK = {'spot': 0, 'station': 1, 'hotel': 2}
+
+Leg = Tuple[str, str, str]  # (起点, 终点, 出行方式)
+
+
+def guess_kind(name: str) -> str:
+    lowered = name.lower()
+    if any(keyword in lowered for keyword in _HOTEL_KEYWORDS):
+        return 'hotel'
+    if name.endswith(_STATION_KEYWORDS) or '机场' in name:
+        return 'station'
+    return 'spot'
+
+
+@dataclass
+class _SessionPrefetch:
+    city: str
+    places: Dict[str, str] = field(default_factory=dict)  # 吸附后的坐标 -> 类型
+    pending: Deque[Leg] = field(default_factory=deque)
+    done: Set[Leg] = field(default_factory=set)
+    due: Optional[float] = None      # 地点集合变化后，到这个时刻重新计算待预取的交通段
+    touched: float = field(default_factory=time.monotonic)
+    fetched: int = 0
+    cached: int = 0
+    failed: int = 0
+
+
+def plan_legs(places: Dict[str, str], modes: List[str] = ROUTE_PREFETCH_MODES,
+              neighbors: int = ROUTE_PREFETCH_NEIGHBORS, walk_meters: float = ROUTE_PREFETCH_WALK_METERS,
+              limit: int = ROUTE_PREFETCH_MAX_LEGS) -> List[Leg]:
+    """
+    按被用到的可能性排序的交通段: 车站<->酒店，酒店<->各景点(近的在前)，每个景点到最近的几个景点。
+    没有核实酒店时只预取景点之间的相邻交通段。
+    """
+    hotels = [loc for loc, kind in places.items() if kind == 'hotel']
+    stations = [loc for loc, kind in places.items() if kind == 'station']
+    spots = [loc for loc, kind in places.items() if kind == 'spot']
+    pairs: List[Tuple[str, str]] = []
+    for hotel in hotels:
+        for station in stations:
+            pairs += [(station, hotel), (hotel, station)]
+    for hotel in hotels:
+        for spot in sorted(spots, key=lambda loc: haversine_meters(hotel, loc)):
+            pairs += [(hotel, spot), (spot, hotel)]
+    for spot in spots:
+        nearest = sorted((other for other in spots if other != spot), key=lambda loc: haversine_meters(spot, loc))
+        pairs += [(spot, other) for other in nearest[:neighbors]]
+
+    legs: Dict[Leg, None] = {}
+    for origin, destination in pairs:
+        extra = ['walking'] if 'walking' not in modes and haversine_meters(origin, destination) < walk_meters else []
+        for mode in [*modes, *extra]:
+            legs.setdefault((origin, destination, mode), None)
+    return list(legs)[:limit]
+
+
+class RoutePrefetcher:
+    """
+    每个会话维护一份已核实的地点集合；集合变化(并等待 debounce 秒合并并发的核实)后重新计算待预取的交通段，
+    由一个后台线程逐个查询写入路线缓存。后台查询只使用令牌桶里的富余令牌(amap_get(background=True))，
+    前台请求一多就自动让路；会话空闲超过 idle_seconds 或被 cancel() 后停止。
+    """
+
+    def __init__(self, fetch: Callable[[str, str, str, str], bool] = prefetch_route, enabled: bool = ROUTE_PREFETCH_ENABLED,
+                 debounce: float = ROUTE_PREFETCH_DEBOUNCE, idle_seconds: float = ROUTE_PREFETCH_IDLE_SECONDS):
+        self.fetch = fetch
+        self.enabled = enabled
+        self.debounce = debounce
+        self.idle_seconds = idle_seconds
+        self._sessions: Dict[str, _SessionPrefetch] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def observe(self, city: str, name: str, location: str, kind: str = None, session_id: str = None):
+        """记录当前会话核实了一个地点(kind 为 hotel/station/spot，省略时按名称猜测)。"""
+        if not self.enabled or not location or ',' not in location:
+            return
+        session_id = session_id or get_session_id()
+        snapped = snap_location(location)
+        kind = kind or guess_kind(name)
+        with self._cond:
+            state = self._sessions.get(session_id)
+            if state is None or state.city != city:
+                # 换了城市，之前的地点不再相关
+                state = self._sessions[session_id] = _SessionPrefetch(city=city)
+            state.touched = time.monotonic()
+            previous = state.places.get(snapped)
+            if previous is not None and _KIND_RANK[previous] >= _KIND_RANK[kind]:
+                return
+            state.places[snapped] = kind
+            state.due = state.touched + self.debounce
+            self._ensure_thread()
+            self._cond.notify()
+
+    def observe_trip_spec(self, spec, session_id: str = None):
+        """探索家交接的行程信息里地点类型是明确的(酒店、车站、景点)。"""
+        kinds = [(spec.hotel, 'hotel')]
+        kinds += [(visit.station, 'station') for visit in (spec.arrival, spec.departure) if visit is not None]
+        kinds += [(place, 'spot') for place in (*spec.spots, *spec.restaurants, *spec.night_activities)]
+        for place, kind in kinds:
+            self.observe(spec.city, place.name, place.location, kind, session_id=session_id)
+
+    def cancel(self, session_id: str = None):
+        """会话结束时调用，丢弃它尚未完成的预取。"""
+        with self._cond:
+            self._sessions.pop(session_id or get_session_id(), None)
+
+    def stats(self, session_id: str = None) -> Dict[str, int]:
+        with self._cond:
+            state = self._sessions.get(session_id or get_session_id())
+            if state is None:
+                return {}
+            return {"places": len(state.places), "pending": len(state.pending), "fetched": state.fetched,
+                    "cached": state.cached, "failed": state.failed}
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="route-prefetcher", daemon=True)
+            self._thread.start()
+
+    def _next_leg(self) -> Tuple[Optional[Tuple[str, _SessionPrefetch, Leg]], Optional[float]]:
+        """在锁内调用: 取出下一段要预取的交通段；没有时返回最近一次需要醒来的等待时间。"""
+        now = time.monotonic()
+        wake = None
+        for session_id, state in list(self._sessions.items()):
+            if now - state.touched > self.idle_seconds:
+                del self._sessions[session_id]
+                continue
+            if state.due is not None:
+                if state.due > now:
+                    delay = state.due - now
+                    wake = delay if wake is None else min(wake, delay)
+                    continue
+                state.due = None
+                state.pending = deque(leg for leg in plan_legs(state.places) if leg not in state.done)
+        # 多个会话轮流预取，后核实地点的会话不会被前一个会话的长队列饿死
+        for session_id, state in sorted(self._sessions.items(), key=lambda item: len(item[1].done)):
+            if state.pending:
+                return (session_id, state, state.pending.popleft()), None
+        return None, wake
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job, wake = self._next_leg()
+                while job is None:
+                    self._cond.wait(wake if wake is not None else self.idle_seconds)
+                    job, wake = self._next_leg()
+            session_id, state, leg = job
+            origin, destination, mode = leg
+            try:
+                fetched = self.fetch(origin, destination, state.city, mode)
+            except AmapQuotaBusy:
+                # 配额正被前台使用: 放回队首，等大约一个令牌的时间再试
+                with self._cond:
+                    if self._sessions.get(session_id) is state:
+                        state.pending.appendleft(leg)
+                time.sleep(1 / AMAP_QPS)
+                continue
+            except Exception as e:
+                print(f"--- ⚠️ [route_prefetcher] 预取 {origin} -> {destination} ({mode}) 失败: {e} ---")
+                with self._cond:
+                    state.failed += 1
+                    state.done.add(leg)
+                continue
+            with self._cond:
+                state.done.add(leg)
+                if fetched:
+                    state.fetched += 1
+                else:
+                    state.cached += 1
+                if not state.pending and state.due is None:
+                    print(f"--- ✅ [route_prefetcher] 会话 {session_id}: 已预取 {state.fetched} 段交通"
+                          f"(另有 {state.cached} 段已在缓存中) ---")
+
+
+# 进程内共享的预取器，后台线程在第一次核实地点时启动
+route_prefetcher = RoutePrefetcher()
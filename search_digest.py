@@ -0,0 +1,138 @@
+# search_digest.py (网络搜索结果的精简 - 查询词归一化、URL与段落去重、候选地点提取、按token预算截断)
+
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from history_manager import estimate_tokens
+
+# 不影响搜索意图的口语成分: "大连好玩的地方" 与 "大连有什么好玩的" 归一化为同一个查询。
+# 只去掉完整的短语，单字虚词和 地方/推荐 这类词只在句末去掉，以免 "酒吧"->"酒"、"地方菜"->"菜" 把不同的查询合并；
+# 句末的 吧 不去掉，它和 "酒吧" 无法区分
+_QUERY_FILLERS = re.compile(r'请问|有什么|有哪些|推荐一下')
+_TRAILING_FILLERS = re.compile(r'(?:的|吗|呢|啊|呀|地方|去处|推荐|攻略|一下)+$')
+_NON_WORD = re.compile(r'[\W_]+')
+_SENTENCE_END = re.compile(r'(?<=[。！？!?；;\n])')
+
+# 候选地点: 先在标点和常见的动词/虚词处切开，再保留以常见地点后缀结尾的片段；被引号/书名号括起来的名称也算
+_PLACE_SUFFIXES = ('海洋公园', '森林公园', '主题公园', '动物园', '植物园', '博物馆', '博物院', '美术馆', '纪念馆', '步行街',
+                   '风情街', '古镇', '古城', '老街', '夜市', '广场', '公园', '景区', '乐园', '寺', '塔', '岛', '湾', '湖', '山',
+                   '桥', '宫', '街', '巷', '巷子', '码头', '故居', '遗址', '草堂', '祠', '基地', '里', '路')
+_NAME_BREAKS = re.compile(r'[^一-鿿A-Za-z0-9·]+|的|有|是|很|逛|去|到|然后|游览|参观|前往|推荐|打卡|必去|还有|以及|包括|比如|例如|'
+                          r'其中|位于|晚上|傍晚|早上|上午|下午|中午|可以|适合|建议|第[一二三四五六七八九十\d]+天')
+_CONJUNCTION = re.compile(r'[和与及]')
+_QUOTED_PLACE = re.compile(r'[「《“"]([一-鿿A-Za-z0-9·]{2,12})[」》”"]')
+# 以这些词开头的片段是泛指，不是具体地点
+_GENERIC_PREFIXES = ('城市', '这个', '那个', '一个', '一些', '不少', '很多', '许多', '各种', '这里', '那里', '附近', '周边', '市区', '整个')
+MAX_CANDIDATE_PLACES = 12
+
+
+def normalize_query(query: str) -> str:
+    """查询词归一化(全角转半角、去标点空白、去口语成分)，作为搜索结果缓存的键。"""
+    text = _NON_WORD.sub('', unicodedata.normalize("NFKC", query).casefold())
+    normalized = _TRAILING_FILLERS.sub('', _QUERY_FILLERS.sub('', text))
+    return normalized or text
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """截取不超过 max_tokens 的最长前缀(以"…"结尾)；预算不够时返回空字符串。"""
+    if max_tokens < 2:
+        return ''
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) < max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + '…' if low else ''
+
+
+def _url_key(url: str) -> str:
+    parts = urlsplit(url or '')
+    return f"{parts.netloc.lower().removeprefix('www.')}{parts.path.rstrip('/')}"
+
+
+def _passages(content: str) -> List[str]:
+    return [passage.strip() for passage in _SENTENCE_END.split(content or '') if passage.strip()]
+
+
+def _is_place(piece: str) -> bool:
+    return piece.endswith(_PLACE_SUFFIXES)
+
+
+def _pieces(text: str) -> List[str]:
+    """切开后的片段；"A和B" 两边都像地点名称时再从连词处切开(不直接按 和/与/及 切，以免拆坏 "和平广场" 这样的名称)。"""
+    pieces = []
+    for piece in _NAME_BREAKS.split(text):
+        parts = _CONJUNCTION.split(piece)
+        if len(parts) > 1 and all(len(part) >= 2 and _is_place(part) for part in parts):
+            pieces += parts
+        else:
+            pieces.append(piece)
+    return pieces
+
+
+def extract_place_names(texts: Sequence[str], limit: int = MAX_CANDIDATE_PLACES) -> List[str]:
+    """从搜索结果中提取候选地点名称，按出现次数排序(同样次数时先出现的在前)。只是候选，坐标仍需 search_place_info 核实。"""
+    counts: Counter = Counter()
+    for text in texts:
+        for match in _QUOTED_PLACE.finditer(text):
+            counts[match.group(1)] += 2  # 引号括起来的名称更可信
+        for piece in _pieces(text):
+            if 3 <= len(piece) <= 12 and _is_place(piece) and not piece.startswith(_GENERIC_PREFIXES):
+                counts[piece] += 1
+    # 被更长的同类名称包含的片段(例如 "海广场" 之于 "星海广场")不单独列出
+    names = [name for name in counts if not any(name != other and name in other and counts[other] >= counts[name]
+                                                for other in counts)]
+    return sorted(names, key=lambda name: -counts[name])[:limit]
+
+
+def condense_results(results: Sequence[Dict[str, Any]], token_budget: int) -> Tuple[List[Dict[str, str]], List[str]]:
+    """
+    精简搜索结果: 去掉重复的URL，以及在多个结果之间重复的段落；再按 token_budget 截断，
+    每个结果轮流放入下一段，预算用完为止(而不是第一个结果独占预算)。
+    返回 (精简后的结果列表, 候选地点名称)。
+    """
+    seen_urls, seen_passages = set(), []
+    kept: List[Tuple[Dict[str, Any], List[str]]] = []
+    for result in results:
+        url_key = _url_key(result.get('url', ''))
+        if url_key and url_key in seen_urls:
+            continue
+        seen_urls.add(url_key)
+        unique = []
+        for passage in _passages(str(result.get('content', ''))):
+            key = _NON_WORD.sub('', passage)
+            if not key or any(key in other for other in seen_passages):
+                continue
+            seen_passages.append(key)
+            unique.append(passage)
+        if unique:
+            kept.append((result, unique))
+
+    places = extract_place_names([passage for _, passages in kept for passage in passages])
+    budget = token_budget
+    condensed = []
+    for result, _ in kept:
+        entry = {"title": str(result.get('title', '')), "url": str(result.get('url', '')), "content": ""}
+        budget -= estimate_tokens(entry["title"]) + estimate_tokens(entry["url"]) // 2
+        condensed.append(entry)
+    depth = 0
+    while budget > 0 and any(depth < len(passages) for _, passages in kept):
+        for entry, (_, passages) in zip(condensed, kept):
+            if depth < len(passages):
+                cost = estimate_tokens(passages[depth])
+                # 放不下的段落跳过，预算留给更短的段落和其他结果
+                if cost <= budget:
+                    entry["content"] += passages[depth]
+                    budget -= cost
+        depth += 1
+    # 第一段就超出预算的结果(例如没有中文句号的英文网页只会切出一段)平分剩余的预算，各截取第一段的开头
+    empty = [(entry, passages[0]) for entry, (_, passages) in zip(condensed, kept) if not entry["content"]]
+    for count, (entry, passage) in enumerate(empty):
+        entry["content"] = _truncate(passage, max(0, budget) // (len(empty) - count))
+        budget -= estimate_tokens(entry["content"])
+    return [entry for entry in condensed if entry["content"]], places
@@ -0,0 +1,24 @@
+# session_context.py (当前会话ID - 让进程内共享的工具知道自己在为哪个会话工作)
+
+import contextvars
+from contextlib import contextmanager
+
+DEFAULT_SESSION_ID = "default"
+
+# 工具函数由所有会话共享，需要按会话隔离的数据(路线几何、行程状态等)通过这个上下文变量找到所属会话。
+# contextvars 会随 asyncio 任务和 LangChain 的线程池调用一起传递。
+current_session_id: contextvars.ContextVar[str] = contextvars.ContextVar("session_id", default=DEFAULT_SESSION_ID)
+
+
+def get_session_id() -> str:
+    return current_session_id.get()
+
+
+@contextmanager
+def use_session(session_id: str):
+    """在 with 块内把当前会话ID设置为 session_id。"""
+    token = current_session_id.set(session_id)
+    try:
+        yield
+    finally:
+        current_session_id.reset(token)
@@ -0,0 +1,101 @@
+# single_flight.py (并发请求合并 - 同一时刻相同的上游请求只发一次，所有等待者共享结果)
+
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+from tracing import annotate
+
+T = TypeVar("T")
+
+
+class _LeaderCancelled(Exception):
+    """leader 被取消(例如它所在的页面被刷新)，等待者应当自己重新发起请求，而不是跟着失败。"""
+
+
+class SingleFlight:
+    """
+    按键合并进行中的请求: 第一个调用者(leader)真正发起请求，结果(或异常)交给同时到达的所有调用者。
+    同步调用(线程)和异步调用(任意事件循环)共用同一张表，彼此之间也能合并。请求结束后立即移除，不做缓存。
+    共享的结果对象是同一个，调用方不要修改它。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced": 0}
+
+    def _join(self, key: Hashable) -> Tuple[concurrent.futures.Future, bool]:
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                return future, False
+            future = self._flights[key] = concurrent.futures.Future()
+            self._stats["leaders"] += 1
+            return future, True
+
+    def _land(self, key: Hashable, future: concurrent.futures.Future, result: Any = None, error: BaseException = None):
+        with self._lock:
+            self._flights.pop(key, None)
+        if isinstance(error, asyncio.CancelledError):
+            future.set_exception(_LeaderCancelled())
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, fn: Callable[..., T], *args, **kwargs) -> T:
+        future, leader = self._join(key)
+        while not leader:
+            annotate(coalesced=1)
+            try:
+                return future.result()
+            except _LeaderCancelled:
+                future, leader = self._join(key)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._land(key, future, error=e)
+            raise
+        self._land(key, future, result)
+        return result
+
+    def follow(self, key: Hashable, fn: Callable[..., T], *args, **kwargs) -> T:
+        """
+        低优先级调用: 相同的请求正在进行时共享它的结果，否则自己直接执行，但不让别人等待自己
+        (例如后台预取随时可能因为让出配额而失败，不应该连累同时到达的前台请求)。
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+        if future is not None:
+            try:
+                return future.result()
+            except _LeaderCancelled:
+                pass
+        return fn(*args, **kwargs)
+
+    async def ado(self, key: Hashable, fn: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        future, leader = self._join(key)
+        while not leader:
+            annotate(coalesced=1)
+            try:
+                # shield: 某个等待者被取消时不影响 leader 和其他等待者
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _LeaderCancelled:
+                future, leader = self._join(key)
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            self._land(key, future, error=e)
+            raise
+        self._land(key, future, result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, inflight=len(self._flights))
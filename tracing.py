@@ -0,0 +1,227 @@
+# tracing.py (耗时追踪 - 每次LLM调用/工具调用的耗时、token、缓存命中、重试，写入滚动JSONL并支持p50/p95汇总)
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables.config import var_child_runnable_config
+
+from config import TRACE_LOG_PATH, TRACE_LOG_MAX_BYTES, TRACE_LOG_BACKUPS
+
+_trace_logger: Optional[logging.Logger] = None
+_logger_lock = threading.Lock()
+
+
+def _get_trace_logger() -> logging.Logger:
+    """JSONL 追踪日志: 每行一个 span，文件超过 TRACE_LOG_MAX_BYTES 后滚动。"""
+    global _trace_logger
+    with _logger_lock:
+        if _trace_logger is None:
+            os.makedirs(os.path.dirname(TRACE_LOG_PATH) or ".", exist_ok=True)
+            handler = RotatingFileHandler(TRACE_LOG_PATH, maxBytes=TRACE_LOG_MAX_BYTES,
+                                          backupCount=TRACE_LOG_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("trip_planner.trace")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _trace_logger = logger
+        return _trace_logger
+
+
+def _size(value: Any) -> int:
+    content = getattr(value, "content", value)
+    return len(content if isinstance(content, str) else str(content))
+
+
+def _token_usage(response) -> Dict[str, Optional[int]]:
+    """优先读取消息上的 usage_metadata，其次读取 llm_output 里的 token_usage(不同模型的字段名不同)。"""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return {"input_tokens": usage.get("input_tokens"), "output_tokens": usage.get("output_tokens")}
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return {"input_tokens": usage.get("input_tokens", usage.get("prompt_tokens")),
+            "output_tokens": usage.get("output_tokens", usage.get("completion_tokens"))}
+
+
+class TurnTracer(BaseCallbackHandler):
+    """
+    一轮对话的追踪器，作为 callbacks 传给 Agent。记录每次 LLM 调用和工具调用的起止时间、
+    输入/输出大小、token 数，以及工具内部通过 annotate() 上报的缓存命中、高德请求和重试次数。
+    """
+
+    # 在触发回调的线程/协程里同步执行，时间戳才准确
+    run_inline = True
+
+    def __init__(self, session_id: str = "", agent: str = ""):
+        self.session_id = session_id
+        self.agent = agent
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self._open: Dict[UUID, Dict[str, Any]] = {}
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self.wall_ms: Optional[float] = None
+        self.first_token_ms: Optional[float] = None  # 本轮第一个token出现的时刻(流式输出时用户开始看到文字)
+
+    def _start(self, run_id: UUID, kind: str, name: str, **fields):
+        with self._lock:
+            self._open[run_id] = {"kind": kind, "name": name, "start_ms": round((time.perf_counter() - self._t0) * 1000, 1),
+                                  "_t": time.perf_counter(), **fields}
+
+    def _end(self, run_id: UUID, **fields):
+        with self._lock:
+            span = self._open.pop(run_id, None)
+            if span is None:
+                return
+            span["wall_ms"] = round((time.perf_counter() - span.pop("_t")) * 1000, 1)
+            span.update(fields)
+            self.spans.append(span)
+
+    def annotate(self, run_id: UUID, values: Dict[str, Any]):
+        with self._lock:
+            span = self._open.get(run_id)
+            if span is None:
+                return
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    span[key] = span.get(key, 0) + value
+                else:
+                    span[key] = value
+
+    # --- LLM ---
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        name = (kwargs.get("metadata") or {}).get("ls_model_name") or (serialized or {}).get("name", "llm")
+        self._start(run_id, "llm", name, input_chars=sum(_size(m) for batch in messages for m in batch))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm", (serialized or {}).get("name", "llm"), input_chars=sum(len(p) for p in prompts))
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if not token:
+            return
+        elapsed = round((time.perf_counter() - self._t0) * 1000, 1)
+        with self._lock:
+            if self.first_token_ms is None:
+                self.first_token_ms = elapsed
+            span = self._open.get(run_id)
+            if span is not None and "first_token_ms" not in span:
+                span["first_token_ms"] = round((time.perf_counter() - span["_t"]) * 1000, 1)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        output_chars = sum(_size(getattr(g, "message", g.text)) for gens in response.generations for g in gens)
+        self._end(run_id, output_chars=output_chars, **_token_usage(response))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=str(error)[:200])
+
+    # --- 工具 ---
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, "tool", (serialized or {}).get("name") or kwargs.get("name", "tool"),
+                    input_chars=len(input_str or ""))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, output_chars=_size(output))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=str(error)[:200])
+
+    # --- 汇总 ---
+    def finish(self) -> Dict[str, Any]:
+        """结束本轮追踪: 写入JSONL追踪文件，并返回供界面展示的汇总。"""
+        self.wall_ms = round((time.perf_counter() - self._t0) * 1000, 1)
+        summary = self.summary()
+        try:
+            logger = _get_trace_logger()
+            base = {"ts": self.started, "session": self.session_id, "agent": self.agent}
+            for span in self.spans:
+                logger.info(json.dumps({**base, **span}, ensure_ascii=False))
+            logger.info(json.dumps({**base, "kind": "turn", "name": self.agent or "turn", "wall_ms": self.wall_ms,
+                                    "first_token_ms": self.first_token_ms,
+                                    "llm_calls": summary["llm"]["calls"], "tool_calls": summary["tool_calls"]},
+                                   ensure_ascii=False))
+        except OSError as e:
+            print(f"--- ⚠️ [tracing] 写入追踪文件失败: {e} ---")
+        return summary
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = list(self.spans)
+        llm = [s for s in spans if s["kind"] == "llm"]
+        tools: Dict[str, Dict[str, Any]] = {}
+        for span in (s for s in spans if s["kind"] == "tool"):
+            entry = tools.setdefault(span["name"], {"calls": 0, "wall_ms": 0.0, "max_ms": 0.0, "cache_hits": 0,
+                                                    "amap_requests": 0, "retries": 0, "coalesced": 0,
+                                                    "output_chars": 0})
+            entry["calls"] += 1
+            entry["wall_ms"] += span["wall_ms"]
+            entry["max_ms"] = max(entry["max_ms"], span["wall_ms"])
+            for key in ("cache_hits", "amap_requests", "retries", "coalesced", "output_chars"):
+                entry[key] += span.get(key, 0)
+        return {
+            "wall_ms": self.wall_ms,
+            "first_token_ms": self.first_token_ms,
+            "llm": {"calls": len(llm), "wall_ms": round(sum(s["wall_ms"] for s in llm), 1),
+                    "input_tokens": sum(s.get("input_tokens") or 0 for s in llm),
+                    "output_tokens": sum(s.get("output_tokens") or 0 for s in llm)},
+            "tool_calls": sum(entry["calls"] for entry in tools.values()),
+            "tools": tools,
+        }
+
+
+def annotate(**values):
+    """
+    在工具内部调用，把附加信息记到当前工具调用的 span 上(数值累加，其他值覆盖)。
+    例如 annotate(cache_hits=1)、annotate(retries=1)。不在追踪中运行时什么也不做。
+    """
+    config = var_child_runnable_config.get()
+    manager = (config or {}).get("callbacks")
+    run_id = getattr(manager, "parent_run_id", None)
+    if run_id is None:
+        return
+    for handler in getattr(manager, "handlers", []):
+        if isinstance(handler, TurnTracer):
+            handler.annotate(run_id, values)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def aggregate(path: str = TRACE_LOG_PATH) -> Dict[str, Dict[str, float]]:
+    """读取追踪文件(包括滚动出的旧文件)，按 (类型, 名称) 汇总调用次数和耗时的 p50/p95。"""
+    durations: Dict[str, List[float]] = {}
+    for file in sorted(glob.glob(f"{path}*")):
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("wall_ms") is not None:
+                    durations.setdefault(f"{record['kind']}:{record['name']}", []).append(record["wall_ms"])
+    return {key: {"count": len(values), "p50_ms": _percentile(values, 0.5), "p95_ms": _percentile(values, 0.95),
+                  "total_s": round(sum(values) / 1000, 1)}
+            for key, values in sorted(durations.items())}
+
+
+if __name__ == '__main__':
+    # 用法: python tracing.py [追踪文件路径]
+    import sys
+    stats = aggregate(sys.argv[1] if len(sys.argv) > 1 else TRACE_LOG_PATH)
+    if not stats:
+        print("没有找到追踪记录。")
+    print(f"{'名称':<40}{'次数':>8}{'p50(ms)':>12}{'p95(ms)':>12}{'合计(s)':>10}")
+    for key, row in stats.items():
+        print(f"{key:<40}{row['count']:>8}{row['p50_ms']:>12.1f}{row['p95_ms']:>12.1f}{row['total_s']:>10.1f}")
@@ -0,0 +1,178 @@
+# trip_spec.py (探索家 -> 规划师 的结构化交接数据: 解析、校验、注入规划师)
+
+import ast
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from itinerary_optimizer import parse_clock
+
+# 探索家最终摘要中各字段的中文标签
+_FIELD_LABELS = {
+    "城市": "city", "旅行天数": "days", "酒店": "hotel", "抵达": "arrival", "离开": "departure",
+    "必去地点": "spots", "指定餐厅": "restaurants", "夜间活动": "night_activities",
+}
+_FIELD_LINE = re.compile(r'^\s*[-*]\s*\*\*(?P<label>[^*]+)\*\*\s*[:：]\s*(?P<value>.*)$')
+_LOCATION = re.compile(r'^\s*(-?\d{1,3}(?:\.\d+)?)\s*,\s*(-?\d{1,2}(?:\.\d+)?)\s*$')
+
+
+class TripSpecError(ValueError):
+    """探索家的摘要缺少必要字段，或者其中的坐标格式不正确。"""
+
+
+@dataclass(frozen=True, slots=True)
+class PlaceRef:
+    name: str
+    location: str  # 已核实的 "经度,纬度"
+
+    @classmethod
+    def parse(cls, raw: Any, label: str) -> "PlaceRef":
+        if not isinstance(raw, dict) or not raw.get('name'):
+            raise TripSpecError(f"{label}: 无法识别的地点 {raw!r}")
+        match = _LOCATION.match(str(raw.get('location', '')))
+        if not match:
+            raise TripSpecError(f"{label}: 地点'{raw['name']}'的坐标不是'经度,纬度'格式: {raw.get('location')!r}")
+        lng, lat = float(match.group(1)), float(match.group(2))
+        if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+            raise TripSpecError(f"{label}: 地点'{raw['name']}'的坐标超出范围: {raw.get('location')!r}")
+        return cls(name=str(raw['name']).strip(), location=f"{lng},{lat}")
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"name": self.name, "location": self.location}
+
+
+@dataclass(frozen=True, slots=True)
+class StationVisit:
+    station: PlaceRef
+    time: Optional[str] = None  # 原始时间文本，例如 "2025-08-01 10:30"
+
+    @property
+    def minute_of_day(self) -> Optional[int]:
+        return parse_clock(self.time)
+
+    @classmethod
+    def parse(cls, raw: Any, label: str) -> "StationVisit":
+        if not isinstance(raw, dict) or 'station' not in raw:
+            raise TripSpecError(f"{label}: 需要包含 station 和 time 的字典，实际为 {raw!r}")
+        time = raw.get('time')
+        return cls(station=PlaceRef.parse(raw['station'], label), time=str(time).strip() if time else None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"station": self.station.to_dict(), "time": self.time}
+
+
+@dataclass(frozen=True, slots=True)
+class TripSpec:
+    city: str
+    days: int
+    hotel: PlaceRef
+    arrival: Optional[StationVisit] = None
+    departure: Optional[StationVisit] = None
+    spots: Tuple[PlaceRef, ...] = field(default_factory=tuple)
+    restaurants: Tuple[PlaceRef, ...] = field(default_factory=tuple)
+    night_activities: Tuple[PlaceRef, ...] = field(default_factory=tuple)
+
+    def places(self) -> List[PlaceRef]:
+        """所有已核实坐标的地点(酒店、车站、景点、餐厅、夜间活动)。"""
+        stations = [visit.station for visit in (self.arrival, self.departure) if visit is not None]
+        return [self.hotel, *stations, *self.spots, *self.restaurants, *self.night_activities]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """与 optimize_itinerary 的 trip_spec 参数格式一致，可以直接传给优化器。"""
+        return {
+            "city": self.city, "days": self.days, "hotel": self.hotel.to_dict(),
+            "arrival": self.arrival.to_dict() if self.arrival else None,
+            "departure": self.departure.to_dict() if self.departure else None,
+            "spots": [place.to_dict() for place in self.spots],
+            "restaurants": [place.to_dict() for place in self.restaurants],
+            "night_activities": [place.to_dict() for place in self.night_activities],
+        }
+
+    def to_prompt(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def from_dict(cls, data: Any) -> "TripSpec":
+        """to_dict() 的逆操作(例如规划服务收到的请求)，校验规则与解析摘要时相同。"""
+        if not isinstance(data, dict):
+            raise TripSpecError(f"需要一个字典，实际为 {data!r}")
+        try:
+            days = int(data.get('days'))
+        except (TypeError, ValueError):
+            raise TripSpecError(f"旅行天数无法识别: {data.get('days')!r}")
+        if not data.get('city') or days <= 0:
+            raise TripSpecError(f"城市或旅行天数无效: {data.get('city')!r}, {days}")
+
+        def place_list(key: str, label: str) -> Tuple[PlaceRef, ...]:
+            return tuple(PlaceRef.parse(item, label) for item in data.get(key) or [])
+
+        def station(key: str, label: str) -> Optional[StationVisit]:
+            return StationVisit.parse(data[key], label) if data.get(key) else None
+
+        return cls(
+            city=str(data['city']).strip(), days=days, hotel=PlaceRef.parse(data.get('hotel'), "酒店"),
+            arrival=station('arrival', "抵达"), departure=station('departure', "离开"),
+            spots=place_list('spots', "必去地点"), restaurants=place_list('restaurants', "指定餐厅"),
+            night_activities=place_list('night_activities', "夜间活动"),
+        )
+
+
+def _parse_value(text: str) -> Any:
+    """字段值可能是JSON，也可能是模型写成的Python字面量(单引号)或者被反引号包住。"""
+    text = text.strip().strip('`').strip()
+    if not text:
+        return None
+    for loader in (json.loads, ast.literal_eval):
+        try:
+            return loader(text)
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            # 例如 {[1]: 2} 在 literal_eval 中抛出 TypeError，嵌套过深时抛出 RecursionError: 都按原文处理
+            continue
+    return text
+
+
+def parse_explorer_summary(text: str) -> TripSpec:
+    """从探索家的最终摘要(“- **城市**: ...”格式)中解析出 TripSpec；缺少字段或坐标不合法时抛出 TripSpecError。"""
+    fields: Dict[str, Any] = {}
+    for line in text.splitlines():
+        match = _FIELD_LINE.match(line)
+        if match and match.group('label').strip() in _FIELD_LABELS:
+            fields[_FIELD_LABELS[match.group('label').strip()]] = _parse_value(match.group('value'))
+
+    missing = [label for label, key in _FIELD_LABELS.items() if key in ('city', 'days', 'hotel') and not fields.get(key)]
+    if missing:
+        raise TripSpecError(f"摘要缺少必要字段: {', '.join(missing)}")
+    days_match = re.search(r'\d+', str(fields['days']))
+    if not days_match or int(days_match.group()) <= 0:
+        raise TripSpecError(f"旅行天数无法识别: {fields['days']!r}")
+
+    def place_list(key: str, label: str) -> Tuple[PlaceRef, ...]:
+        value = fields.get(key) or []
+        if isinstance(value, dict):
+            value = [value]
+        if not isinstance(value, list):
+            raise TripSpecError(f"{label}: 需要一个列表，实际为 {value!r}")
+        return tuple(PlaceRef.parse(item, label) for item in value)
+
+    def station(key: str, label: str) -> Optional[StationVisit]:
+        return StationVisit.parse(fields[key], label) if fields.get(key) else None
+
+    return TripSpec(
+        city=str(fields['city']).strip(), days=int(days_match.group()),
+        hotel=PlaceRef.parse(fields['hotel'], "酒店"),
+        arrival=station('arrival', "抵达"), departure=station('departure', "离开"),
+        spots=place_list('spots', "必去地点"), restaurants=place_list('restaurants', "指定餐厅"),
+        night_activities=place_list('night_activities', "夜间活动"),
+    )
+
+
+def find_trip_spec(text: str) -> Optional[TripSpec]:
+    """在任意一段文本(探索家的回复或用户粘贴给规划师的内容)中查找摘要；没有或不完整时返回None。"""
+    if "**城市**" not in text:
+        return None
+    try:
+        return parse_explorer_summary(text)
+    except TripSpecError as e:
+        print(f"--- ⚠️ [trip_spec] 摘要无法解析: {e} ---")
+        return None